@@ -0,0 +1,115 @@
+"""
+File: conftest.py
+
+Description:
+    Pytest plugin that gates playbook performance in the same way as functional
+    failures. It provides the following:
+
+    1) A 'playbook_history' fixture, which is the local store of every measured
+       playbook run (.playbook_history.ndjson by default).
+    2) A 'playbook_performance' fixture. Calling its check() method waits for a
+       playbook run to finish, records its duration (submission to terminal
+       status) and the duration of each action, and then fails or warns if the
+       run is slower than the rolling p95 baseline by more than the margin.
+    3) A summary of every measured playbook at the end of the test session.
+
+    e.g.
+        def test_run_playbook(phantasm_instance, playbook_performance):
+            phantasm_instance.run_playbook("phantom-playbook/Create JIRA Ticket")
+            run = playbook_performance.check(phantasm_instance)
+            assert run['status'] == 'success'
+
+    Options:
+        --playbook-history      - The history file to record to and calculate the baselines from
+        --playbook-margin       - The fraction over the p95 baseline that is tolerated (default 0.2)
+        --playbook-regression   - Whether a regression should 'fail' the test, 'warn', or be ignored ('off')
+        --playbook-window       - The number of recent successful runs used for the baselines
+        --playbook-min-runs     - The number of runs needed before a baseline is enforced
+"""
+
+import warnings
+import pytest
+import phantasm
+
+
+class PlaybookRegressionWarning(UserWarning):
+    pass
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('phantasm', 'Phantom playbook performance')
+    group.addoption('--playbook-history', default='.playbook_history.ndjson', help='The history file of playbook run durations')
+    group.addoption('--playbook-margin', type=float, default=0.2, help='The fraction over the p95 baseline that is tolerated')
+    group.addoption('--playbook-regression', choices=['fail', 'warn', 'off'], default='fail', help='What to do when a playbook is slower than its baseline')
+    group.addoption('--playbook-window', type=int, default=20, help='The number of recent runs the baselines are calculated from')
+    group.addoption('--playbook-min-runs', type=int, default=5, help='The number of runs needed before a baseline is enforced')
+
+
+'''The history of playbook runs, shared by the whole session'''
+@pytest.fixture(scope='session')
+def playbook_history(request):
+    config = request.config
+    history = phantasm.playbookHistory(config.getoption('--playbook-history'), window=config.getoption('--playbook-window'))
+    config._playbook_runs = []
+    return history
+
+
+class playbookPerformance(object):
+    '''
+    Class: playbookPerformance
+
+    Description:
+    Measures playbook runs for a test, and compares them against the history.
+    '''
+    def __init__(self, history, config):
+        self._history = history
+        self._config = config
+
+    def check(self, phantasm_instance, playbook_id=None, interval=1, max_attempts=60):
+        '''
+        Function: check
+
+        Description:
+        Waits for a playbook run to finish, records it, and fails or warns the test if it has regressed.
+
+        Args:
+            phantasm_instance (phantasm)    - The instance that ran the playbook
+            (optional) playbook_id (str)    - The Phantom Playbook Run ID, by default the last playbook run by the instance
+            (optional) interval (int)       - The period between polling
+            (optional) max_attempts (int)   - The amount of times to poll
+
+        Returns:
+            (dict)                          - The run, as returned by wait_for_playbook
+        '''
+        run = phantasm_instance.wait_for_playbook(playbook_id, interval=interval, max_attempts=max_attempts)
+        regressions = self._history.check(run, margin=self._config.getoption('--playbook-margin'), min_runs=self._config.getoption('--playbook-min-runs'))
+        baseline = self._history.baseline(run['playbook'])
+        self._history.record(run)
+        self._config._playbook_runs.append((run, baseline, regressions))
+
+        mode = self._config.getoption('--playbook-regression')
+        if regressions and mode == 'fail':
+            pytest.fail('Playbook performance regression:\n    ' + '\n    '.join(regressions))
+        elif regressions and mode == 'warn':
+            for regression in regressions:
+                warnings.warn(regression, PlaybookRegressionWarning)
+        return run
+
+
+'''Measures playbook runs within a test'''
+@pytest.fixture
+def playbook_performance(request, playbook_history):
+    return playbookPerformance(playbook_history, request.config)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    runs = getattr(config, '_playbook_runs', [])
+    if not runs:
+        return
+    terminalreporter.section('playbook performance')
+    for run, baseline, regressions in runs:
+        if baseline['count']:
+            line = '{}: {:.2f}s ({}) - baseline p50 {:.2f}s, p95 {:.2f}s over {} runs'.format(run['playbook'], run['duration'] or 0, run['status'], baseline['p50'], baseline['p95'], baseline['count'])
+        else:
+            line = '{}: {:.2f}s ({}) - no baseline yet'.format(run['playbook'], run['duration'] or 0, run['status'])
+        terminalreporter.write_line(('REGRESSED ' if regressions else '') + line)
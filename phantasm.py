@@ -39,10 +39,38 @@ __maintainer__ = "sean@shadow.engineering"
 __email__ = "sean@shadow.engineering"
 
 import os, sys, csv
+import re
+import base64
+import hashlib
+import itertools
+import concurrent.futures
+import threading
+import configparser
+import functools
+import datetime
+import random
+import queue
+import collections
+import tempfile
+import atexit
+import cProfile
+import pstats
+import gc
+import bisect
+import fnmatch
+import zipfile
+import tarfile
+import contextlib
+import inspect
+from urllib.parse import quote, urlsplit, parse_qsl
 import json
 import requests
 import time
 import logging
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # Phantom uses self signed certificates, so need to disable warnings
 requests.packages.urllib3.disable_warnings()
@@ -50,6 +78,11 @@ requests.packages.urllib3.disable_warnings()
 # Setting up a Debug Logger
 logger = logging.getLogger(__name__)
 
+# Parsed configuration and pooled sessions, shared by every instance of the class
+_configurations = {}
+_sessions = {}
+_shared_lock = threading.Lock()
+
 
 """
 Custom Exception Handling
@@ -57,18 +90,2180 @@ Custom Exception Handling
 class phantomException(Exception):
     pass
 
-class containerException(phantomException):
-    pass
+class containerException(phantomException):
+    pass
+
+class artifactException(containerException):
+    pass
+
+class playbookException(containerException):
+    pass
+
+class actionException(containerException):
+    pass
+
+class deadlineException(phantomException):
+    pass
+
+
+"""
+Streaming JSON Parsing
+"""
+class _jsonStreamReader(object):
+    '''
+    Class: _jsonStreamReader
+
+    Description:
+    Walks a JSON document that is read incrementally from an iterable of byte chunks (e.g. response.iter_content()).
+    Values can be decoded or skipped one at a time, so only the value currently being decoded is held in memory.
+
+    Args:
+        chunks (iterable)               - An iterable of bytes that together make up the JSON document
+    '''
+    _whitespace = re.compile(rb'[^ \t\r\n]')
+    _string_special = re.compile(rb'["\\]')
+    _token = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|"|[\[\]{}]', re.S)
+    _scalar_end = re.compile(rb'[,\]} \t\r\n]')
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._position = 0
+        self._mark = None
+        self._eof = False
+
+    def _fill(self):
+        '''
+        Function: _fill
+
+        Description:
+        Reads the next chunk into the buffer, discarding anything already consumed that isn't part of a value being captured.
+
+        Returns:
+            (bool)                          - False if the stream has been exhausted
+        '''
+        discard = self._position if self._mark is None else self._mark
+        if discard:
+            del self._buffer[:discard]
+            self._position -= discard
+            if self._mark is not None:
+                self._mark -= discard
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer += chunk
+                return True
+        self._eof = True
+        return False
+
+    def _search(self, pattern):
+        '''
+        Function: _search
+
+        Description:
+        Searches the buffer from the current position for a pattern, reading further chunks until it matches or the stream ends.
+
+        Returns:
+            (int)                           - The offset of the match, or None if the stream ended first
+        '''
+        position = self._position
+        while True:
+            match = pattern.search(self._buffer, position)
+            if match:
+                return match.start()
+            position = len(self._buffer) - self._position
+            if not self._fill():
+                return None
+            position += self._position
+
+    def peek(self):
+        '''
+        Function: peek
+
+        Description:
+        Skips whitespace and returns the next significant character without consuming it.
+
+        Returns:
+            (bytes)                         - The next character, or b'' at the end of the stream
+        '''
+        offset = self._search(self._whitespace)
+        if offset is None:
+            self._position = len(self._buffer)
+            return b''
+        self._position = offset
+        return bytes(self._buffer[offset:offset + 1])
+
+    def expect(self, characters):
+        '''
+        Function: expect
+
+        Description:
+        Consumes the next significant character, which must be one of the characters provided.
+
+        Returns:
+            (bytes)                         - The character that was consumed
+        '''
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError('Malformed JSON: expected one of {} but found {}'.format(characters, character))
+        self._position += 1
+        return character
+
+    def _skip_string(self):
+        self._position += 1
+        while True:
+            offset = self._search(self._string_special)
+            if offset is None:
+                raise ValueError('Malformed JSON: unterminated string')
+            if self._buffer[offset:offset + 1] == b'"':
+                self._position = offset + 1
+                return
+            self._position = offset
+            while self._position + 2 > len(self._buffer):
+                if not self._fill():
+                    raise ValueError('Malformed JSON: unterminated string')
+            self._position += 2
+
+    def skip_value(self):
+        '''
+        Function: skip_value
+
+        Description:
+        Consumes the next value without decoding it.
+        '''
+        character = self.peek()
+        if character == b'"':
+            self._skip_string()
+        elif character in (b'{', b'['):
+            depth = 0
+            while True:
+                unterminated = None
+                for match in self._token.finditer(self._buffer, self._position):
+                    token = self._buffer[match.start()]
+                    if token == 0x22:
+                        if match.end() - match.start() == 1:
+                            unterminated = match.start()
+                            break
+                        continue
+                    depth += 1 if token in (0x5b, 0x7b) else -1
+                    if depth == 0:
+                        self._position = match.end()
+                        return
+                if unterminated is not None:
+                    # The string continues past the end of the buffer, so read it incrementally
+                    self._position = unterminated
+                    self._skip_string()
+                    continue
+                self._position = len(self._buffer)
+                if not self._fill():
+                    raise ValueError('Malformed JSON: unterminated {}'.format(character))
+        elif character:
+            offset = self._search(self._scalar_end)
+            self._position = len(self._buffer) if offset is None else offset
+        else:
+            raise ValueError('Malformed JSON: unexpected end of stream')
+
+    def read_value(self):
+        '''
+        Function: read_value
+
+        Description:
+        Consumes and decodes the next value.
+
+        Returns:
+            (object)                        - The decoded JSON value
+        '''
+        self.peek()
+        self._mark = self._position
+        try:
+            self.skip_value()
+            return json.loads(self._buffer[self._mark:self._position])
+        finally:
+            self._mark = None
+
+    def iter_object(self):
+        '''
+        Function: iter_object
+
+        Description:
+        Iterates the keys of the next object. The caller must consume each value (read_value or skip_value) before advancing.
+
+        Returns:
+            (generator)                     - The keys of the object
+        '''
+        self.expect(b'{')
+        if self.peek() == b'}':
+            self._position += 1
+            return
+        while True:
+            self.peek()
+            key = self.read_value()
+            self.expect(b':')
+            yield key
+            if self.expect(b',}') == b'}':
+                return
+
+    def iter_array(self):
+        '''
+        Function: iter_array
+
+        Description:
+        Iterates the indexes of the next array. The caller must consume each value (read_value or skip_value) before advancing.
+
+        Returns:
+            (generator)                     - The indexes of the array
+        '''
+        self.expect(b'[')
+        if self.peek() == b']':
+            self._position += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self.expect(b',]') == b']':
+                return
+
+    def iter_items(self, key='data', meta=None, fields=None):
+        '''
+        Function: iter_items
+
+        Description:
+        Yields each item of an array held under a top-level key (e.g. the 'data' array of a Phantom listing), decoding one item at a time.
+
+        Args:
+            (optional) key (str)            - The top-level key holding the array, defaults to 'data'
+            (optional) meta (dict)          - If provided, is populated with the other top-level fields (e.g. count, num_pages)
+            (optional) fields (set)         - If provided, only these fields of each item are kept
+
+        Returns:
+            (generator)                     - The decoded items of the array
+        '''
+        for name in self.iter_object():
+            if name == key and self.peek() == b'[':
+                for _ in self.iter_array():
+                    item = self.read_value()
+                    if fields is not None and isinstance(item, dict):
+                        # Decoding the whole item in C is quicker than walking it key by key, and it is dropped straight away
+                        item = dict((field, item[field]) for field in fields if field in item)
+                    yield item
+            elif meta is not None:
+                meta[name] = self.read_value()
+            else:
+                self.skip_value()
+
+
+"""
+Result Extraction
+"""
+class jsonPath(object):
+    '''
+    Class: jsonPath
+
+    Description:
+    A JSONPath-like path, compiled once, that pulls values out of a parsed response or out of the raw bytes of a response as they stream. When streaming, only the values the path selects are decoded, and everything else is skipped without building the object tree, which suits asserting on a few fields of large app run results.
+
+    Paths are a sequence of steps, optionally starting with $: .name or ['name'] selects a key, [0] selects an index (negative indexes count from the end), and .* or [*] selects every value of an object or array.
+
+    e.g.
+        status = phantasm.jsonPath('data[0].result_data[0].data[*].status')
+        status.find(response_json)                          # ['open']
+        status.find_stream(response.iter_content(65536))    # ['open'], without decoding the rest of the response
+
+    Args:
+        path (str)                      - The path to compile
+    '''
+    _step = re.compile(r'''\.?(?:(\*)|([^.\[\]'"]+))|\[(?:(\*)|(-?\d+)|'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)")\]''')
+    _wildcard = ('*',)
+
+    def __init__(self, path):
+        self.path = path
+        steps = []
+        position = 1 if path.startswith('$') else 0
+        while position < len(path):
+            match = self._step.match(path, position)
+            if not match or match.end() == position:
+                raise phantomException('Invalid path {}: unexpected {}'.format(path, path[position:]))
+            wildcard, name, bracket_wildcard, index, single_quoted, double_quoted = match.groups()
+            if wildcard or bracket_wildcard:
+                steps.append(self._wildcard)
+            elif index is not None:
+                steps.append(('index', int(index)))
+            else:
+                quoted = single_quoted if single_quoted is not None else double_quoted
+                steps.append(('key', name if quoted is None else re.sub(r'\\(.)', r'\1', quoted)))
+            position = match.end()
+        self.steps = tuple(steps)
+
+    def __repr__(self):
+        return 'jsonPath({!r})'.format(self.path)
+
+    @staticmethod
+    def _find(value, steps):
+        values = [value]
+        for step in steps:
+            selected = []
+            for value in values:
+                if step is jsonPath._wildcard:
+                    if isinstance(value, dict):
+                        selected.extend(value.values())
+                    elif isinstance(value, list):
+                        selected.extend(value)
+                elif step[0] == 'key':
+                    if isinstance(value, dict) and step[1] in value:
+                        selected.append(value[step[1]])
+                elif isinstance(value, list) and -len(value) <= step[1] < len(value):
+                    selected.append(value[step[1]])
+            values = selected
+        return values
+
+    @staticmethod
+    def _walk(reader, states, results):
+        '''
+        Function: _walk
+
+        Description:
+        Walks the next value of a stream for several paths at once, descending only into the keys and indexes a path selects. A value is decoded once a path selects it whole, or when a negative index means the whole array is needed.
+
+        Args:
+            reader (_jsonStreamReader)      - The stream, positioned at the value
+            states (list)                   - The result key and remaining steps of each path that reached the value
+            results (dict)                  - The lists the selected values are added to
+        '''
+        if any(not steps or (steps[0][0] == 'index' and steps[0][1] < 0) for _, steps in states):
+            value = reader.read_value()
+            for key, steps in states:
+                results[key].extend(jsonPath._find(value, steps))
+            return
+        character = reader.peek()
+        if character == b'{':
+            for name in reader.iter_object():
+                step = ('key', name)
+                selected = [(key, steps[1:]) for key, steps in states if steps[0] is jsonPath._wildcard or steps[0] == step]
+                if selected:
+                    jsonPath._walk(reader, selected, results)
+                else:
+                    reader.skip_value()
+        elif character == b'[':
+            for index in reader.iter_array():
+                step = ('index', index)
+                selected = [(key, steps[1:]) for key, steps in states if steps[0] is jsonPath._wildcard or steps[0] == step]
+                if selected:
+                    jsonPath._walk(reader, selected, results)
+                else:
+                    reader.skip_value()
+        else:
+            reader.skip_value()
+
+    def find(self, document):
+        '''
+        Function: find
+
+        Description:
+        Applies the path to a parsed document (e.g. response.json()).
+
+        Args:
+            document (object)               - The parsed JSON
+
+        Returns:
+            (list)                          - The selected values, in document order
+        '''
+        return self._find(document, self.steps)
+
+    def first(self, document, default=None):
+        '''
+        Function: first
+
+        Description:
+        Applies the path to a parsed document, returning the first value selected.
+
+        Args:
+            document (object)               - The parsed JSON
+            (optional) default (object)     - Returned if nothing is selected
+
+        Returns:
+            (object)                        - The first selected value
+        '''
+        values = self._find(document, self.steps)
+        return values[0] if values else default
+
+    def find_stream(self, chunks):
+        '''
+        Function: find_stream
+
+        Description:
+        Applies the path to the raw bytes of a JSON document, decoding only the values it selects.
+
+        Args:
+            chunks (iterable)               - The bytes of the document, or an iterable of chunks (e.g. response.iter_content())
+
+        Returns:
+            (list)                          - The selected values, in document order
+        '''
+        return self.find_all_stream({self.path: self}, chunks)[self.path]
+
+    @staticmethod
+    def find_all(paths, document):
+        '''
+        Function: find_all
+
+        Description:
+        Applies several paths to a parsed document.
+
+        Args:
+            paths (dict)                    - Names mapped to the paths (a jsonPath or a path string) to apply
+            document (object)               - The parsed JSON
+
+        Returns:
+            (dict)                          - The names mapped to the values each path selected
+        '''
+        return dict((key, (path if isinstance(path, jsonPath) else jsonPath(path)).find(document)) for key, path in paths.items())
+
+    @staticmethod
+    def find_all_stream(paths, chunks):
+        '''
+        Function: find_all_stream
+
+        Description:
+        Applies several paths to the raw bytes of a JSON document in a single pass, decoding only the values they select.
+
+        Args:
+            paths (dict)                    - Names mapped to the paths (a jsonPath or a path string) to apply
+            chunks (iterable)               - The bytes of the document, or an iterable of chunks (e.g. response.iter_content())
+
+        Returns:
+            (dict)                          - The names mapped to the values each path selected
+        '''
+        if isinstance(chunks, (bytes, bytearray)):
+            chunks = [chunks]
+        states = [(key, (path if isinstance(path, jsonPath) else jsonPath(path)).steps) for key, path in paths.items()]
+        results = dict((key, []) for key in paths)
+        if states:
+            jsonPath._walk(_jsonStreamReader(chunks), states, results)
+        return results
+
+
+"""
+Query Filters
+"""
+class Q(object):
+    '''
+    Class: Q
+
+    Description:
+    A server side filter for a Phantom REST query. Each keyword is a field, optionally followed by a lookup (e.g. status="failed", name__icontains="jira", id__in=[1, 2], create_time__range=("2019-03-11", "2019-04-11")). Filters are combined with & and excluded with ~, and compile into the _filter_ and _exclude_ query string parameters.
+
+    e.g.    Q(status="failed") & Q(create_time__range=(start_date, end_date)) & ~Q(label="test")
+
+    Args:
+        conditions (kwargs)             - The field lookups and the values to filter on
+    '''
+    __slots__ = ('_conditions',)
+
+    def __init__(self, **conditions):
+        self._conditions = tuple(sorted(('_filter_', field, self._freeze(value)) for field, value in conditions.items()))
+
+    @classmethod
+    def _from_conditions(cls, conditions):
+        combined = cls()
+        combined._conditions = tuple(conditions)
+        return combined
+
+    @staticmethod
+    def _freeze(value):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return tuple(Q._freeze(item) for item in value)
+        return value
+
+    def __and__(self, other):
+        if other is None:
+            return self
+        if not isinstance(other, Q):
+            return NotImplemented
+        return Q._from_conditions(self._conditions + other._conditions)
+
+    __rand__ = __and__
+
+    def __invert__(self):
+        if any(prefix != '_filter_' for prefix, _, _ in self._conditions):
+            raise ValueError('Only plain filters can be excluded')
+        return Q._from_conditions(('_exclude_', field, value) for _, field, value in self._conditions)
+
+    def __eq__(self, other):
+        return isinstance(other, Q) and self._conditions == other._conditions
+
+    def __hash__(self):
+        return hash(self._conditions)
+
+    def __bool__(self):
+        return bool(self._conditions)
+
+    def __repr__(self):
+        return 'Q({})'.format(self.compile())
+
+    def compile(self):
+        '''
+        Function: compile
+
+        Description:
+        Compiles the filter into its query string. Compiled filters are cached, so filters that are reused (or rebuilt with the same values) are only compiled once.
+
+        Returns:
+            (str)                           - The query string parameters, e.g. '_filter_status="failed"'
+        '''
+        return _compile_conditions(self._conditions)
+
+def _encode_filter_value(value):
+    '''
+    Function: _encode_filter_value
+
+    Description:
+    Encodes a filter value the way Phantom parses it: strings and dates are double quoted, booleans and None are the Python literals, and lists become [..].
+    '''
+    if isinstance(value, bool) or value is None:
+        return repr(value)
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return json.dumps(value.isoformat())
+    if isinstance(value, tuple):
+        return '[{}]'.format(','.join(_encode_filter_value(item) for item in value))
+    return json.dumps(str(value))
+
+@functools.lru_cache(maxsize=1024)
+def _compile_conditions(conditions):
+    return '&'.join('{}{}={}'.format(prefix, field, quote(_encode_filter_value(value), safe='[],:')) for prefix, field, value in conditions)
+
+
+"""
+Timelines and Traces
+"""
+def _parse_time(value):
+    '''
+    Function: _parse_time
+
+    Description:
+    Converts a Phantom timestamp (e.g. 2019-11-15T01:02:03.123456Z) to seconds since the epoch.
+
+    Returns:
+        (float)                         - The seconds since the epoch, or None if there is no timestamp
+    '''
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = value.replace('Z', '+00:00')
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        parsed = datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+def _trace_event(name, category, start, duration, process, thread, args=None):
+    '''
+    Function: _trace_event
+
+    Description:
+    Builds a complete ('X') event in the Chrome trace event format, converting seconds to microseconds.
+    '''
+    event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start * 1000000, 'dur': duration * 1000000, 'pid': process, 'tid': thread}
+    if args:
+        event['args'] = args
+    return event
+
+def _write_chrome_trace(events, file_name):
+    '''
+    Function: _write_chrome_trace
+
+    Description:
+    Writes trace events to a file in the Chrome trace format, which can be opened in chrome://tracing, Perfetto or speedscope.
+    '''
+    with open(file_name, 'w') as trace_file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+class spanTracer(object):
+    '''
+    Class: spanTracer
+
+    Description:
+    Records spans of wall-clock time locally, without any external collector. When an instance of the class is given a tracer, each public method opens a span, and each HTTP request and each sleep between polls opens a child span within it, so the time of a compound call (e.g. get_jira_ticket_data) can be broken down. Spans are exported in the Chrome trace format, which can be opened in chrome://tracing, Perfetto or speedscope. A tracer can be shared between instances and threads.
+
+    Args:
+        (optional) max_spans (int)      - The number of most recent spans kept. Older spans are dropped, and counted in dropped.
+    '''
+    def __init__(self, max_spans=100000):
+        self._spans = collections.deque(maxlen=max_spans)
+        self._local = threading.local()
+        self.dropped = 0
+
+    def _add(self, event):
+        if len(self._spans) == self._spans.maxlen:
+            self.dropped += 1
+        self._spans.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category='method', **args):
+        '''
+        Function: span
+
+        Description:
+        Times the block within it as a span, nested within the span currently open on the thread. The dictionary it yields can be used to add arguments to the span.
+        '''
+        stack = self._local.__dict__.setdefault('stack', [])
+        if stack:
+            args['parent'] = stack[-1]
+        stack.append(name)
+        start = time.time()
+        try:
+            yield args
+        except Exception as span_error:
+            args['error'] = repr(span_error)
+            raise
+        finally:
+            stack.pop()
+            self._add(_trace_event(name, category, start, time.time() - start, os.getpid(), threading.get_ident(), args))
+
+    def events(self):
+        '''Returns the recorded spans, as Chrome trace events'''
+        return list(self._spans)
+
+    def write(self, file_name):
+        '''Writes the recorded spans to a Chrome trace file'''
+        _write_chrome_trace(self.events(), file_name)
+
+    def clear(self):
+        '''Drops every recorded span'''
+        self._spans.clear()
+        self.dropped = 0
+
+    def record(self, name, category, start, duration, **args):
+        '''Records a span that was timed elsewhere (e.g. the iteration of a generator)'''
+        self._add(_trace_event(name, category, start, duration, os.getpid(), threading.get_ident(), args))
+
+class _soakTracer(spanTracer):
+    '''
+    Class: _soakTracer
+
+    Description:
+    The tracer run_soak_test installs. Rather than keeping the spans, which a long window could overflow, it adds the duration of each to the window in progress: per method, and for the HTTP requests together.
+    '''
+    def __init__(self):
+        spanTracer.__init__(self, max_spans=0)
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def _add(self, event):
+        category = 'requests' if event['cat'] == 'http' else event['name'] if event['cat'] == 'method' else None
+        if category:
+            with self._lock:
+                self._durations.setdefault(category, []).append(event['dur'] / 1000000.0)
+
+    def take(self):
+        '''Returns the durations (in seconds) recorded since the last call, by method name, with the HTTP requests under requests'''
+        with self._lock:
+            durations, self._durations = self._durations, {}
+        return durations
+
+def _instrumented(function):
+    '''
+    Function: _instrumented
+
+    Description:
+    Wraps a public method of the class so that it opens a span when the instance has a tracer, is profiled when the instance has a profiler, and accepts a timeout_budget keyword (see deadline). Without any of them the method is called directly. When the method returns a generator (e.g. get_containers(stream=True)), its iteration is instrumented as well (see _instrumented_iteration).
+    '''
+    if inspect.isgeneratorfunction(function):
+        # Calling a generator function does no work, so only its iteration is instrumented
+        @functools.wraps(function)
+        def instrumented_generator(self, *args, **kwargs):
+            timeout_budget = kwargs.pop('timeout_budget', None)
+            with deadline(timeout_budget) if timeout_budget is not None else _no_span:
+                current = getattr(_deadline_state, 'deadline', None)
+            generator = function(self, *args, **kwargs)
+            if self._tracer is None and self._profiler is None and current is None:
+                return generator
+            return _instrumented_iteration(function.__name__, generator, self._tracer, self._profiler, current)
+        return instrumented_generator
+
+    @functools.wraps(function)
+    def instrumented(self, *args, **kwargs):
+        timeout_budget = kwargs.pop('timeout_budget', None)
+        with deadline(timeout_budget) if timeout_budget is not None else _no_span:
+            tracer = self._tracer
+            profiler = self._profiler
+            if tracer is None and profiler is None:
+                result = function(self, *args, **kwargs)
+            else:
+                with tracer.span(function.__name__, 'method') if tracer is not None else _no_span, profiler.call(function.__name__) if profiler is not None else _no_span:
+                    result = function(self, *args, **kwargs)
+            current = getattr(_deadline_state, 'deadline', None)
+            if not inspect.isgenerator(result) or (tracer is None and profiler is None and current is None):
+                return result
+            return _instrumented_iteration(function.__name__, result, tracer, profiler, current, counted=True)
+    return instrumented
+
+def _instrumented_iteration(name, generator, tracer, profiler, carried, counted=False):
+    '''
+    Function: _instrumented_iteration
+
+    Description:
+    Wraps a generator returned by a public method, which only does its work as it is iterated, after the call has returned. Each step runs under the deadline the call was made with, and is profiled as part of the method. The whole iteration is recorded as one span, whose busy argument is the time spent producing items rather than waiting on the consumer.
+
+    Args:
+        name (str)                      - The name of the method
+        generator (generator)           - The generator it returned
+        tracer (spanTracer)             - The tracer of the instance, or None
+        profiler (methodProfiler)       - The profiler of the instance, or None
+        carried (tuple)                 - The deadline the call was made under, or None
+        (optional) counted (bool)       - Whether the profiler has already counted the call
+
+    Returns:
+        (generator)                     - The items of the generator
+    '''
+    started = None
+    busy = 0.0
+    items = 0
+    args = {'iteration': True}
+    try:
+        while True:
+            previous = getattr(_deadline_state, 'deadline', None)
+            if carried is not None and (previous is None or carried[0] < previous[0]):
+                _deadline_state.deadline = carried
+            step_started = time.time()
+            if started is None:
+                started = step_started
+            try:
+                with profiler.call(name, count=not (items or counted)) if profiler is not None else _no_span:
+                    item = next(generator)
+            except StopIteration:
+                return
+            except Exception as iteration_error:
+                args['error'] = repr(iteration_error)
+                raise
+            finally:
+                _deadline_state.deadline = previous
+                busy += time.time() - step_started
+            items += 1
+            yield item
+    finally:
+        generator.close()
+        if tracer is not None and started is not None:
+            args.update(items=items, busy=busy)
+            tracer.record(name, 'method', started, time.time() - started, **args)
+
+
+"""
+Profiling
+"""
+class methodProfiler(object):
+    '''
+    Class: methodProfiler
+
+    Description:
+    Profiles the public methods of the class, splitting the time of each into client-side CPU (e.g. JSON encoding and decoding, building URLs, base64 encoding uploads) and waiting (on Phantom, the network or sleeps between polls). CPU time is measured per thread, so work a method hands to worker threads counts as waiting. The CPU/wait split is kept for every method, including nested calls. In 'cprofile' mode the outermost call of each thread also runs under cProfile. In 'sampling' mode a background thread samples the stack of those calls every interval while any are in progress, which costs less for long runs. The hottest functions of each method are listed alongside the split. A summary is written when the interpreter exits, and a profiler can be shared between instances and threads.
+
+    e.g.
+        ph = phantasm.phantasm(profiler=phantasm.methodProfiler('cprofile', output_file='profile.txt'))
+        PHANTASM_PROFILE=sampling PHANTASM_PROFILE_FILE=profile.txt pytest
+
+    Args:
+        (optional) mode (str)           - 'timing' only splits the time, 'cprofile' also profiles calls deterministically, and 'sampling' samples their stacks
+        (optional) output_file (str)    - The file the summary is written to at exit, standard error if None
+        (optional) interval (float)     - The period between stack samples in sampling mode
+        (optional) top (int)            - The number of hottest functions listed for each method
+        (optional) at_exit (bool)       - Whether to write the summary when the interpreter exits
+    '''
+    _modes = ('timing', 'cprofile', 'sampling')
+
+    def __init__(self, mode='timing', output_file=None, interval=0.005, top=10, at_exit=True):
+        if mode not in self._modes:
+            raise phantomException('Unknown profiling mode {}, expected one of {}'.format(mode, ', '.join(self._modes)))
+        self.mode = mode
+        self._output_file = output_file
+        self._interval = interval
+        self._top = top
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._methods = {}
+        self._profiles = {}
+        self._samples = {}
+        self._active = {}
+        self._sampler = None
+        self._stopped = threading.Event()
+        if at_exit:
+            atexit.register(self.write)
+
+    @contextlib.contextmanager
+    def call(self, name, count=True):
+        '''
+        Function: call
+
+        Description:
+        Profiles the block within it as a call of a method. Only the outermost call of a thread is profiled or sampled, as a thread can only run one profiler at a time. The steps of a generator's iteration are profiled as part of the call that returned it, so only the first is counted as a call.
+        '''
+        outermost = not getattr(self._local, 'depth', 0)
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        profile = None
+        if outermost and self.mode == 'cprofile':
+            profiles = self._local.__dict__.setdefault('profiles', {})
+            profile = profiles.get(name)
+            if profile is None:
+                profile = profiles[name] = cProfile.Profile()
+                with self._lock:
+                    self._profiles.setdefault(name, []).append(profile)
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger or coverage) is already active on this thread
+                profile = None
+        elif outermost and self.mode == 'sampling':
+            with self._lock:
+                self._active[threading.get_ident()] = name
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample, name='phantasm-profiler', daemon=True)
+                    self._sampler.start()
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            cpu = time.thread_time() - cpu_started
+            wall = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+            if outermost and self.mode == 'sampling':
+                with self._lock:
+                    self._active.pop(threading.get_ident(), None)
+            self._local.depth -= 1
+            with self._lock:
+                totals = self._methods.setdefault(name, [0, 0.0, 0.0])
+                totals[0] += 1 if count else 0
+                totals[1] += wall
+                totals[2] += min(cpu, wall)
+
+    def _sample(self):
+        # Counts the function each profiled call is executing at every interval, until no calls are left in progress
+        while not self._stopped.wait(self._interval):
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            for thread, name in active:
+                frame = frames.get(thread)
+                if frame is None:
+                    continue
+                function = '{}:{}({})'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_firstlineno, frame.f_code.co_name)
+                with self._lock:
+                    self._samples.setdefault(name, collections.Counter())[function] += 1
+
+    def stats(self):
+        '''
+        Function: stats
+
+        Description:
+        Reports the time of each method, split into client-side CPU and waiting.
+
+        Returns:
+            (dict)                          - The calls, wall, cpu and wait seconds, and cpu share of each method
+        '''
+        with self._lock:
+            methods = dict((name, list(totals)) for name, totals in self._methods.items())
+        return dict((name, {'calls': calls, 'wall': wall, 'cpu': cpu, 'wait': wall - cpu, 'cpu_share': cpu / wall if wall else None}) for name, (calls, wall, cpu) in methods.items())
+
+    def _hottest(self, name):
+        '''
+        Function: _hottest
+
+        Description:
+        Lists the functions a method spent most of its own time in, from its cProfile profiles or its stack samples.
+
+        Returns:
+            (list)                          - Descriptions of the hottest functions
+        '''
+        with self._lock:
+            profiles = list(self._profiles.get(name, []))
+            samples = collections.Counter(self._samples.get(name, {}))
+        if profiles:
+            profile_stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                profile_stats.add(profile)
+            hottest = sorted(profile_stats.stats.items(), key=lambda entry: entry[1][2], reverse=True)[:self._top]
+            return ['{:10.4f}s  {}:{}({})'.format(timings[2], os.path.basename(function[0]), function[1], function[2]) for function, timings in hottest]
+        total = sum(samples.values())
+        return ['{:10.1%}   {}'.format(count / total, function) for function, count in samples.most_common(self._top)]
+
+    def summary(self):
+        '''
+        Function: summary
+
+        Description:
+        Formats the time of each method, most client-side CPU first, with the hottest functions of each in cprofile and sampling modes.
+
+        Returns:
+            (str)                           - The summary
+        '''
+        stats = self.stats()
+        lines = ['phantasm profile ({})'.format(self.mode), '{:<40} {:>8} {:>10} {:>10} {:>10} {:>6}'.format('method', 'calls', 'wall (s)', 'cpu (s)', 'wait (s)', 'cpu %')]
+        ordered = sorted(stats.items(), key=lambda entry: entry[1]['cpu'], reverse=True)
+        for name, method in ordered:
+            lines.append('{:<40} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>6.1%}'.format(name, method['calls'], method['wall'], method['cpu'], method['wait'], method['cpu_share'] or 0))
+        if self.mode != 'timing':
+            for name, _ in ordered:
+                hottest = self._hottest(name)
+                if hottest:
+                    lines.append('')
+                    lines.append('{} - {}'.format(name, 'own time' if self.mode == 'cprofile' else 'samples'))
+                    lines.extend('    ' + function for function in hottest)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_name=None):
+        '''
+        Function: write
+
+        Description:
+        Stops sampling and writes the summary, if any method was profiled.
+
+        Args:
+            (optional) file_name (str)      - The file to write to, defaults to the output file of the profiler (or standard error)
+        '''
+        self._stopped.set()
+        if not self._methods:
+            return
+        file_name = file_name or self._output_file
+        if file_name:
+            with open(file_name, 'w') as summary_file:
+                summary_file.write(self.summary())
+        else:
+            sys.stderr.write(self.summary())
+
+_profilers = {}
+
+def _shared_profiler(mode, output_file=None):
+    '''
+    Function: _shared_profiler
+
+    Description:
+    Returns the profiler for a mode and output file, creating it the first time, so instances created with phantasm(profiler=<mode>) (e.g. in a function scoped pytest fixture) add to one summary rather than writing one each.
+
+    Returns:
+        (methodProfiler)                - The shared profiler
+    '''
+    key = (mode, output_file)
+    with _shared_lock:
+        profiler = _profilers.get(key)
+        if profiler is None:
+            profiler = _profilers[key] = methodProfiler(mode, output_file, at_exit=False)
+    return profiler
+
+def _write_profilers():
+    '''Writes the summary of every shared profiler, when the interpreter exits'''
+    for profiler in list(_profilers.values()):
+        profiler.write()
+
+atexit.register(_write_profilers)
+
+def _default_profiler():
+    '''
+    Function: _default_profiler
+
+    Description:
+    Returns the profiler set up by the PHANTASM_PROFILE environment variable (timing, cprofile or sampling), which is shared by every instance so profiling can be turned on for a whole test run. The summary is written to PHANTASM_PROFILE_FILE, or standard error.
+
+    Returns:
+        (methodProfiler)                - The shared profiler, or None if profiling isn't turned on
+    '''
+    mode = os.environ.get('PHANTASM_PROFILE')
+    if not mode:
+        return None
+    return _shared_profiler(mode, os.environ.get('PHANTASM_PROFILE_FILE'))
+
+
+"""
+Playbook Performance History
+"""
+def _percentile(values, percent):
+    '''
+    Function: _percentile
+
+    Description:
+    Calculates a percentile of the values using the nearest rank method.
+    '''
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, int(-(-percent * len(ordered) // 100)))
+    return ordered[rank - 1]
+
+class playbookHistory(object):
+    '''
+    Class: playbookHistory
+
+    Description:
+    A local store of playbook run durations (as returned by wait_for_playbook), kept as a newline delimited JSON file. It calculates rolling p50/p95 baselines from the most recent successful runs of each playbook and action, and reports runs that are slower than the baseline by more than a margin.
+
+    Args:
+        file_name (str)                 - The path of the history file, which is created if it doesn't exist
+        (optional) window (int)         - The number of recent successful runs the baselines are calculated from
+    '''
+    def __init__(self, file_name, window=20):
+        self._file_name = file_name
+        self._window = window
+        self._durations = {}
+        self._lock = threading.Lock()
+        if os.path.exists(file_name):
+            with open(file_name) as history_file:
+                for line in history_file:
+                    if line.strip():
+                        self._remember(json.loads(line))
+
+    def _remember(self, run):
+        if run.get('status') != 'success' or run.get('duration') is None:
+            return
+        self._durations.setdefault((run['playbook'], None), []).append(run['duration'])
+        for action, duration in run.get('actions', {}).items():
+            self._durations.setdefault((run['playbook'], action), []).append(duration)
+        for key in [(run['playbook'], None)] + [(run['playbook'], action) for action in run.get('actions', {})]:
+            del self._durations[key][:-self._window]
+
+    def record(self, run):
+        '''
+        Function: record
+
+        Description:
+        Adds a run to the history file and the baselines.
+
+        Args:
+            run (dict)                  - The run, as returned by wait_for_playbook
+        '''
+        entry = {}
+        entry['time'] = time.time()
+        entry['playbook'] = run['playbook']
+        entry['playbook_run_id'] = run.get('playbook_run_id')
+        entry['status'] = run.get('status')
+        entry['duration'] = run.get('duration')
+        entry['actions'] = run.get('actions', {})
+        with self._lock:
+            with open(self._file_name, 'a') as history_file:
+                history_file.write(json.dumps(entry) + '\n')
+            self._remember(entry)
+
+    def baseline(self, playbook, action=None):
+        '''
+        Function: baseline
+
+        Description:
+        Returns the rolling baseline of a playbook, or of an action within it.
+
+        Returns:
+            (dict)                      - The number of runs, and the p50 and p95 durations in seconds
+        '''
+        durations = self._durations.get((playbook, action), [])
+        return {'count': len(durations), 'p50': _percentile(durations, 50), 'p95': _percentile(durations, 95)}
+
+    def check(self, run, margin=0.2, min_runs=5):
+        '''
+        Function: check
+
+        Description:
+        Compares a run against the baselines of its playbook and actions. A duration is a regression when it is over the p95 baseline by more than the margin. Baselines with fewer than min_runs runs are ignored.
+
+        Args:
+            run (dict)                  - The run, as returned by wait_for_playbook
+            (optional) margin (float)   - The fraction over the p95 baseline that is tolerated (e.g. 0.2 for 20%)
+            (optional) min_runs (int)   - The number of runs needed before a baseline is used
+
+        Returns:
+            (array)                     - A message for each regression, empty if there are none
+        '''
+        regressions = []
+        durations = [(None, run.get('duration'))] + list(run.get('actions', {}).items())
+        for action, duration in durations:
+            baseline = self.baseline(run['playbook'], action)
+            if duration is None or baseline['count'] < min_runs:
+                continue
+            limit = baseline['p95'] * (1 + margin)
+            if duration > limit:
+                name = run['playbook'] if action is None else '{} / {}'.format(run['playbook'], action)
+                regressions.append('{} took {:.2f}s, over the limit of {:.2f}s (p50 {:.2f}s, p95 {:.2f}s over {} runs, margin {:.0%})'.format(name, duration, limit, baseline['p50'], baseline['p95'], baseline['count'], margin))
+        return regressions
+
+
+"""
+Soak Testing
+"""
+def _process_resources():
+    '''
+    Function: _process_resources
+
+    Description:
+    Samples the resources held by this process. The resident set size and open sockets are read from /proc on Linux. Elsewhere the resident set size falls back on the peak reported by the resource module, and sockets aren't counted.
+
+    Returns:
+        (dict)                          - The rss (bytes), open_files, sockets, threads, gc_objects, gc_collections (per generation) and gc_uncollectable
+    '''
+    sample = {'rss': None, 'open_files': None, 'sockets': None, 'threads': threading.active_count()}
+    try:
+        with open('/proc/self/statm') as statm:
+            sample['rss'] = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        descriptors = os.listdir('/proc/self/fd')
+        sample['open_files'] = len(descriptors)
+        sample['sockets'] = 0
+        for descriptor in descriptors:
+            try:
+                if os.readlink('/proc/self/fd/{}'.format(descriptor)).startswith('socket:'):
+                    sample['sockets'] += 1
+            except OSError:
+                continue
+    except (OSError, ValueError):
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            sample['rss'] = peak if sys.platform == 'darwin' else peak * 1024
+    generations = gc.get_stats()
+    sample['gc_objects'] = len(gc.get_objects())
+    sample['gc_collections'] = [generation['collections'] for generation in generations]
+    sample['gc_uncollectable'] = sum(generation['uncollectable'] for generation in generations)
+    return sample
+
+def _growth(values):
+    '''
+    Function: _growth
+
+    Description:
+    Fits a least squares line through a series of values, and measures how far it rises from the first window to the last.
+
+    Returns:
+        (tuple)                         - The fitted first and last values, or None if there are fewer than two values
+    '''
+    points = [(position, value) for position, value in enumerate(values) if value is not None]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance if variance else 0
+    first, last = points[0][0], points[-1][0]
+    return mean_y + slope * (first - mean_x), mean_y + slope * (last - mean_x)
+
+def _latency_stats(durations):
+    '''Summarises a list of durations (in seconds)'''
+    return {'count': len(durations), 'mean': sum(durations) / len(durations), 'p50': _percentile(durations, 50), 'p95': _percentile(durations, 95), 'max': max(durations)}
+
+def _soak_trends(windows, threshold=0.2, min_windows=3):
+    '''
+    Function: _soak_trends
+
+    Description:
+    Flags the trends in the windows of a soak test: client memory, objects, threads or sockets that keep growing, and method latency that drifts upwards. Drifting latency is attributed to Phantom when the HTTP requests slowed down by as much, and to the client when they didn't.
+
+    Args:
+        windows (list)                  - The windows of the soak test, as recorded by run_soak_test
+        (optional) threshold (float)    - The relative growth over the run that is flagged, e.g. 0.2 for 20%
+        (optional) min_windows (int)    - The number of windows needed before trends are flagged
+
+    Returns:
+        (list)                          - A description of each trend
+    '''
+    trends = []
+    if len(windows) < min_windows:
+        return trends
+
+    def relative(fitted):
+        if not fitted or fitted[0] <= 0:
+            return None
+        return (fitted[1] - fitted[0]) / fitted[0]
+
+    for field, label, scale, unit in (('rss', 'Client memory', 1048576.0, 'MB'), ('gc_objects', 'Live Python objects', 1, '')):
+        fitted = _growth([window['resources'][field] for window in windows])
+        if relative(fitted) is not None and relative(fitted) > threshold:
+            trends.append('{} grew {:.0%} over {} windows ({:.1f}{} to {:.1f}{}), a possible leak'.format(label, relative(fitted), len(windows), fitted[0] / scale, unit, fitted[1] / scale, unit))
+    for field, label in (('threads', 'Threads'), ('sockets', 'Open sockets')):
+        fitted = _growth([window['resources'][field] for window in windows])
+        if fitted and fitted[1] - fitted[0] >= 2 and (relative(fitted) is None or relative(fitted) > threshold):
+            trends.append('{} rose from {:.0f} to {:.0f} over {} windows, a possible leak'.format(label, fitted[0], fitted[1], len(windows)))
+
+    request_growth = relative(_growth([window['requests']['p50'] if window['requests'] else None for window in windows]))
+    for method in sorted(set(method for window in windows for method in window['methods'])):
+        fitted = _growth([window['methods'][method]['p50'] if method in window['methods'] else None for window in windows])
+        growth = relative(fitted)
+        if growth is None or growth <= threshold:
+            continue
+        if request_growth is not None and request_growth > growth / 2:
+            cause = 'the HTTP requests slowed by {:.0%} too, so the drift is on the Phantom side'.format(request_growth)
+        else:
+            cause = 'the HTTP requests didn\'t slow down by as much, so the drift is on the client side'
+        trends.append('{} p50 latency grew {:.0%} ({:.3f}s to {:.3f}s); {}'.format(method, growth, fitted[0], fitted[1], cause))
+    return trends
+
+
+"""
+Rate Limiting
+"""
+class _rateLimiter(object):
+    '''
+    Class: _rateLimiter
+
+    Description:
+    A token bucket shared between threads, which limits how often something (e.g. submitting a playbook run) happens. Up to burst calls go through at once, after which calls are spaced out to rate per second.
+
+    Args:
+        rate (float)                    - The number of calls allowed per second
+        (optional) burst (int)          - The number of calls allowed at once, defaults to 1
+    '''
+    def __init__(self, rate, burst=1):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Blocks until a call is allowed'''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self._rate
+            _deadline_sleep(delay, 'the next rate limited call')
+
+
+"""
+Deadlines
+"""
+_deadline_state = threading.local()
+
+@contextlib.contextmanager
+def deadline(timeout_budget):
+    '''
+    Function: deadline
+
+    Description:
+    Limits the wall-clock time of everything within it, however many requests and polls it makes. Every request's socket timeout is shrunk to the time left, the sleeps between polls are shortened to fit, and once the budget has run out a deadlineException is raised rather than making another request. Deadlines nest (an inner deadline can only shorten an outer one), and are carried over to the threads that compound calls (e.g. run_action_many) submit work on. Every public method of the class also accepts a timeout_budget keyword, which does the same for that call.
+
+    e.g.
+        with phantasm.deadline(30):
+            ph.get_jira_ticket_data("PROJ-123")
+        ph.get_jira_ticket_data("PROJ-123", timeout_budget=30)
+
+    Args:
+        timeout_budget (float)          - The number of seconds everything within it may take
+    '''
+    previous = getattr(_deadline_state, 'deadline', None)
+    expires = time.monotonic() + timeout_budget
+    if previous is None or expires < previous[0]:
+        _deadline_state.deadline = (expires, timeout_budget)
+    try:
+        yield
+    finally:
+        _deadline_state.deadline = previous
+
+def _time_left(step, minimum=0):
+    '''
+    Function: _time_left
+
+    Description:
+    Returns the number of seconds left before the deadline of the current thread, raising a deadlineException if there is no more than the minimum left for the step.
+
+    Returns:
+        (float)                         - The seconds left, or None if there is no deadline
+    '''
+    current = getattr(_deadline_state, 'deadline', None)
+    if current is None:
+        return None
+    remaining = current[0] - time.monotonic()
+    if remaining <= minimum:
+        raise deadlineException('The timeout budget of {:.2f}s ran out before {}'.format(current[1], step))
+    return remaining
+
+def _deadline_sleep(seconds, step):
+    '''
+    Function: _deadline_sleep
+
+    Description:
+    Sleeps, unless the sleep would outlast the deadline of the current thread, in which case a deadlineException is raised straight away rather than sleeping past it.
+    '''
+    remaining = _time_left(step)
+    if remaining is not None and seconds >= remaining:
+        raise deadlineException('The timeout budget of {:.2f}s would run out waiting {:.2f}s before {}'.format(_deadline_state.deadline[1], seconds, step))
+    time.sleep(seconds)
+
+def _carry_deadline(function):
+    '''
+    Function: _carry_deadline
+
+    Description:
+    Wraps a function that will be run on another thread (e.g. by a ThreadPoolExecutor), so that it runs under the deadline of the thread wrapping it.
+    '''
+    current = getattr(_deadline_state, 'deadline', None)
+    if current is None:
+        return function
+
+    @functools.wraps(function)
+    def carried(*args, **kwargs):
+        previous = getattr(_deadline_state, 'deadline', None)
+        _deadline_state.deadline = current
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _deadline_state.deadline = previous
+    return carried
+
+
+"""
+Synthetic Data
+"""
+class syntheticData(object):
+    '''
+    Class: syntheticData
+
+    Description:
+    Generates realistic containers and artifacts for load tests, as payloads ready for create_container/add_artifact (or create_containers). Artifacts carry valid CEF fields (IP addresses, ports, file hashes, URLs, domains and user names). Each kind of value is drawn from a pool of a fixed size, so the cardinality (and with it how often values repeat across artifacts) is controlled, and a fraction of each container's artifacts can be exact duplicates. Values are drawn a batch at a time rather than one by one, so millions of artifacts can be generated a minute. The same seed always generates the same data.
+
+    e.g.
+        generator = phantasm.syntheticData(seed=1, cardinality={'ip': 50})
+        ph.create_containers(generator.containers(1000, artifacts_per_container=100))
+
+    Args:
+        (optional) seed (int)               - The seed of the random number generator
+        (optional) cardinality (dict)       - The number of distinct values of each kind: 'ip', 'file', 'domain', 'url' and 'user'
+        (optional) duplicate_rate (float)   - The fraction of each container's artifacts that are copies of another artifact in it
+        (optional) kinds (dict)             - The weighting of each kind of artifact: 'network', 'file', 'url' and 'user'
+    '''
+    _cardinality = {'ip': 10000, 'file': 5000, 'domain': 2000, 'url': 10000, 'user': 1000}
+    _kinds = {'network': 4, 'file': 2, 'url': 2, 'user': 1}
+    _first_names = ['james', 'mary', 'john', 'patricia', 'robert', 'jennifer', 'michael', 'linda', 'william', 'elizabeth', 'david', 'susan', 'sean', 'sarah', 'rex', 'karen']
+    _last_names = ['smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'murphy', 'breen', 'chen', 'wilson', 'taylor', 'lee', 'walker', 'hall']
+    _top_level_domains = ['com', 'net', 'org', 'io', 'ru', 'cn', 'info', 'xyz']
+    _words = ['login', 'update', 'secure', 'account', 'invoice', 'portal', 'files', 'cdn', 'mail', 'verify', 'support', 'cloud', 'billing', 'auth', 'media', 'static']
+    _extensions = ['exe', 'dll', 'doc', 'docm', 'xls', 'pdf', 'zip', 'js', 'ps1', 'vbs']
+    _ports = [22, 25, 53, 80, 123, 389, 443, 445, 3389, 8080, 8443]
+
+    def __init__(self, seed=None, cardinality=None, duplicate_rate=0.0, kinds=None):
+        self._random = random.Random(seed)
+        self._duplicate_rate = duplicate_rate
+        self._kind_names = list(kinds or self._kinds)
+        self._kind_weights = list(itertools.accumulate((kinds or self._kinds)[kind] for kind in self._kind_names))
+        self._sequence = itertools.count(1)
+
+        sizes = dict(self._cardinality)
+        sizes.update(cardinality or {})
+        choice, bits = self._random.choice, self._random.getrandbits
+        self._ips = ['{}.{}.{}.{}'.format(*bits(32).to_bytes(4, 'big')) for _ in range(sizes['ip'])]
+        self._domains = ['{}-{}{}.{}'.format(choice(self._words), choice(self._words), bits(12), choice(self._top_level_domains)) for _ in range(sizes['domain'])]
+        self._urls = ['https://{}/{}/{}.php?id={}'.format(choice(self._domains), choice(self._words), choice(self._words), bits(20)) for _ in range(sizes['url'])]
+        self._users = ['{}.{}{}'.format(choice(self._first_names), choice(self._last_names), bits(8)) for _ in range(sizes['user'])]
+        # The hashes of a file are kept together, so the same file always has the same md5, sha1 and sha256
+        self._files = []
+        for _ in range(sizes['file']):
+            contents = bits(256).to_bytes(32, 'big')
+            self._files.append(('{}_{}.{}'.format(choice(self._words), bits(16), choice(self._extensions)), hashlib.md5(contents).hexdigest(), hashlib.sha1(contents).hexdigest(), hashlib.sha256(contents).hexdigest()))
+
+    def _cef(self, count):
+        '''Generates the CEF fields of count artifacts, drawing each kind of value a batch at a time'''
+        choices = self._random.choices
+        kinds = choices(self._kind_names, cum_weights=self._kind_weights, k=count)
+        ips = iter(choices(self._ips, k=count * 2))
+        files = iter(choices(self._files, k=count))
+        urls = iter(choices(self._urls, k=count))
+        users = iter(choices(self._users, k=count * 2))
+        ports = iter(choices(self._ports, k=count))
+        for kind in kinds:
+            if kind == 'network':
+                yield kind, {'sourceAddress': next(ips), 'destinationAddress': next(ips), 'destinationPort': next(ports)}
+            elif kind == 'file':
+                file_name, md5, sha1, sha256 = next(files)
+                yield kind, {'fileName': file_name, 'fileHashMd5': md5, 'fileHashSha1': sha1, 'fileHashSha256': sha256, 'destinationAddress': next(ips)}
+            elif kind == 'url':
+                url = next(urls)
+                yield kind, {'requestURL': url, 'destinationDnsDomain': url.split('/')[2], 'sourceAddress': next(ips)}
+            else:
+                yield kind, {'sourceUserName': next(users), 'destinationUserName': next(users), 'sourceAddress': next(ips)}
+
+    def artifacts(self, count, container_id=None, label='events', severity='low', run_automation=False):
+        '''
+        Function: artifacts
+
+        Description:
+        Generates artifacts, as payloads for add_artifact (or the artifacts of a create_container payload).
+
+        Args:
+            count (int)                         - The number of artifacts to generate
+            (optional) container_id (str)       - The container the artifacts belong to, not needed for artifacts embedded in a container
+            (optional) label (str)              - The label of the artifacts
+            (optional) severity (str)           - The severity of the artifacts
+            (optional) run_automation (bool)    - Whether the artifacts trigger automation
+
+        Returns:
+            (list)                              - The artifact payloads
+        '''
+        unique = count - int(round(count * self._duplicate_rate)) if count else 0
+        artifacts = []
+        for kind, cef in self._cef(max(unique, 1 if count else 0)):
+            artifact = {'cef': cef, 'cef_types': {}, 'data': {}, 'description': 'Synthetic {} artifact'.format(kind), 'label': label, 'name': '{} artifact'.format(kind), 'run_automation': run_automation, 'severity': severity, 'source_data_identifier': 'synthetic-{}'.format(next(self._sequence)), 'tags': ['synthetic', kind]}
+            if container_id:
+                artifact['container_id'] = container_id
+            artifacts.append(artifact)
+        # Duplicates get their own copies of the nested fields, so changing one doesn't change the artifact it copies
+        artifacts.extend(dict(artifact, cef=dict(artifact['cef']), cef_types=dict(artifact['cef_types']), data=dict(artifact['data']), tags=list(artifact['tags'])) for artifact in self._random.choices(artifacts, k=count - len(artifacts)))
+        return artifacts
+
+    def containers(self, count, artifacts_per_container=10, label='events', severity='low', run_automation=False):
+        '''
+        Function: containers
+
+        Description:
+        Generates containers with their artifacts embedded, as payloads for create_container (or create_containers). Containers are generated as they are consumed, so any number can be streamed into create_containers.
+
+        Args:
+            count (int)                         - The number of containers to generate
+            (optional) artifacts_per_container (int) - The number of artifacts in each container
+            (optional) label (str)              - The label of the containers and artifacts
+            (optional) severity (str)           - The severity of the containers and artifacts
+            (optional) run_automation (bool)    - Whether the containers trigger automation
+
+        Returns:
+            (generator)                         - The container payloads
+        '''
+        for position in range(count):
+            sequence = next(self._sequence)
+            artifacts = self.artifacts(artifacts_per_container, label=label, severity=severity)
+            if artifacts and run_automation:
+                # Automation runs once, when the last artifact is added
+                artifacts[-1]['run_automation'] = True
+            yield {'artifacts': artifacts, 'custom_fields': {}, 'data': {}, 'description': 'Synthetic container for load testing', 'label': label, 'name': 'SYNTHETIC - Container {}'.format(sequence), 'run_automation': run_automation, 'sensitivity': 'white', 'severity': severity, 'source_data_identifier': 'synthetic-{}'.format(sequence), 'status': 'new', 'tags': ['synthetic']}
+
+    def batches(self, count, batch_size=100, **kwargs):
+        '''
+        Function: batches
+
+        Description:
+        Generates containers (see containers) in lists of batch_size.
+
+        Returns:
+            (generator)                         - Lists of container payloads
+        '''
+        containers = self.containers(count, **kwargs)
+        while True:
+            batch = list(itertools.islice(containers, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+"""
+Configuration and Sessions
+"""
+def load_config(config_file=None, reload=False):
+    '''
+    Function: load_config
+
+    Description:
+    Loads the Phantom server address and auth token. The PHANTOM_SERVER_ADDRESS and PHANTOM_AUTH_TOKEN environment variables take precedence, otherwise they are read from the config file (PHANTASM_CONFIG, or config.ini in the current directory). The server address can be a comma separated list of the nodes of a cluster. The parsed file is cached, so it is only read once.
+
+    Args:
+        (optional) config_file (str)    - The path of the config file to read
+        (optional) reload (bool)        - Whether to re-read the config file even if it has already been parsed
+
+    Returns:
+        (dict)                          - The server_address and auth_token
+    '''
+    if not config_file:
+        config_file = os.environ.get('PHANTASM_CONFIG', 'config.ini')
+    config_file = os.path.abspath(config_file)
+
+    configuration = _configurations.get(config_file)
+    if configuration is None or reload:
+        parser = configparser.ConfigParser()
+        parser.read(config_file)
+        configuration = {}
+        if parser.has_section('PHANTOM'):
+            configuration = dict(parser.items('PHANTOM'))
+        _configurations[config_file] = configuration
+
+    configuration = dict(configuration)
+    if os.environ.get('PHANTOM_SERVER_ADDRESS'):
+        configuration['server_address'] = os.environ['PHANTOM_SERVER_ADDRESS']
+    if os.environ.get('PHANTOM_AUTH_TOKEN'):
+        configuration['auth_token'] = os.environ['PHANTOM_AUTH_TOKEN']
+    if not configuration.get('server_address') or not configuration.get('auth_token'):
+        raise phantomException('No server_address and auth_token found in {} or the environment'.format(config_file))
+    return configuration
+
+def _shared_session(server_address, auth_token, pool_size=32):
+    '''
+    Function: _shared_session
+
+    Description:
+    Returns the pooled session for a server and auth token, creating it the first time. Every instance of the class talking to the same server shares the session, so connections (and their TLS handshakes) are reused between instances.
+
+    Returns:
+        (requests.Session)              - The shared session
+    '''
+    key = (server_address, auth_token)
+    session = _sessions.get(key)
+    if session is None:
+        with _shared_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.headers = {'ph-auth-token': auth_token}
+                session.hooks = {'response': phantasm._hook_response}
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[key] = session
+    return session
+
+
+"""
+Transport and Caching
+"""
+def _endpoint(url):
+    '''
+    Function: _endpoint
+
+    Description:
+    Returns the REST endpoint of a URL, e.g. 'container' for https://phantom.local/rest/container/5?page_size=0
+    '''
+    path = urlsplit(url).path
+    if '/rest/' in path:
+        path = path.split('/rest/', 1)[1]
+    return path.strip('/').split('/', 1)[0]
+
+class responseCache(object):
+    '''
+    Class: responseCache
+
+    Description:
+    An in-memory cache of GET responses, keyed by the normalised URL (so the order of the query parameters doesn't matter). Each endpoint has its own time to live, and endpoints without one (e.g. playbook_run and action_run, which are polled for their status) are never cached. Once max_entries is reached the least recently used response is evicted. Every invalidation of an endpoint moves it on a generation, and a response is only cached if its endpoint is still on the generation it was requested in, so a GET in flight during a write can't cache what the write changed. A cache can be shared between instances.
+
+    Args:
+        (optional) ttls (dict)          - The number of seconds responses are kept for, per endpoint. These are merged into the defaults, and a TTL of 0 stops an endpoint being cached.
+        (optional) max_entries (int)    - The maximum number of responses kept
+    '''
+    _ttls = {'container': 5, 'artifact': 5, 'playbook': 30, 'asset': 60, 'app': 60, 'workflow_template': 60, 'vault_document': 60}
+    # A write to an endpoint (the key) invalidates everything cached from these endpoints
+    _invalidates = {'container': ('container', 'artifact'), 'artifact': ('artifact', 'container'), 'container_attachment': ('container', 'vault_document'), 'playbook': ('playbook',)}
+
+    def __init__(self, ttls=None, max_entries=1024):
+        self._ttls_by_endpoint = dict(self._ttls)
+        self._ttls_by_endpoint.update(ttls or {})
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._generations = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(url):
+        parts = urlsplit(url)
+        return (parts.netloc, parts.path.rstrip('/'), tuple(sorted(parse_qsl(parts.query, keep_blank_values=True))))
+
+    def get(self, url):
+        '''
+        Function: get
+
+        Description:
+        Returns the cached response of a URL, if it is cached and hasn't expired.
+
+        Returns:
+            (requests.Response)         - The cached response, or None
+        '''
+        if not self._ttls_by_endpoint.get(_endpoint(url)):
+            return None
+        key = self._key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def generation(self, url):
+        '''Returns the number of times the endpoint of a URL has been invalidated, to pass to put once the response arrives'''
+        with self._lock:
+            return self._generations[_endpoint(url)]
+
+    def put(self, url, response, generation=None):
+        '''Caches the response of a URL, if its endpoint is cached and hasn't been invalidated since the generation the response was requested in'''
+        endpoint = _endpoint(url)
+        ttl = self._ttls_by_endpoint.get(endpoint)
+        if not ttl or response.status_code != 200:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations[endpoint]:
+                return
+            self._entries[self._key(url)] = (time.monotonic() + ttl, endpoint, response)
+            self._entries.move_to_end(self._key(url))
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    @classmethod
+    def _invalidated(cls, url):
+        '''Returns the endpoints a write to the URL may have changed'''
+        endpoint = _endpoint(url)
+        return cls._invalidates.get(endpoint, (endpoint,))
+
+    def invalidate(self, url):
+        '''Drops everything cached that a write to the URL may have changed'''
+        endpoints = self._invalidated(url)
+        with self._lock:
+            for invalidated in endpoints:
+                self._generations[invalidated] += 1
+            for key in [key for key, entry in self._entries.items() if entry[1] in endpoints]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        '''Drops everything cached'''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        '''
+        Function: stats
+
+        Returns:
+            (dict)                      - The number of entries, hits, misses, evictions and invalidations
+        '''
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'invalidations': self.invalidations}
+
+class nodePool(object):
+    '''
+    Class: nodePool
+
+    Description:
+    Spreads requests across the web nodes of a Phantom cluster. Each request is sent to the next node in turn ('round_robin'), or to the node with the fewest requests in progress ('least_outstanding'). A node that can't be connected to is marked unhealthy and skipped for the cooldown, and the request fails over to another node. GETs and DELETEs fail over on any connection error, but POSTs only when the connection was never made, so a write is never sent twice. Pools are shared by every instance of the class using the same nodes.
+
+    Args:
+        addresses (list)                - The address of each node, e.g. ['https://phantom1.local/rest/', 'https://phantom2.local/rest/']
+        (optional) strategy (str)       - How nodes are chosen: 'round_robin' or 'least_outstanding'
+        (optional) cooldown (int)       - The number of seconds an unhealthy node is skipped for
+    '''
+    strategies = ('round_robin', 'least_outstanding')
+
+    def __init__(self, addresses, strategy='round_robin', cooldown=30):
+        if strategy not in self.strategies:
+            raise phantomException('Unknown load balancing strategy {}, expected one of {}'.format(strategy, ', '.join(self.strategies)))
+        self.addresses = list(addresses)
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._nodes = dict((address, {'requests': 0, 'failures': 0, 'outstanding': 0, 'down_until': 0}) for address in self.addresses)
+
+    def _acquire(self, tried):
+        with self._lock:
+            now = time.monotonic()
+            candidates = [address for address in self.addresses if address not in tried]
+            healthy = [address for address in candidates if self._nodes[address]['down_until'] <= now]
+            if healthy:
+                start = next(self._turn) % len(healthy)
+                healthy = healthy[start:] + healthy[:start]
+                if self.strategy == 'least_outstanding':
+                    healthy.sort(key=lambda address: self._nodes[address]['outstanding'])
+                address = healthy[0]
+            else:
+                # Every node is unhealthy, so try the one that has been down the longest
+                address = min(candidates, key=lambda address: self._nodes[address]['down_until'])
+            self._nodes[address]['outstanding'] += 1
+            self._nodes[address]['requests'] += 1
+            return address
+
+    def _release(self, address, failed):
+        with self._lock:
+            node = self._nodes[address]
+            node['outstanding'] -= 1
+            if failed:
+                node['failures'] += 1
+                node['down_until'] = time.monotonic() + self.cooldown
+            else:
+                node['down_until'] = 0
+
+    @staticmethod
+    def _never_connected(connection_error):
+        reason = getattr(connection_error.args[0], 'reason', None) if connection_error.args else None
+        return isinstance(connection_error, requests.ConnectTimeout) or isinstance(reason, requests.packages.urllib3.exceptions.NewConnectionError)
+
+    def send(self, session, method, url, kwargs):
+        '''
+        Function: send
+
+        Description:
+        Sends a request built for the first node to a node chosen by the strategy, failing over to the other nodes on connection errors.
+
+        Args:
+            session (requests.Session)  - The session to send the request with
+            method (str)                - The HTTP method: get, post or delete
+            url (str)                   - The URL, starting with the address of the first node
+            kwargs (dict)               - The arguments of the request
+
+        Returns:
+            (requests.Response)         - The response
+        '''
+        path = url[len(self.addresses[0]):] if url.startswith(self.addresses[0]) else None
+        tried = set()
+        while True:
+            address = self._acquire(tried)
+            failed = False
+            try:
+                return getattr(session, method)(url if path is None else address + path, **kwargs)
+            except requests.ConnectionError as connection_error:
+                failed = True
+                tried.add(address)
+                if path is None or len(tried) == len(self.addresses) or (method == 'post' and not self._never_connected(connection_error)):
+                    raise
+                logger.debug("Node {} failed ({}), failing over".format(address, connection_error))
+            finally:
+                self._release(address, failed)
+
+    def stats(self):
+        '''
+        Function: stats
+
+        Returns:
+            (dict)                      - The requests, failures, requests in progress and health of each node
+        '''
+        with self._lock:
+            now = time.monotonic()
+            return dict((address, {'requests': node['requests'], 'failures': node['failures'], 'outstanding': node['outstanding'], 'healthy': node['down_until'] <= now}) for address, node in self._nodes.items())
+
+_node_pools = {}
+
+def _shared_node_pool(addresses, strategy='round_robin'):
+    '''
+    Function: _shared_node_pool
+
+    Description:
+    Returns the node pool for a list of node addresses, creating it the first time, so the health of each node is shared by every instance.
+    '''
+    key = (tuple(addresses), strategy)
+    with _shared_lock:
+        pool = _node_pools.get(key)
+        if pool is None:
+            pool = _node_pools[key] = nodePool(addresses, strategy)
+    return pool
+
+class _singleFlight(object):
+    '''
+    Class: _singleFlight
+
+    Description:
+    Coalesces identical calls that are in progress at the same time: the first caller makes the call, and everyone else asking for the same key meanwhile waits for and shares its result (or exception). A follower with a timeout stops waiting when it runs out, raising requests.Timeout.
+
+    Writes move the endpoints they change on a generation (see invalidate), which callers include in their keys, so a read made after a write never joins a call that started before it.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._generations = collections.defaultdict(int)
+        self.calls = 0
+        self.coalesced = 0
+
+    def generation(self, scope, endpoint):
+        '''Returns the number of writes made to an endpoint within a scope (e.g. a session)'''
+        with self._lock:
+            return self._generations[(scope, endpoint)]
+
+    def invalidate(self, scope, endpoints):
+        '''Moves the endpoints a write changed on a generation, so reads made after it start calls of their own'''
+        with self._lock:
+            for endpoint in endpoints:
+                self._generations[(scope, endpoint)] += 1
+
+    def do(self, key, function, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not call['done'].wait(timeout):
+                raise requests.Timeout('Timed out waiting for a coalesced request')
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = function()
+            return call['result']
+        except Exception as call_error:
+            call['error'] = call_error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+# Identical GETs in progress are coalesced across every instance sharing a session
+_single_flight = _singleFlight()
+
+class _noSpan(object):
+    '''Stands in for a span when tracing is disabled'''
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+_no_span = _noSpan()
+
+class phantomTransport(object):
+    '''
+    Class: phantomTransport
+
+    Description:
+    Sends the requests of an instance of the class through the shared session. It provides the same get/post/delete calls as the session, and adds:
+        - The optional response cache: GETs are served from the cache where possible, and writes invalidate what they may have changed.
+        - Request coalescing: when several threads send the exact same GET at the same time (e.g. polling the same playbook run), only one request goes to Phantom and every caller shares its response.
+        - Load balancing and failover across the nodes of a cluster, when given a nodePool.
+
+    Args:
+        session (requests.Session)      - The shared session to send requests through
+        (optional) cache (responseCache) - The cache of GET responses, none by default
+        (optional) coalesce (bool)      - Whether identical GETs in progress at the same time are coalesced
+        (optional) tracer (spanTracer)  - If provided, each request is recorded as a span
+        (optional) nodes (nodePool)     - If provided, requests are spread across the nodes of a cluster
+    '''
+    def __init__(self, session, cache=None, coalesce=True, tracer=None, nodes=None):
+        self.session = session
+        self.cache = cache
+        self.coalesce = coalesce
+        self.tracer = tracer
+        self.nodes = nodes
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+
+    def _send(self, method, url, kwargs):
+        if self.nodes is None:
+            return getattr(self.session, method)(url, **kwargs)
+        return self.nodes.send(self.session, method, url, kwargs)
+
+    def _send_get(self, url, kwargs):
+        with self._lock:
+            self.requests += 1
+        if self.cache is None:
+            return self._send('get', url, kwargs)
+        generation = self.cache.generation(url)
+        response = self._send('get', url, kwargs)
+        self.cache.put(url, response, generation)
+        return response
+
+    def _written(self, url):
+        # A read after a write must neither be served from the cache nor join a read that started before the write
+        if self.cache is not None:
+            self.cache.invalidate(url)
+        _single_flight.invalidate(id(self.session), responseCache._invalidated(url))
+
+    def _span(self, method, url):
+        if self.tracer is None:
+            return _no_span
+        return self.tracer.span('{} {}'.format(method, _endpoint(url)), 'http', url=url)
+
+    @staticmethod
+    def _budget(method, url, kwargs):
+        # The socket timeout can't outlast the deadline
+        remaining = _time_left('{} {}'.format(method, url))
+        if remaining is not None:
+            kwargs['timeout'] = min(kwargs.get('timeout') or remaining, remaining)
+        return remaining
+
+    @staticmethod
+    def _budget_exceeded(method, url, request_error):
+        current = getattr(_deadline_state, 'deadline', None)
+        if current is not None and current[0] <= time.monotonic():
+            raise deadlineException('The timeout budget of {:.2f}s ran out during {} {}'.format(current[1], method, url)) from request_error
+        raise request_error
+
+    def get(self, url, **kwargs):
+        remaining = self._budget('GET', url, kwargs)
+        with self._span('GET', url) as span:
+            try:
+                return self._get(url, kwargs, span)
+            except requests.RequestException as request_error:
+                if remaining is None:
+                    raise
+                self._budget_exceeded('GET', url, request_error)
+
+    def _get(self, url, kwargs, span):
+        if kwargs.get('stream'):
+            return self._send('get', url, kwargs)
+        if self.cache is not None:
+            response = self.cache.get(url)
+            if response is not None:
+                span['cached'] = True
+                return response
+        if not self.coalesce or set(kwargs) - {'timeout'}:
+            return self._send_get(url, kwargs)
+        # Everyone sharing the response decodes it themselves, so one caller changing its JSON can't affect another
+        leader = []
+        generation = _single_flight.generation(id(self.session), _endpoint(url))
+        try:
+            response = _single_flight.do((id(self.session), generation, responseCache._key(url)), lambda: leader.append(True) or self._send_get(url, kwargs), kwargs.get('timeout'))
+        except requests.Timeout:
+            if leader or kwargs.get('timeout') is not None:
+                raise
+            # The leader's timeout came from its own deadline, so a follower without one makes the request itself
+            return self._send_get(url, kwargs)
+        if not leader:
+            span['coalesced'] = True
+            with self._lock:
+                self.coalesced += 1
+        return response
+
+    def post(self, url, **kwargs):
+        remaining = self._budget('POST', url, kwargs)
+        try:
+            with self._span('POST', url):
+                return self._send('post', url, kwargs)
+        except requests.RequestException as request_error:
+            if remaining is None:
+                raise
+            self._budget_exceeded('POST', url, request_error)
+        finally:
+            self._written(url)
+
+    def delete(self, url, **kwargs):
+        remaining = self._budget('DELETE', url, kwargs)
+        try:
+            with self._span('DELETE', url):
+                return self._send('delete', url, kwargs)
+        except requests.RequestException as request_error:
+            if remaining is None:
+                raise
+            self._budget_exceeded('DELETE', url, request_error)
+        finally:
+            self._written(url)
+
+
+"""
+Container Seeding
+"""
+class containerSeed(object):
+    '''
+    Class: containerSeed
+
+    Description:
+    Collects the artifacts of a container so it can be created with automation triggered once (see phantasm.seed_container). It can be used as a context manager, which creates the container when the block exits without an exception, or as a builder by calling create().
+
+    Args:
+        phantasm_instance (phantasm)    - The instance to create the container with
+        container (dict)                - The arguments of create_container
+        (optional) settle (int)         - The number of seconds to wait before counting the playbook runs triggered, not counted if None
+        (optional) batch_size (int)     - The maximum number of artifacts sent in one request
+    '''
+    def __init__(self, phantasm_instance, container, settle=None, batch_size=500):
+        self._phantasm = phantasm_instance
+        self._container = dict(container)
+        self._settle = settle
+        self._batch_size = batch_size
+        self._artifacts = []
+        self.report = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.create()
+        return False
+
+    def add_artifact(self, **artifact):
+        '''
+        Function: add_artifact
+
+        Description:
+        Adds an artifact to be created with the container, taking the same arguments as phantasm.add_artifact (without container_id). Its run_automation is ignored, as only the last artifact triggers automation.
+
+        Returns:
+            (containerSeed)                 - The seed, so calls can be chained
+        '''
+        artifact.pop('container_id', None)
+        self._artifacts.append(phantasm._artifact_payload(**artifact))
+        return self
+
+    def add_artifacts(self, artifacts):
+        '''Adds many artifacts (each a dictionary of add_artifact arguments) to be created with the container'''
+        for artifact in artifacts:
+            self.add_artifact(**artifact)
+        return self
+
+    def create(self):
+        '''
+        Function: create
+
+        Description:
+        Creates the container and its artifacts, triggering automation once, and sets it as the current container of the instance.
+
+        Returns:
+            (dict)                          - The report: container_id, artifacts, requests, automation_triggers and playbook_runs
+        '''
+        if self.report is not None:
+            raise containerException('The container has already been seeded ({})'.format(self.report['container_id']))
+        run_automation = self._container.pop('run_automation', True)
+        for artifact in self._artifacts:
+            artifact['run_automation'] = False
+        if run_automation and self._artifacts:
+            self._artifacts[-1]['run_automation'] = True
+
+        container = self._phantasm._container_payload(**self._container)
+        container['artifacts'] = self._artifacts[:self._batch_size]
+        # With artifacts, the last artifact triggers the automation instead of the container
+        container['run_automation'] = bool(run_automation and not self._artifacts)
+        post_response = self._phantasm._sess.post(self._phantasm._url('container'), json=container)
+        container_id = post_response.json().get('id')
+        if not container_id:
+            raise containerException('The container was not created: {}'.format(post_response.json()))
+        self._phantasm._set_container_id(container_id)
+        requests_made = 1
+
+        for start in range(self._batch_size, len(self._artifacts), self._batch_size):
+            batch = self._artifacts[start:start + self._batch_size]
+            for artifact in batch:
+                artifact['container_id'] = container_id
+            post_response = self._phantasm._sess.post(self._phantasm._url('artifact'), json=batch)
+            requests_made += 1
+            for created in post_response.json() if isinstance(post_response.json(), list) else []:
+                if created.get('id'):
+                    self._phantasm._set_artifact_id(created.get('id'))
+
+        self.report = {'container_id': container_id, 'artifacts': len(self._artifacts), 'requests': requests_made, 'automation_triggers': 1 if run_automation else 0, 'playbook_runs': None}
+        if self._settle is not None:
+            _deadline_sleep(self._settle, 'counting the playbook runs')
+            get_response = self._phantasm._sess.get(self._phantasm._url('playbook_run', Q(container=container_id), page_size=1, include_expensive=False))
+            self.report['playbook_runs'] = get_response.json().get('count')
+        logger.debug("Seeded container {} with {} artifacts in {} requests".format(container_id, len(self._artifacts), requests_made))
+        return self.report
+
+
+"""
+Metadata Index
+"""
+class metadataIndex(object):
+    '''
+    Class: metadataIndex
+
+    Description:
+    An in-memory index of the assets, apps, playbooks and case templates of a Phantom instance, loaded in one paginated sweep, so names can be resolved without touching the network during a run. Names can be looked up exactly (case sensitive, as Phantom does), or by a case insensitive prefix or substring. The index doesn't notice changes made on the server, so call refresh() after creating or renaming anything it holds.
+
+    e.g.
+        index = phantasm_instance.prefetch_metadata()
+        index.get('asset', 'jira')['product_name']
+        index.lookup('playbook', 'jira', match='substring')
+
+    Args:
+        phantasm_instance (phantasm)    - The instance to load the metadata with
+        (optional) kinds (dict)         - The REST endpoint of each kind of metadata, mapped to the fields it is indexed by
+    '''
+    _kinds = {'asset': ('name',), 'app': ('name', 'product_name'), 'playbook': ('name',), 'workflow_template': ('name',)}
+
+    def __init__(self, phantasm_instance, kinds=None):
+        self._phantasm = phantasm_instance
+        self._kinds = dict(kinds or self._kinds)
+        self._indexes = {}
+        self.loaded = None
+        self.refresh()
+
+    def refresh(self, kinds=None):
+        '''
+        Function: refresh
+
+        Description:
+        Reloads the index from the server, sweeping every kind of metadata in parallel. Lookups carry on against the old index until the new one is complete.
+
+        Args:
+            (optional) kinds (list)         - The kinds of metadata to reload, defaults to all of them
+
+        Returns:
+            (dict)                          - The number of records loaded of each kind
+        '''
+        kinds = list(kinds or self._kinds)
+        def sweep(kind):
+            return list(self._phantasm._iter_query(kind, page_size=1000, include_expensive=False))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(kinds)) as executor:
+            records = dict(zip(kinds, executor.map(_carry_deadline(sweep), kinds)))
+
+        indexes = dict(self._indexes)
+        for kind in kinds:
+            for field in self._kinds[kind]:
+                by_name = {}
+                for record in records[kind]:
+                    name = record.get(field)
+                    if isinstance(name, str):
+                        by_name.setdefault(name, []).append(record)
+                indexes[(kind, field)] = (by_name, sorted((name.lower(), name) for name in by_name))
+        self._indexes = indexes
+        self.loaded = time.time()
+        logger.debug("Indexed {}".format(', '.join('{} {}'.format(len(records[kind]), kind) for kind in kinds)))
+        return {kind: len(records[kind]) for kind in kinds}
+
+    def lookup(self, kind, name, match='exact', field='name'):
+        '''
+        Function: lookup
+
+        Description:
+        Finds the records of a kind of metadata by name, without touching the network.
+
+        Args:
+            kind (str)                      - The kind of metadata: asset, app, playbook or workflow_template
+            name (str)                      - The name to look up
+            (optional) match (str)          - How to match the name: exact, prefix or substring
+            (optional) field (str)          - The field to match the name against, e.g. product_name for apps
 
-class artifactException(containerException):
-    pass
+        Returns:
+            (list)                          - The matching records, in name order
+        '''
+        if (kind, field) not in self._indexes:
+            raise phantomException('{} is not indexed by {}'.format(kind, field))
+        by_name, names = self._indexes[(kind, field)]
+        if match == 'exact':
+            return list(by_name.get(name, []))
+        folded = name.lower()
+        if match == 'prefix':
+            start = bisect.bisect_left(names, (folded,))
+            matched = itertools.takewhile(lambda entry: entry[0].startswith(folded), names[start:])
+        elif match == 'substring':
+            matched = (entry for entry in names if folded in entry[0])
+        else:
+            raise phantomException('Unknown match type: {}'.format(match))
+        return [record for _, original in matched for record in by_name[original]]
 
-class playbookException(containerException):
-    pass
+    def get(self, kind, name, field='name'):
+        '''
+        Function: get
 
-class actionException(containerException):
-    pass
+        Description:
+        Returns the record with exactly the name given, as the remote name lookups did.
+
+        Args:
+            kind (str)                      - The kind of metadata: asset, app, playbook or workflow_template
+            name (str)                      - The exact name to look up
+            (optional) field (str)          - The field to match the name against
 
+        Returns:
+            (dict)                          - The record
+        '''
+        records = self.lookup(kind, name, field=field)
+        if not records:
+            raise phantomException('No {} with a {} of {} in the metadata index, refresh it if it was created since {}'.format(kind, field, name, time.ctime(self.loaded)))
+        return records[0]
 
 
 """
@@ -83,10 +2278,15 @@ Description:
 
 Container Functions:
     create_container                    - Creates a new container
+    create_containers                   - Creates many containers (with their artifacts) concurrently
+    seed_container                      - Creates a container with its artifacts, triggering automation once
     update_container_status             - Updates the container status
     update_container_tags               - Adds a tag to the container
+    update_containers                   - Updates the status and/or tags of many containers concurrently
     get_last_created_container          - Identifies the most recently created container
+    get_containers                      - Retrieves the list of containers
     get_container_artifacts             - Retrieves the list of artifacts currently in the container
+    iter_container_artifacts            - Iterates over the artifacts of a container with flat memory, resumably
     promote_container_to_case           - Promotes the current container to a case
     demote_case_to_container            - Demotes the current case to a container
     delete_container                    - Deletes a container
@@ -96,41 +2296,79 @@ Artifact Functions:
     get_last_created_artifact           - Identifies the most recently created artifact
 
 File Functions:
-    upload_file_to_phantom              - Uploads a file to a container    
+    upload_file_to_phantom              - Uploads a file to a container, reusing existing vault entries with the same contents
+    upload_many                         - Uploads many files (or archive members) to a container in parallel
+    upload_directory                    - Uploads every file in a directory to a container in parallel
+    upload_archive                      - Uploads the members of a zip or tar archive without extracting them
+    save_vault_index                    - Saves the local index of file hashes to vault ids
+    load_vault_index                    - Loads a saved index of file hashes to vault ids
 
 Playbook Functions:
     run_playbook                        - Runs a playbook against a container
     get_playbook_results                - Retrieves the status of the playbook
+    wait_for_playbook                   - Waits for a playbook to finish and measures its duration
     get_playbook_action_results         - Retrieves the status of the last run action in the playbook
     get_playbook_information            - Retrieves the information relating to a playbook
     get_last_run_playbook_information   - Retrieves the information relating to the last executed playbook
     alter_playbook_active_state         - Activates/Deactives a playbook
     get_system_failure_impacted_playbooks - Identifies playbooks that didn't execute due to a system failure
     get_system_failure_pending_playbooks - Identifies playbooks that were pending execution before a system failure
+    scan_system_failures                - Scans a long date range for system failures in parallel, resumably
+    recover_pending_playbooks           - Re-runs the playbooks of containers stranded by a system failure, throttled and resumably
+    profile_playbook_run                - Rebuilds the timeline of a playbook run to find its bottlenecks
 
 Action Functions:
     get_application_id                  - Retrieves an application id
     run_action                          - Run an action
+    run_action_many                     - Run an action against many targets concurrently
     get_action_results                  - Retrieve the results of an action
     get_action_run_data                 - Retrieve the data of the action
 
+Scenario Functions:
+    run_scenario_matrix                 - Runs every combination of container templates and playbooks in parallel
+    run_soak_test                       - Loops a workflow for hours, tracking client resources and latency drift over time
+
+Export Functions:
+    export_to_csv                       - Streams records (e.g. from a streamed query) to a CSV file
+    export_to_ndjson                    - Streams records (e.g. from a streamed query) to a NDJSON file
+
 Misc Functions:
     get_jira_ticket_data                - Runs an action to retrieve all JIRA tickets.
+    get_jira_ticket_data_many           - Runs the action to retrieve many JIRA tickets concurrently.
+    get_cache_stats                     - Reports the hits, misses and evictions of the response cache
+    get_request_stats                   - Reports the GET requests sent, and those saved by coalescing and caching
+    get_node_stats                      - Reports the requests and health of each node of a cluster
+    prefetch_metadata                   - Loads (or refreshes) the local index of assets, apps, playbooks and case templates
+    get_profile_stats                   - Reports the client-side CPU and wait time of each function, when profiling
+    clear_cache                         - Drops every cached response
+    export_trace                        - Writes the spans recorded by the tracer to a Chrome trace file
 """
 class phantasm(object):
-    def __init__(self):
+    def __init__(self, config_file=None, server_address=None, auth_token=None, cache=None, coalesce=True, tracer=None, balancing='round_robin', prefetch=False, profiler=None):
         '''Setting Global Variables'''
-        import configparser
-        configuration=configparser.ConfigParser()
-        configuration.read('config.ini')
-        self._phantom_server_address = configuration.get('PHANTOM', 'server_address')
-        self._phantom_auth_token = configuration.get('PHANTOM', 'auth_token')
+        if not server_address or not auth_token:
+            configuration = load_config(config_file)
+            server_address = server_address or configuration['server_address']
+            auth_token = auth_token or configuration['auth_token']
+        if isinstance(server_address, str):
+            server_address = server_address.split(',')
+        self._phantom_server_addresses = [address.strip() for address in server_address if address.strip()]
+        self._phantom_server_address = self._phantom_server_addresses[0]
+        self._phantom_auth_token = auth_token
         self._url_headers = {'ph-auth-token': self._phantom_auth_token}
 
         '''Setting the Requests Components'''
-        self._sess = requests.Session()
-        self._sess.headers = self._url_headers
-        self._sess.hooks = {'response': self._hook_response}
+        if cache is True or isinstance(cache, dict):
+            cache = responseCache(cache if isinstance(cache, dict) else None)
+        if tracer is True:
+            tracer = spanTracer()
+        self._tracer = tracer or None
+        if profiler is True or isinstance(profiler, str):
+            profiler = _shared_profiler(profiler if isinstance(profiler, str) else 'timing')
+        self._profiler = profiler or _default_profiler()
+        nodes = _shared_node_pool(self._phantom_server_addresses, balancing) if len(self._phantom_server_addresses) > 1 else None
+        self._sess = phantomTransport(_shared_session(self._phantom_server_address, self._phantom_auth_token), cache or None, coalesce, self._tracer, nodes)
+        self._index = metadataIndex(self) if prefetch else None
 
         '''Setting Container Variables'''
         self._container_name = ""
@@ -145,10 +2383,12 @@ class phantasm(object):
         '''Setting File Variables'''
         self._file_id = []
         self._file_name = []
+        self._vault_index = {}
 
         '''Setting Playbook Variables'''
         self._playbook_run_id = []
         self._playbook_name = []
+        self._playbook_submitted = {}
 
         '''Setting Misc Variables'''
         self._last_run_product_name = ''
@@ -171,9 +2411,9 @@ class phantasm(object):
         '''
         return phantomcontainer.__doc__
 
-    """"
+    """
     HTTP: Functions
-    """"
+    """
     @staticmethod
     def _hook_response(post_response, *args, **kwargs):
         '''
@@ -183,35 +2423,173 @@ class phantasm(object):
         Used for debugging the actions being completed
         '''
         post_response.raise_for_status()
-        logger.debug("Request: {0}\nResponse: {1}".format(post_response.url, post_response.json()))
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        if kwargs.get('stream'):
+            # Reading the body here would defeat streaming, so only the request is logged
+            logger.debug("Request: {0}\nResponse: <streamed>".format(post_response.url))
+        else:
+            logger.debug("Request: {0}\nResponse: {1}".format(post_response.url, post_response.json()))
 
-    def _url(self, url_path, filter=[], page_number=0, page_size=0):
+    def _url(self, url_path, filters=None, page_number=0, page_size=0, sort=None, order=None, include_expensive=True):
         '''
         Function: _url
 
         Description:
-        A function to poll the ongoing action and confirm if it's completed.
+        Builds the URL for a request, including the paging, sorting and server side filters.
 
         Args:
             url_path (str)                  - The URL path: https://phantom.local/rest/<path>
-            (optional) filter (array)       - Optional filters to add for further information: https://phantom.local/rest/app_run?_filter_playbook_run_id=<playbook_id>&_filter_action="<action>"&include_expensive'
+            (optional) filters (Q)          - Filters to apply on the server, e.g. Q(playbook_run_id=<playbook_id>, action="<action>"). Lists of raw filter strings (e.g. 'action="<action>"') are still accepted.
+            (optional) page_number (int)    - The page to retrieve
+            (optional) page_size (int)      - The number of items per page (0 for all of them)
+            (optional) sort (str)           - The field to sort on
+            (optional) order (str)          - The order to sort in (asc or desc)
+            (optional) include_expensive (bool) - Whether to include the expensive fields (e.g. result_data)
 
         Returns:
             (str)                           - The string for the URL
         '''
-        url_path += '?page={}&page_size={}'.format(page_number,page_size)
-        if filter:
-            """
-            Add query string for filtered actions
-            e.g.    'https://phantom.local/rest/app_run?_filter_playbook_run_id=<playbook_id>&_filter_action="<action>"&include_expensive'
-            """
-            filter_query_string="?"
-            for action in filter:
-                filter_query_string += '&_filter_{}'.format(action)
-        else:
-            filter_query_string=""
-        url_path += '&include_expensive'
-        return self._phantom_server_address + url_path + filter_query_string
+        parameters = ['page={}'.format(page_number), 'page_size={}'.format(page_size)]
+        if sort:
+            parameters.append('sort={}'.format(sort))
+        if order:
+            parameters.append('order={}'.format(order))
+        if include_expensive:
+            parameters.append('include_expensive')
+        if isinstance(filters, Q):
+            filters = [filters]
+        for query_filter in filters or []:
+            if isinstance(query_filter, Q):
+                if query_filter:
+                    parameters.append(query_filter.compile())
+            else:
+                parameters.append('_filter_{}'.format(query_filter))
+        return self._phantom_server_address + url_path + '?' + '&'.join(parameters)
+
+    def _stream_data(self, url, key='data', chunk_size=65536, meta=None, fields=None):
+        '''
+        Function: _stream_data
+
+        Description:
+        Streams a listing response, decoding the items of its 'data' array one at a time as the bytes arrive, rather than loading the whole response with .json().
+
+        Args:
+            url (str)                       - The URL to retrieve
+            (optional) key (str)            - The top-level key holding the items, defaults to 'data'
+            (optional) chunk_size (int)     - The number of bytes to read from the socket at a time
+            (optional) meta (dict)          - If provided, is populated with the other top-level fields (e.g. count, num_pages)
+            (optional) fields (set)         - If provided, only these fields of each item are kept
+
+        Returns:
+            (generator)                     - The JSON of each item
+        '''
+        get_response = self._sess.get(url, stream=True)
+        try:
+            reader = _jsonStreamReader(get_response.iter_content(chunk_size=chunk_size))
+            for item in reader.iter_items(key, meta, fields):
+                yield item
+        finally:
+            get_response.close()
+
+    def _extract_data(self, url, extract, chunk_size=65536):
+        '''
+        Function: _extract_data
+
+        Description:
+        Streams a response through one or more compiled paths, decoding only the values they select.
+
+        Args:
+            url (str)                       - The URL to retrieve
+            extract (jsonPath)              - A jsonPath or path string, or a dict of names to paths
+            (optional) chunk_size (int)     - The number of bytes to read from the socket at a time
+
+        Returns:
+            (list)                          - The selected values, or a dict of them by name when given a dict of paths
+        '''
+        get_response = self._sess.get(url, stream=True)
+        try:
+            chunks = get_response.iter_content(chunk_size=chunk_size)
+            if isinstance(extract, dict):
+                return jsonPath.find_all_stream(extract, chunks)
+            return (extract if isinstance(extract, jsonPath) else jsonPath(extract)).find_stream(chunks)
+        finally:
+            get_response.close()
+
+    def _iter_query(self, url_path, filters=None, page_size=1000, sort='id', order=None, include_expensive=True):
+        '''
+        Function: _iter_query
+
+        Description:
+        Pages through a listing, streaming each page so only one item is held in memory at a time.
+
+        Args:
+            url_path (str)                  - The URL path: https://phantom.local/rest/<path>
+            (optional) filters (Q)          - Filters to apply on the server
+            (optional) page_size (int)      - The number of items to request per page
+            (optional) sort (str)           - The field to sort on, which keeps the pages stable
+            (optional) order (str)          - The order to sort in (asc or desc)
+            (optional) include_expensive (bool) - Whether to include the expensive fields (e.g. result_data)
+
+        Returns:
+            (generator)                     - The JSON of each item
+        '''
+        page_number = 0
+        while True:
+            meta = {}
+            count = 0
+            url = self._url(url_path, filters, page_number=page_number, page_size=page_size, sort=sort, order=order, include_expensive=include_expensive)
+            for item in self._stream_data(url, meta=meta):
+                count += 1
+                yield item
+            page_number += 1
+            if count < page_size or page_number >= meta.get('num_pages', page_number + 1):
+                return
+
+    def _iter_keyset(self, url_path, filters=None, page_size=1000, include_expensive=True):
+        '''
+        Function: _iter_keyset
+
+        Description:
+        Pages through a listing in id order, asking each page for the ids after the last one seen rather than for a page number. Items that stop matching the filters while paging (e.g. containers a playbook has started on) therefore can't shift later items onto pages already read.
+
+        Args:
+            url_path (str)                  - The URL path: https://phantom.local/rest/<path>
+            (optional) filters (Q)          - Filters to apply on the server
+            (optional) page_size (int)      - The number of items to request per page
+            (optional) include_expensive (bool) - Whether to include the expensive fields
+
+        Returns:
+            (generator)                     - The JSON of each item
+        '''
+        last_id = None
+        while True:
+            page_filters = filters
+            if last_id is not None:
+                page_filters = filters & Q(id__gt=last_id) if filters else Q(id__gt=last_id)
+            count = 0
+            for item in self._stream_data(self._url(url_path, page_filters, page_size=page_size, sort='id', order='asc', include_expensive=include_expensive)):
+                count += 1
+                last_id = item.get('id')
+                yield item
+            if count < page_size or last_id is None:
+                return
+
+    def _sleep(self, seconds):
+        '''
+        Function: _sleep
+
+        Description:
+        Sleeps between polls, recording the sleep as a span when tracing. Under a deadline the sleep is shortened to leave time for the next poll.
+        '''
+        remaining = _time_left('the next poll', minimum=0.05)
+        if remaining is not None:
+            seconds = min(seconds, remaining / 2)
+        if self._tracer is None:
+            time.sleep(seconds)
+            return
+        with self._tracer.span('sleep', 'wait', seconds=seconds):
+            time.sleep(seconds)
 
     def _wait(self, url, interval=1, max_attempts=10):
         '''
@@ -233,10 +2611,10 @@ class phantasm(object):
             status = post_response.json().get("status")
             success = post_response.json().get("success")
             count = post_response.json().get("count")
-            if status is in ['failed', 'success', 'new', 'closed', 'open']:
+            if status in ['failed', 'success', 'new', 'closed', 'open']:
                 return post_response.json()
-            elif status is in ['pending', 'running'']:
-                time.sleep(interval)
+            elif status in ['pending', 'running']:
+                self._sleep(interval)
                 continue
             elif success:
                 return post_response.json()
@@ -277,6 +2655,20 @@ class phantasm(object):
         Returns:
             Response (json)                 - The JSON data of the action
         '''
+        post_data = self._container_payload(name, artifacts, custom_fields, data, description, label, run_automation, sensitivity, severity, source_data_identifier, status, tags)
+
+        post_response = self._sess.post(self._url('container'), json=post_data)
+        self._set_container_id(post_response.json().get('id'))
+        return post_response.json()
+
+    @staticmethod
+    def _container_payload(name="TEST - Default Name",artifacts=[],custom_fields={},data={},description="This originated from a PyTest Case",label="events",run_automation=True,sensitivity="white",severity="low",source_data_identifier="",status="new",tags=[]):
+        '''
+        Function: _container_payload
+
+        Description:
+        Builds the JSON payload of a container, taking the same arguments (and defaults) as create_container.
+        '''
         post_data = {}
         post_data['artifacts'] = artifacts
         post_data['custom_fields'] = custom_fields
@@ -290,21 +2682,91 @@ class phantasm(object):
         post_data['source_data_identifier'] = source_data_identifier
         post_data['status'] = status
         post_data['tags'] = tags
+        return post_data
 
-        post_response = self._sess.post(self._url('container'), json=post_data)
-        self._set_container_id(post_response.json().get('id'))
-        return post_response.json()
+    def seed_container(self, settle=None, batch_size=500, **container):
+        '''
+        Function: seed_container
+
+        Description:
+        Creates a container with its artifacts so that automation is triggered exactly once, instead of once for the container and again for every artifact added. Used as a context manager, artifacts are collected with add_artifact, and when the block exits the container is created with them embedded in the same request. Only the last artifact has run_automation set, so the active playbooks are evaluated once, with every artifact in place.
+
+        e.g.
+            with ph.seed_container(name="Phishing test", label="email", settle=5) as seed:
+                seed.add_artifact(cef={'fromEmail': 'attacker@example.com'})
+                seed.add_artifact(cef={'requestURL': 'https://example.com/login'})
+            print(seed.report)
+
+        Args:
+            (optional) settle (int)         - If provided, the number of seconds to wait after seeding before counting the playbook runs that were triggered
+            (optional) batch_size (int)     - The maximum number of artifacts sent in one request. Any beyond the first batch are posted together afterwards, with automation still triggered only by the last.
+            (optional) container (kwargs)   - The arguments of create_container (name, label, severity, tags...). run_automation decides whether the automation is triggered at all.
+
+        Returns:
+            (containerSeed)                 - The seed, whose report has the container_id, the number of artifacts, requests made, automation triggers and playbook runs
+        '''
+        return containerSeed(self, container, settle, batch_size)
+
+    def create_containers(self, containers, max_workers=8):
+        '''
+        Function: create_containers
+
+        Description:
+        Creates many containers concurrently, each with its artifacts embedded in the same request. The containers are read from the iterable as they are needed, so a generator (e.g. syntheticData.containers, or one of its batches) can be streamed straight in without holding every payload in memory.
+
+        Args:
+            containers (iterable)           - The container payloads, as the arguments of create_container (including an 'artifacts' list of artifact payloads)
+            (optional) max_workers (int)    - The maximum number of containers to create at once
+
+        Returns:
+            (dict)                          - The ids of the created containers, the number of containers, artifacts and failures, the duration, and the containers and artifacts created per second
+        '''
+        def create(payload):
+            post_response = self._sess.post(self._url('container'), json=payload)
+            return post_response.json().get('id'), len(payload.get('artifacts', []))
+
+        create = _carry_deadline(create)
+        summary = {'ids': [], 'containers': 0, 'artifacts': 0, 'failed': 0, 'errors': []}
+        started = time.time()
+        payloads = iter(containers)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            in_flight = set(executor.submit(create, payload) for payload in itertools.islice(payloads, max_workers * 2))
+            while in_flight:
+                done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        container_id, artifact_count = future.result()
+                    except Exception as create_error:
+                        summary['failed'] += 1
+                        summary['errors'].append(str(create_error))
+                        continue
+                    if not container_id:
+                        summary['failed'] += 1
+                        continue
+                    summary['ids'].append(container_id)
+                    summary['containers'] += 1
+                    summary['artifacts'] += artifact_count
+                in_flight.update(executor.submit(create, payload) for payload in itertools.islice(payloads, len(done)))
+        finally:
+            executor.shutdown(wait=False)
+
+        summary['duration'] = time.time() - started
+        summary['containers_per_second'] = summary['containers'] / summary['duration'] if summary['duration'] else None
+        summary['artifacts_per_second'] = summary['artifacts'] / summary['duration'] if summary['duration'] else None
+        logger.debug("Created {} containers with {} artifacts in {:.2f}s".format(summary['containers'], summary['artifacts'], summary['duration']))
+        return summary
 
     def update_container_status(self,status="resolved",container_id=None):
         '''
         Function: update_container_status
 
         Description:
-        Promotes the current container to a case, built in to the phantom case management system. It uses the template of another already existing case.
+        Updates the status of the container. To update many containers, use update_containers.
 
         Args:
             (optional) status (str)         - The Status to update the container to, defaults to resolved
-            (optional) contianer_id (str)   - The Container ID, defaults to current container
+            (optional) container_id (str)   - The Container ID, defaults to current container
 
         Returns:
             Response (json)                 - The JSON data of the action
@@ -315,7 +2777,7 @@ class phantasm(object):
         post_data['container_id'] = container_id
         post_data['status'] = status
         url = self._url('container/{}'.format(container_id))
-        post_response = self._sess.post(url)
+        post_response = self._sess.post(url, json=post_data)
 
         return post_response.json()
 
@@ -325,7 +2787,7 @@ class phantasm(object):
         Function: update_container_tags
 
         Description:
-        Promotes the current container to a case, built in to the phantom case management system. It uses the template of another already existing case.
+        Sets the tags of the container. To update many containers, use update_containers.
 
         Args:
             (optional) tags (dict)          - A dictionary of tags to add to the container.
@@ -340,10 +2802,105 @@ class phantasm(object):
         post_data['container_id'] = container_id
         post_data['tags'] = tags
         url = self._url('container/{}'.format(container_id))
-        post_response = self._sess.post(url)
+        post_response = self._sess.post(url, json=post_data)
 
         return post_response.json()
 
+    def update_containers(self, container_ids=None, filters=None, status=None, tags=None, add_tags=None, max_workers=8, batch_size=100, rate=None, retries=3, backoff=1):
+        '''
+        Function: update_containers
+
+        Description:
+        Updates the status and/or tags of many containers, e.g. closing out or tagging every container left by a test run. Phantom updates one container per request, so the containers are worked through in batches, with the containers of each batch updated concurrently. The update rate can be limited, and updates that fail because Phantom is busy (429 or 5xx) or can't be reached are retried with an exponential backoff. Other failures (e.g. a 400 for a missing required field) are not retried.
+
+        Args:
+            (optional) container_ids (iterable) - The ids of the containers to update
+            (optional) filters (Q)          - Instead of container_ids, updates every container matching the filters, e.g. Q(tags__icontains="pytest") & ~Q(status="closed")
+            (optional) status (str)         - The status to set
+            (optional) tags (list)          - The tags to set, replacing the existing tags
+            (optional) add_tags (list)      - Tags to add to the existing tags (the container is retrieved first)
+            (optional) max_workers (int)    - The maximum number of containers updated at once
+            (optional) batch_size (int)     - The number of containers in each batch
+            (optional) rate (float)         - The maximum number of updates per second, unlimited by default
+            (optional) retries (int)        - The number of times a failed update is retried
+            (optional) backoff (float)      - The delay before the first retry in seconds, doubling for each retry
+
+        Returns:
+            (dict)                          - The 'results' of each container (updated, attempts, error and time), and a 'summary' of the counts, retries, duration and containers updated per second
+        '''
+        if status is None and tags is None and add_tags is None:
+            raise containerException('Nothing to update, provide a status, tags or add_tags')
+        if container_ids is None:
+            if filters is None:
+                raise containerException('Provide the container_ids or filters of the containers to update')
+            # Listed before updating, as the updates can change which containers match (and so the pages)
+            container_ids = [container.get('id') for container in self._iter_query('container', filters, include_expensive=False)]
+
+        limiter = _rateLimiter(rate) if rate else None
+
+        def update(container_id):
+            outcome = {'updated': False, 'attempts': 0, 'error': None}
+            started = time.time()
+            for attempt in range(retries + 1):
+                outcome['attempts'] += 1
+                try:
+                    if limiter:
+                        limiter.acquire()
+                    post_data = {}
+                    if status is not None:
+                        post_data['status'] = status
+                    if tags is not None:
+                        post_data['tags'] = list(tags)
+                    if add_tags:
+                        current = post_data.get('tags')
+                        if current is None:
+                            current = self._sess.get(self._url('container/{}'.format(container_id))).json().get('tags') or []
+                        post_data['tags'] = current + [tag for tag in add_tags if tag not in current]
+                    post_response = self._sess.post(self._url('container/{}'.format(container_id)), json=post_data)
+                    if post_response.json().get('failed'):
+                        raise containerException(post_response.json().get('message', 'The update failed'))
+                    outcome['updated'] = True
+                    outcome['error'] = None
+                    break
+                except requests.RequestException as update_error:
+                    # Timeouts, connection errors, throttling and server errors are retried, other client errors aren't
+                    outcome['error'] = str(update_error)
+                    response = getattr(update_error, 'response', None)
+                    if isinstance(update_error, requests.HTTPError) and response is not None:
+                        if response.status_code != 429 and response.status_code < 500:
+                            break
+                    elif not isinstance(update_error, (requests.Timeout, requests.ConnectionError)):
+                        break
+                except Exception as update_error:
+                    # Anything else (e.g. a rejected update, or a response that isn't JSON) is the outcome of this container, rather than ending the whole run
+                    outcome['error'] = str(update_error)
+                    break
+                if attempt < retries:
+                    self._sleep(backoff * 2 ** attempt)
+            outcome['time'] = time.time() - started
+            return outcome
+
+        update = _carry_deadline(update)
+        results = {}
+        started = time.time()
+        ids = iter(container_ids)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                batch = list(itertools.islice(ids, batch_size))
+                if not batch:
+                    break
+                for container_id, outcome in zip(batch, executor.map(update, batch)):
+                    results[container_id] = outcome
+                logger.debug("Updated {} containers, {:.2f}/s".format(len(results), len(results) / (time.time() - started)))
+
+        duration = time.time() - started
+        summary = {'total': len(results), 'updated': 0, 'failed': 0, 'retries': 0, 'duration': duration}
+        for outcome in results.values():
+            summary['updated' if outcome['updated'] else 'failed'] += 1
+            summary['retries'] += outcome['attempts'] - 1
+        summary['containers_per_second'] = summary['updated'] / duration if duration else None
+        return {'results': results, 'summary': summary}
+
     def get_last_created_container(self, container_tag=""):
         '''
         Function: get_last_created_container
@@ -357,36 +2914,127 @@ class phantasm(object):
         Returns:
             Response (json)                 - The JSON data of the action
         '''
-        filters = [] 
-        filters.append('tags__icontains="{}"&sort=id&order=desc'.format(container_tag))
-        url = self._url('container',page_size=1,filters=filters)
+        url = self._url('container',page_size=1,filters=Q(tags__icontains=container_tag),sort='id',order='desc')
         post_response = self._sess.get(url)
 
         return post_response.json()
 
 
-    def get_container_artifacts(self, container_id=None):
+    def get_containers(self, filters=None, stream=False, page_size=1000):
+        '''
+        Function: get_containers
+
+        Description:
+        Retrieves the list of containers, optionally filtered.
+
+        Args:
+            (optional) filters (Q)          - Filters to apply on the server, e.g. Q(label="events") & ~Q(status="closed")
+            (optional) stream (bool)        - Whether to page through the containers one at a time instead of loading them all
+            (optional) page_size (int)      - The number of containers to request per page when streaming
+
+        Returns:
+            Response (json)                 - The JSON data of the action, or a generator of each container when streaming
+        '''
+        if stream:
+            return self._iter_query('container', filters, page_size=page_size)
+        url = self._url('container', filters=filters)
+        get_response = self._sess.get(url)
+
+        return get_response.json()
+
+    def get_container_artifacts(self, container_id=None, stream=False, filters=None):
         '''
         Function: get_container_artifacts
 
         Description:
-        Promotes the current container to a case, built in to the phantom case management system. It uses the template of another already existing case.
+        Retrieves the list of artifacts currently in the container. For containers with a very large number of artifacts, use iter_container_artifacts.
 
         Args:
-            template_name (str)             - The name of the Phantom case template, which will be used as the basis for the case.
-            (optional) container_id (str)   - The Container ID to promote (defaults to existing case if there is one)
+            (optional) container_id (str)   - The Container ID (defaults to the current container)
+            (optional) stream (bool)        - Whether to stream the artifacts one at a time instead of loading the whole response
+            (optional) filters (Q)          - Further filters to apply on the server, e.g. Q(label="events")
 
         Returns:
-            Response (json)                 - The JSON data of the action
+            Response (json)                 - The JSON data of the action, or a generator of each artifact when streaming
         '''
         if not container_id:
             container_id = self._get_container_id()
-        filter = []
-        filter.append('container={}'.format(container_id))
-        post_response = self._sess.post(self._url('artifact', filter))
+        filters = Q(container=container_id) & filters
+        url = self._url('artifact', filters)
+        if stream:
+            return self._stream_data(url)
+        post_response = self._sess.get(url)
 
         return post_response.json()
 
+    def iter_container_artifacts(self, container_id=None, fields=None, since_id=None, page_size=1000, prefetch=2, filters=None):
+        '''
+        Function: iter_container_artifacts
+
+        Description:
+        Iterates over the artifacts of a container with flat memory, however many artifacts it holds. Artifacts are requested in pages of ascending id, each page starting after the last id seen (rather than at an offset, which gets slower the deeper it goes and shifts when artifacts are added). Each page is streamed and decoded one artifact at a time on a background thread, which fetches up to prefetch pages ahead while the caller works through the current one. Iteration can be resumed by passing the id of the last artifact seen as since_id.
+
+        Args:
+            (optional) container_id (str)   - The Container ID, defaults to the current container
+            (optional) fields (list)        - The fields of each artifact to return (e.g. ['id', 'cef']), by default all of them. The id is always included.
+            (optional) since_id (int)       - Only return artifacts with an id greater than this, e.g. the last id seen before an interruption
+            (optional) page_size (int)      - The number of artifacts to request at a time
+            (optional) prefetch (int)       - The number of pages that may be fetched ahead of the caller
+            (optional) filters (Q)          - Further filters to apply on the server, e.g. Q(label="events")
+
+        Returns:
+            (generator)                     - The JSON of each artifact
+        '''
+        if not container_id:
+            container_id = self._get_container_id()
+        if fields is not None:
+            fields = set(fields) | {'id'}
+
+        buffered = queue.Queue(maxsize=max(1, page_size * prefetch))
+        stopped = threading.Event()
+        finished = object()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    buffered.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            last_id = since_id
+            try:
+                while not stopped.is_set():
+                    page_filters = Q(container=container_id) & filters
+                    if last_id is not None:
+                        page_filters &= Q(id__gt=last_id)
+                    count = 0
+                    for artifact in self._stream_data(self._url('artifact', page_filters, page_size=page_size, sort='id', order='asc'), fields=fields):
+                        if not put(artifact):
+                            return
+                        count += 1
+                        last_id = artifact.get('id')
+                    if count < page_size:
+                        break
+                put(finished)
+            except Exception as fetch_error:
+                put(fetch_error)
+
+        fetcher = threading.Thread(target=_carry_deadline(fetch), name='phantasm-artifacts-{}'.format(container_id), daemon=True)
+        fetcher.start()
+        try:
+            while True:
+                item = buffered.get()
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+
     def promote_container_to_case(self, template_name, container_id=None):
         '''
         Function: promote_container_to_case
@@ -404,12 +3052,15 @@ class phantasm(object):
         if not container_id:
             container_id = self._get_container_id()
         # First we need to get the template id, based on the template name
-        url = self._url('name="{}"').format(template_name)
-        post_response = self._sess.post(url)
+        if self._index is not None:
+            template_id = self._index.get('workflow_template', template_name)['id']
+        else:
+            url = self._url('workflow_template', filters=Q(name=template_name), page_size=1)
+            post_response = self._sess.get(url)
 
-        response_json = post_response.json()
+            response_json = post_response.json()
 
-        template_id = response_json['data'][0]['id']
+            template_id = response_json['data'][0]['id']
         self._set_template_id(template_id)
         self._set_template_name(template_name)
 
@@ -417,8 +3068,8 @@ class phantasm(object):
         post_data = {}
         post_data['container_type'] = 'case'
         post_data['template_id'] = template_id
-        url = self._url('rest/container/{}').format(container_id)
-        post_response = self._sess.post(url)
+        url = self._url('container/{}'.format(container_id))
+        post_response = self._sess.post(url, json=post_data)
         self._set_case_id(post_response.json().get('id'))
 
         return post_response.json()
@@ -561,10 +3212,27 @@ class phantasm(object):
         if not container_id:
             container_id = self._get_container_id()
 
+        post_data = self._artifact_payload(cef, cef_types, data, description, label, name, run_automation, severity, source_data_identifier, tags)
+        post_data['container_id'] = container_id
+
+        post_response = self._sess.post(self._url('artifact'), json=post_data)
+        self._set_artifact_id(post_response.json().get('id'))
+        self._set_artifact_name(name)
+
+        return post_response.json()
+
+    
+    @staticmethod
+    def _artifact_payload(cef={},cef_types={},data={},description="TESTING: Creating artifact for testing purposes",label="events",name="Test Artifact",run_automation=True,severity="low",source_data_identifier="", tags=[]):
+        '''
+        Function: _artifact_payload
+
+        Description:
+        Builds the JSON payload of an artifact, taking the same arguments (and defaults) as add_artifact, without the container.
+        '''
         post_data = {}
         post_data['cef'] = cef
         post_data['cef_types'] = cef_types
-        post_data['container_id'] = container_id
         post_data['data'] = data
         post_data['description'] = description
         post_data['label'] = label
@@ -573,14 +3241,8 @@ class phantasm(object):
         post_data['severity'] = severity
         post_data['source_data_identifier'] = source_data_identifier
         post_data['tags'] = tags
+        return post_data
 
-        post_response = self._sess.post(self.url('artifact'), json=post_data)
-        self._set_artifact_id(post_response.json().get('id'))
-        self._set_artifact_name(name)
-
-        return post_response.json()
-
-    
     def get_last_created_artifact(self, artifact_tag=""):
         '''
         Function: get_last_created_artifact
@@ -594,9 +3256,7 @@ class phantasm(object):
         Returns:
             Response (json)                 - The JSON data of the action
         '''
-        filters = [] 
-        filters.append('tags__icontains="{}"&sort=id&order=desc'.format(container_tag))
-        url = self._url('artifact',page_size=1,filters=filters)
+        url = self._url('artifact',page_size=1,filters=Q(tags__icontains=artifact_tag),sort='id',order='desc')
         post_response = self._sess.get(url)
 
         return post_response.json()
@@ -626,49 +3286,335 @@ class phantasm(object):
     """
     Files: Functions
     """
-    def upload_file_to_phantom(self, file_name, container_id=None):
+    def upload_file_to_phantom(self, file_name, container_id=None, deduplicate=True):
+        '''
+        Function: upload_file_to_phantom
+
+        Description:
+        Uploads a file to the vault of the container. When deduplicating, the file is hashed first, and if the vault already holds the same contents (known locally, or found by asking Phantom) the existing vault entry is attached instead of sending the file again. The vault id of the file is recorded in file_id, as upload_many does.
+
+        Args:
+            file_name (str)     - The path and filename of the file to be uploaded.
+            (optional) container_id (str)       - The ID of the container
+            (optional) deduplicate (bool)       - Whether to reuse an existing vault entry with the same contents
+
+        Returns:
+            Response (json)                - The JSON data of the action
+        '''
+        if not container_id:
+            container_id = self._get_container_id()
+
+        if os.path.exists(file_name):
+            def read():
+                with open(file_name, 'rb') as imported_file:
+                    try:
+                        return imported_file.read()
+                    except IOError as read_error:
+                        print('Failed to Read File ({}): {}'.format(read_error.errno, read_error.strerror))
+                    except:
+                        print('Unexpected Error: {}'.format(sys.exc_info()[0]))
+
+            response_json, _ = self._upload_contents(file_name, read, container_id, self._hash_file(file_name) if deduplicate else None)
+            if response_json is not None:
+                self._set_file_id(response_json.get('vault_id') or response_json.get('hash'))
+                self._set_file_name(file_name)
+            return response_json
+
+    def _upload_contents(self, file_name, read, container_id, hashes=None):
+        '''
+        Function: _upload_contents
+
+        Description:
+        Uploads the contents of a file to the vault of a container, or attaches the existing vault entry when the hashes show the vault already holds the same contents. It doesn't change the file state of the instance, so it can be called from several threads at once.
+
+        Args:
+            file_name (str)                 - The name to give the file in the vault
+            read (function)                 - Returns the contents of the file, only called if they need to be uploaded
+            container_id (str)              - The ID of the container
+            (optional) hashes (tuple)       - The SHA-256 and SHA-1 of the contents, to deduplicate with
+
+        Returns:
+            (tuple)                         - The JSON data of the action (or None if there were no contents), and whether an existing vault entry was attached
+        '''
+        if hashes:
+            file_hash, vault_hash = hashes
+            vault_id = self._vault_index.get(file_hash) or self._find_vault_document(vault_hash)
+            if vault_id:
+                response_json = self._attach_vault_document(vault_id, file_name, container_id)
+                if response_json:
+                    self._vault_index[file_hash] = vault_id
+                    return response_json, True
+
+        file_contents = read()
+        if not file_contents:
+            return None, False
+        serialised_contents = base64.b64encode(file_contents).decode()
+
+        post_data = dict()
+        post_data['container_id'] = container_id
+        post_data['file_content'] = serialised_contents
+        post_data['file_name'] = file_name
+        post_data['metadata'] = "{'contains': ['vault id']}"
+
+        post_response = self._sess.post(self._url('container_attachment'), json=post_data)
+        response_json = post_response.json()
+        if hashes and response_json.get('vault_id'):
+            self._vault_index[hashes[0]] = response_json.get('vault_id')
+        return response_json, False
+
+    def upload_many(self, files, container_id=None, max_workers=4, deduplicate=True, progress_interval=10):
+        '''
+        Function: upload_many
+
+        Description:
+        Uploads many files to the vault of a container in parallel, with at most max_workers uploads at once. Files on disk are read by the upload threads, so only the files being uploaded are held in memory. As with upload_file_to_phantom, files the vault already holds are attached rather than sent again. Progress (files, bytes and bytes/s) is logged every progress_interval seconds, and the vault id of every file is recorded in file_id.
+
+        Args:
+            files (iterable)                - The paths of the files, or (file_name, contents) pairs of files that aren't on disk (e.g. archive members)
+            (optional) container_id (str)   - The ID of the container, defaults to the current container
+            (optional) max_workers (int)    - The maximum number of files uploaded at once
+            (optional) deduplicate (bool)   - Whether to reuse existing vault entries with the same contents
+            (optional) progress_interval (int) - The period between logging the progress
+
+        Returns:
+            (dict)                          - The 'results' of each file (file_name, id, vault_id, size, deduplicated, time and error), and a 'summary' of the counts, bytes, duration and bytes/s
+        '''
+        if not container_id:
+            container_id = self._get_container_id()
+
+        def upload(source):
+            started = time.time()
+            result = {'file_name': source if isinstance(source, str) else source[0], 'id': None, 'vault_id': None, 'size': 0, 'deduplicated': False, 'error': None}
+            try:
+                if isinstance(source, str):
+                    result['size'] = os.path.getsize(source)
+                    hashes = self._hash_file(source) if deduplicate else None
+
+                    def read():
+                        with open(source, 'rb') as imported_file:
+                            return imported_file.read()
+                else:
+                    contents = source[1]
+                    result['size'] = len(contents)
+                    hashes = (hashlib.sha256(contents).hexdigest(), hashlib.sha1(contents).hexdigest()) if deduplicate else None
+                    read = lambda: contents
+                response_json, result['deduplicated'] = self._upload_contents(result['file_name'], read, container_id, hashes)
+                if response_json is None:
+                    result['error'] = 'The file is empty'
+                else:
+                    result['id'] = response_json.get('id')
+                    result['vault_id'] = response_json.get('vault_id') or response_json.get('hash')
+                    if response_json.get('failed'):
+                        result['error'] = response_json.get('message', 'The upload failed')
+            except Exception as upload_error:
+                result['error'] = str(upload_error)
+            result['time'] = time.time() - started
+            return result
+
+        upload = _carry_deadline(upload)
+        results = []
+        summary = {'files': 0, 'uploaded': 0, 'deduplicated': 0, 'failed': 0, 'bytes': 0}
+        started = reported = time.time()
+        sources = iter(files)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            # Only a couple of files per worker are queued, so the contents of archive members aren't all held at once
+            in_flight = set(executor.submit(upload, source) for source in itertools.islice(sources, max_workers * 2))
+            while in_flight:
+                done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    results.append(result)
+                    summary['files'] += 1
+                    if result['error']:
+                        summary['failed'] += 1
+                        continue
+                    summary['deduplicated' if result['deduplicated'] else 'uploaded'] += 1
+                    summary['bytes'] += result['size']
+                    self._set_file_id(result['vault_id'])
+                    self._set_file_name(result['file_name'])
+                in_flight.update(executor.submit(upload, source) for source in itertools.islice(sources, len(done)))
+                if time.time() - reported >= progress_interval:
+                    reported = time.time()
+                    logger.info("Uploaded {} files, {} bytes, {:.0f} bytes/s".format(summary['files'], summary['bytes'], summary['bytes'] / (reported - started)))
+        finally:
+            executor.shutdown(wait=False)
+
+        summary['duration'] = time.time() - started
+        summary['bytes_per_second'] = summary['bytes'] / summary['duration'] if summary['duration'] else None
+        return {'results': results, 'summary': summary}
+
+    def upload_directory(self, directory, container_id=None, pattern='*', recursive=True, expand_archives=False, password=None, max_workers=4, deduplicate=True, progress_interval=10):
+        '''
+        Function: upload_directory
+
+        Description:
+        Uploads every file in a directory (e.g. a set of malware samples) to the vault of a container in parallel, using upload_many. Zip and tar archives (by their extension, so e.g. Office documents and jars, which are zips too, are uploaded as they are) can be expanded, so their members are uploaded instead (see upload_archive).
+
+        Args:
+            directory (str)                 - The path of the directory
+            (optional) container_id (str)   - The ID of the container, defaults to the current container
+            (optional) pattern (str)        - Only files with names matching this glob pattern are uploaded, e.g. '*.exe'
+            (optional) recursive (bool)     - Whether to include the files in sub-directories
+            (optional) expand_archives (bool) - Whether to upload the members of zip and tar archives rather than the archives themselves
+            (optional) password (str)       - The password of encrypted zip archives (e.g. 'infected')
+            (optional) max_workers (int)    - The maximum number of files uploaded at once
+            (optional) deduplicate (bool)   - Whether to reuse existing vault entries with the same contents
+            (optional) progress_interval (int) - The period between logging the progress
+
+        Returns:
+            (dict)                          - As returned by upload_many
+        '''
+        def sources():
+            for root, directories, file_names in os.walk(directory):
+                directories.sort()
+                for file_name in sorted(fnmatch.filter(file_names, pattern)):
+                    path = os.path.join(root, file_name)
+                    if expand_archives and file_name.lower().endswith(self._archive_extensions) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path)):
+                        for member in self._archive_members(path, password):
+                            yield member
+                    else:
+                        yield path
+                if not recursive:
+                    return
+
+        return self.upload_many(sources(), container_id, max_workers, deduplicate, progress_interval)
+
+    def upload_archive(self, archive_name, container_id=None, password=None, max_workers=4, deduplicate=True, progress_interval=10):
+        '''
+        Function: upload_archive
+
+        Description:
+        Uploads the members of a zip or tar archive (optionally compressed) to the vault of a container in parallel, using upload_many. The members are read from the archive as they are uploaded, and are never extracted to disk. Each member is named after its path within the archive.
+
+        Args:
+            archive_name (str)              - The path of the zip or tar archive
+            (optional) container_id (str)   - The ID of the container, defaults to the current container
+            (optional) password (str)       - The password of an encrypted zip archive (e.g. 'infected')
+            (optional) max_workers (int)    - The maximum number of files uploaded at once
+            (optional) deduplicate (bool)   - Whether to reuse existing vault entries with the same contents
+            (optional) progress_interval (int) - The period between logging the progress
+
+        Returns:
+            (dict)                          - As returned by upload_many
+        '''
+        return self.upload_many(self._archive_members(archive_name, password), container_id, max_workers, deduplicate, progress_interval)
+
+    # Extensions of the archives upload_directory expands, which leaves alone other zip based formats (e.g. docx, xlsx, jar and apk)
+    _archive_extensions = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+    @staticmethod
+    def _archive_members(archive_name, password=None):
+        '''
+        Function: _archive_members
+
+        Description:
+        Reads the files in a zip or tar archive one at a time, without extracting them to disk.
+
+        Returns:
+            (generator)                     - The (file_name, contents) of each file in the archive
+        '''
+        if zipfile.is_zipfile(archive_name):
+            with zipfile.ZipFile(archive_name) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir():
+                        yield member.filename, archive.read(member, pwd=password.encode() if password else None)
+        elif tarfile.is_tarfile(archive_name):
+            # Streaming mode reads the archive in a single pass, even when it is compressed
+            with tarfile.open(archive_name, 'r|*') as archive:
+                for member in archive:
+                    if member.isfile():
+                        yield member.name, archive.extractfile(member).read()
+        else:
+            raise phantomException('{} is not a zip or tar archive'.format(archive_name))
+
+    @staticmethod
+    def _hash_file(file_name, chunk_size=1048576):
+        '''
+        Function: _hash_file
+
+        Description:
+        Hashes a file a chunk at a time, so large samples are never read into memory whole.
+
+        Returns:
+            (tuple)                         - The SHA-256 of the contents (used for the local index), and the SHA-1 (which Phantom uses as the vault id)
+        '''
+        sha256 = hashlib.sha256()
+        sha1 = hashlib.sha1()
+        with open(file_name, 'rb') as hashed_file:
+            for chunk in iter(lambda: hashed_file.read(chunk_size), b''):
+                sha256.update(chunk)
+                sha1.update(chunk)
+        return sha256.hexdigest(), sha1.hexdigest()
+
+    def _find_vault_document(self, vault_hash):
+        '''
+        Function: _find_vault_document
+
+        Description:
+        Asks Phantom whether the vault already holds a file with the given hash.
+
+        Returns:
+            (str)                           - The vault id of the existing file, or None
+        '''
+        get_response = self._sess.get(self._url('vault_document', filters=Q(hash=vault_hash), page_size=1))
+        documents = get_response.json().get('data', [])
+        if documents:
+            return documents[0].get('hash')
+        return None
+
+    def _attach_vault_document(self, vault_id, file_name, container_id):
+        '''
+        Function: _attach_vault_document
+
+        Description:
+        Attaches a file that is already in the vault to a container, without sending the contents again.
+
+        Returns:
+            Response (json)                 - The JSON data of the action, or None if it could not be attached (refused, a connection error or a response that isn't JSON), the caller then uploads the file instead
         '''
-        Function: upload_file_to_phantom
+        post_data = dict()
+        post_data['container_id'] = container_id
+        post_data['vault_id'] = vault_id
+        post_data['file_name'] = file_name
+        post_data['metadata'] = "{'contains': ['vault id']}"
+
+        try:
+            post_response = self._sess.post(self._url('container_attachment'), json=post_data)
+            response_json = post_response.json()
+        except (requests.exceptions.RequestException, ValueError) as attach_error:
+            logger.debug("Unable to attach vault id {} to container {}: {}".format(vault_id, container_id, attach_error))
+            return None
+        if response_json.get('failed'):
+            return None
+        return response_json
+
+    def save_vault_index(self, file_name):
+        '''
+        Function: save_vault_index
 
         Description:
-        Uploads a file to the vault of the container.
+        Saves the local index of file hashes to vault ids, so it can be reused by later runs.
 
         Args:
-            file_name (str)     - The path and filename of the file to be uploaded.
-            (optional) container_id (str)       - The ID of the container
+            file_name (str)                 - The path of the JSON file to write
+        '''
+        with open(file_name, 'w') as index_file:
+            json.dump(self._vault_index, index_file)
 
-        Returns:
-            Response (json)                - The JSON data of the action
+    def load_vault_index(self, file_name):
         '''
-        if not container_id:
-            container_id = self._get_container_id()
+        Function: load_vault_index
 
-        if os.path.exists(file_name):
-            with open(filename, 'rb') as imported_file:
-                try:
-                    file_contents = imported_file.read()
-                except IOError as read_error:
-                    print('Failed to Read File ({}): {}').format(read_error.errno, read_error.strerror)
-                except:
-                    print('Unexpected Error: {}').format(sys.exc_info()[0])
-            if file_contents:
-                serialised_contents = base64.b64encode(file_contents).decode()
-
-                post_data = dict()
-                post_data['container_id'] = container_id
-                post_data['file_content'] = serialised_contents
-                post_data['file_name'] = file_name
-                post_data['metadata'] = "{'contains': ['vault id']}"
-
-                post_json = json.dumps(post_data)
-
-                post_response = self._sess.post(self._url('container_attachment'), json=post_json)
-                self._set_file_id(response_to_post.json().get('id'))
-                self._set_file_name(file_name)
-                return post_response.json()
-            else:
-                return None
+        Description:
+        Loads a local index of file hashes to vault ids that was saved by save_vault_index.
 
+        Args:
+            file_name (str)                 - The path of the JSON file to read
+        '''
+        if os.path.exists(file_name):
+            with open(file_name) as index_file:
+                self._vault_index.update(json.load(index_file))
 
     """
     Files: Setting and Getting Variables
@@ -694,6 +3640,9 @@ class phantasm(object):
     """
     Playbooks: Functions
     """
+    _system_failure_impacted_filter = Q(status="failed", message__contains="system/daemon start")
+    _system_failure_pending_filter = Q(playbookrun__container__isnull=True)
+
     def run_playbook(self, playbook_name, container_id=None, scope='new', run_confirmation=True):
         '''
         Function: run_playbook
@@ -719,14 +3668,62 @@ class phantasm(object):
         post_data['scope'] = scope
         post_data['run'] = run_confirmation
 
-        post_json = json.dumps(post_data)
-
-        post_response = self._sess.post(self._url('playbook_run'), json=post_json)
+        submitted = time.time()
+        post_response = self._sess.post(self._url('playbook_run'), json=post_data)
         self._set_playbook_run_id(post_response.json().get('playbook_run_id'))
         self._set_playbook_name(playbook_name)
+        self._playbook_submitted[post_response.json().get('playbook_run_id')] = (playbook_name, submitted)
 
         return post_response.json()
 
+    def wait_for_playbook(self, playbook_id=None, interval=1, max_attempts=60, include_actions=True):
+        '''
+        Function: wait_for_playbook
+
+        Description:
+        Waits until a playbook run reaches a terminal status, and measures how long it took from submission (when it was started by this object) to completion.
+
+        Args:
+            (optional) playbook_id (str)        - The Phantom Playbook Run ID to wait for, by default will use the last run playbook.
+            (optional) interval (int)           - The period between polling
+            (optional) max_attempts (int)       - The amount of times to poll
+            (optional) include_actions (bool)   - Whether to also retrieve the duration of each action in the playbook
+
+        Returns:
+            (dict)                              - The playbook_run_id, playbook name, status, duration in seconds, the duration of each action, and the playbook run JSON
+        '''
+        if playbook_id is None:
+            playbook_id = self._playbook_run_id[-1]
+
+        url = self._url('playbook_run/{}'.format(playbook_id), include_expensive=False)
+        for attempt in range(max_attempts):
+            playbook_run = self._sess.get(url).json()
+            if playbook_run.get('status') not in ['pending', 'running']:
+                break
+            self._sleep(interval)
+        else:
+            raise playbookException('Playbook run {} has not finished after {} attempts'.format(playbook_id, max_attempts))
+        completed = time.time()
+
+        playbook_name, submitted = self._playbook_submitted.get(playbook_id, (None, None))
+        run = {}
+        run['playbook_run_id'] = playbook_id
+        run['playbook'] = playbook_name or playbook_run.get('playbook_name') or playbook_run.get('playbook')
+        run['status'] = playbook_run.get('status')
+        if submitted:
+            run['duration'] = completed - submitted
+        else:
+            start = _parse_time(playbook_run.get('start_time') or playbook_run.get('create_time'))
+            end = _parse_time(playbook_run.get('end_time') or playbook_run.get('update_time'))
+            run['duration'] = end - start if start and end else None
+        run['actions'] = {}
+        if include_actions:
+            for timeline in self.profile_playbook_run(playbook_id)['actions']:
+                run['actions'][timeline['name']] = run['actions'].get(timeline['name'], 0) + timeline['wait'] + timeline['execution']
+        run['playbook_run'] = playbook_run
+
+        return run
+
     def get_playbook_results(self, playbook_id=None, wait=True, interval=1, max_attempts=10):
         '''
         Function: get_playbook_results
@@ -751,7 +3748,7 @@ class phantasm(object):
 
         return get_response.json()
 
-    def get_playbook_action_results(self, action, playbook_id=None, wait=True, interval=1, max_attempts=10):
+    def get_playbook_action_results(self, action, playbook_id=None, wait=True, interval=1, max_attempts=10, stream=False, filters=None, extract=None):
         '''
         Function: get_playbook_action_results
 
@@ -764,18 +3761,25 @@ class phantasm(object):
             (optional) wait (bool)         - Whether the playbook should wait until it's completed
             (optional) interval (int)      - The period between polling
             (optional) max_attempts (int)  - The amount of times to poll
+            (optional) stream (bool)       - Whether to stream the app runs one at a time instead of loading the whole response
+            (optional) filters (Q)         - Further filters to apply on the server, e.g. Q(status="failed")
+            (optional) extract (jsonPath)  - A path (or a dict of names to paths) to pull out of the response as it streams, e.g. 'data[*].result_data[*].data[*].status'
 
         Returns:
-            Response (json)                - The JSON data of the action
+            Response (json)                - The JSON data of the action, a generator of each app run when streaming, or the values selected by extract
         '''
         if playbook_id is None:
             playbook_id = self._playbook_run_id[-1]
 
-        filters = []
-        filters.append("playbook_run_id={}".format(playbook_id))
-        filters.append('action="{}"'.format(action))
+        filters = Q(playbook_run_id=playbook_id, action=action) & filters
         url = self._url("app_run", filters=filters)
 
+        if stream or extract is not None:
+            if wait:
+                self._wait(self._url("app_run", filters=filters, page_size=1), interval, max_attempts)
+            if extract is not None:
+                return self._extract_data(url, extract)
+            return self._stream_data(url)
         post_response = self._sess.get(url)
         if wait:
             return self._wait(url, interval, max_attempts)
@@ -787,19 +3791,24 @@ class phantasm(object):
         Function: get_playbook_information
 
         Description:
-        Returns all of the information relating to a playbook, including the container ID that the playbook ran against.
+        Returns all of the information relating to a playbook, including the container ID that the playbook ran against. With a metadata index (see prefetch_metadata) the playbook name is resolved locally, and only the run is requested.
 
         Args:
-            (optional) playbook_name (str) - The name of the playbook to return the information of.
+            (optional) playbook_name (str) - The name of the playbook to return the information of, defaults to the last playbook run
 
         Returns:
             Response (json)                - The JSON data of the action
         '''
         if not playbook_name:
-            playbook_name = self._playbook_name
-        filters = []
-        filters.append('name__icontainers="{}"&order=desc'.format(playbook_name))
-        url = self._url('playbook_run',page_size=1,filters=filters)
+            playbook_name = self._playbook_name[-1] if self._playbook_name else ""
+        if self._index is not None:
+            # The index holds playbook names without their repository (e.g. 'Create JIRA Ticket' for 'phantom-playbook/Create JIRA Ticket')
+            playbook_ids = [playbook['id'] for playbook in self._index.lookup('playbook', playbook_name.split('/')[-1], match='substring')]
+            if not playbook_ids:
+                return {'count': 0, 'num_pages': 0, 'data': []}
+            url = self._url('playbook_run',page_size=1,filters=Q(playbook__in=playbook_ids),sort='id',order='desc')
+        else:
+            url = self._url('playbook_run',page_size=1,filters=Q(name__icontains=playbook_name),sort='id',order='desc')
         post_response = self._sess.get(url)
         return post_response.json()
 
@@ -817,25 +3826,22 @@ class phantasm(object):
         Returns:
             Response (json)                - The JSON data of the action
         '''
-        filters = []
         if container_id:
-            filters.append('container_id="{}"&order=desc'.format(container_id))
-            url = self._url("playbook_run",page_size=1,filters=filters)
+            url = self._url("playbook_run",page_size=1,filters=Q(container_id=container_id),sort='id',order='desc')
             post_response = self._sess.get(url)
             if wait:
                 return self._wait(url, interval, max_attempts)
             else:
                 return post_response.json()
         elif playbook_name:
-            filters.append('message__icontains="{}"&order=desc'.format(playbook_name))
-            url = self._url("playbook_run",page_size=1,filters=filters)
+            url = self._url("playbook_run",page_size=1,filters=Q(message__icontains=playbook_name),sort='id',order='desc')
             post_response = self._sess.get(url)
             if wait:
                 return self._wait(url, interval, max_attempts)
             else:
                 return post_response.json()
         else:
-            url = self._url("playbook_run",page_size=1,filters=filters)
+            url = self._url("playbook_run",page_size=1,sort='id',order='desc')
             post_response = self._sess.get(url)
             if wait:
                 return self._wait(url, interval, max_attempts)
@@ -869,60 +3875,417 @@ class phantasm(object):
 
         return post_response.json()
 
-    def get_system_failure_impacted_playbooks(self,start_date=None,end_date=None):
+    def get_system_failure_impacted_playbooks(self,start_date=None,end_date=None,stream=False,filters=None):
         '''
         Function: get_system_failure_impacted_playbooks
 
         Description:
         Identifies playbooks that didn't complete executing due to a system failure in Phantom.
-            /rest/playbook_run?page_size=0&_filter_status="failed"&sort=id&order=desc&_filter_message__contains="system/daemon start"&_filter_create_time__range("2019-03-11","2013-04-11")
+            /rest/playbook_run?page_size=0&_filter_status="failed"&sort=id&order=desc&_filter_message__contains="system/daemon start"&_filter_create_time__range=["2019-03-11","2013-04-11"]
 
         Args:
             (optional) start_date (str)    - The starting date to begin filtering the playbooks by
             (optional) end_date (str)      - The end date to filter the playbooks by
+            (optional) stream (bool)       - Whether to stream the results one at a time instead of loading the whole response
+            (optional) filters (Q)         - Further filters to apply on the server
 
         Returns:
-            Response (json)                - The JSON data of the action
+            Response (json)                - The JSON data of the action, or a generator of each result when streaming
         '''
-        filters = []
-        filters.append('status="failed"&sort=id&order=desc')
-        filters.append('message__contains="system/daemon start"')
+        filters = self._system_failure_impacted_filter & filters
         if start_date and end_date:
-            filters.append('create_time__range("{}","{}")'.format(start_date,end_date))
-        
-        url = self._url("playbook_run",page_size=0,filters=filters)
+            filters &= Q(create_time__range=(start_date,end_date))
+
+        if stream:
+            return self._iter_query("playbook_run", filters, order='desc')
+        url = self._url("playbook_run",page_size=0,filters=filters,sort='id',order='desc')
         post_response = self._sess.get(url)
 
         return post_response.json()    
 
         r = self.query(query_type="playbook_run",page_size=0,filters=filters,wait=False)
 
-    def get_system_failure_pending_playbooks(self,start_date=None,end_date=None):
+    def get_system_failure_pending_playbooks(self,start_date=None,end_date=None,stream=False,filters=None):
         '''
         Function: get_system_failure_impacted_playbooks
 
         Description:
         Identifies playbooks that were pending execution, but did not get to begin due to a failure in Phantom. These playbooks never would have executed post-recovery.
-            /rest/container?page_size=0&sort=id&order=desc&_filter_playbookrun__container__isnull=True&_filter_create_time__range("2019-03-11","2019-04-11")0
+            /rest/container?page_size=0&sort=id&order=desc&_filter_playbookrun__container__isnull=True&_filter_create_time__range=["2019-03-11","2019-04-11"]
 
         Args:
             (optional) start_date (str)    - The starting date to begin filtering the playbooks by
             (optional) end_date (str)      - The end date to filter the playbooks by
+            (optional) stream (bool)       - Whether to stream the results one at a time instead of loading the whole response
+            (optional) filters (Q)         - Further filters to apply on the server
 
         Returns:
-            Response (json)                - The JSON data of the action
+            Response (json)                - The JSON data of the action, or a generator of each result when streaming
         '''
-        filters = []
-        filters.append('playbookrun__container__isnull=True&sort=id&order=desc')
+        filters = self._system_failure_pending_filter & filters
         if start_date and end_date:
-            filters.append('create_time__range("{}","{}")'.format(start_date,end_date))
-        url = self._url("container",page_size=0,filters=filters)
+            filters &= Q(create_time__range=(start_date,end_date))
+        if stream:
+            return self._iter_query("container", filters, order='desc')
+        url = self._url("container",page_size=0,filters=filters,sort='id',order='desc')
         post_response = self._sess.get(url)
 
         return post_response.json()    
 
         r = self.query(query_type="playbook_run",page_size=0,filters=filters,wait=False)     
 
+    def scan_system_failures(self, output_file, start_date, end_date, impacted=True, checkpoint_file=None, window=datetime.timedelta(days=1), max_window_records=5000, min_window=datetime.timedelta(minutes=1), max_workers=4, page_size=1000):
+        '''
+        Function: scan_system_failures
+
+        Description:
+        Scans a long date range for the playbooks impacted by (or containers left pending by) system failures, as get_system_failure_impacted_playbooks and get_system_failure_pending_playbooks do, without one huge request. The range is split into windows which are fetched concurrently. Windows holding more than max_window_records are split in half until they don't, so windows are narrower where the data is dense. Results are de-duplicated by id and appended to a NDJSON file as each window completes. The remaining windows are saved to a checkpoint file, so an interrupted scan resumes where it stopped when called again with the same files and parameters. Resuming with a different range, or a different kind of scan, raises a phantomException rather than continuing the old scan.
+
+        Args:
+            output_file (str)               - The NDJSON file the results are appended to
+            start_date (str)                - The start of the range (e.g. '2019-03-11', or a datetime)
+            end_date (str)                  - The end of the range (e.g. '2019-04-11', or a datetime)
+            (optional) impacted (bool)      - Whether to scan for impacted playbooks (True), or pending containers (False)
+            (optional) checkpoint_file (str) - The file to save progress to, defaults to the output file with '.checkpoint' appended
+            (optional) window (timedelta)   - The initial size of each window
+            (optional) max_window_records (int) - The number of results above which a window is split
+            (optional) min_window (timedelta) - The size below which windows are no longer split
+            (optional) max_workers (int)    - The number of windows fetched at once
+            (optional) page_size (int)      - The number of results requested per page
+
+        Returns:
+            (dict)                          - The number of records written, duplicates skipped, windows fetched and windows split
+        '''
+        if impacted:
+            url_path, filters = 'playbook_run', self._system_failure_impacted_filter
+        else:
+            url_path, filters = 'container', self._system_failure_pending_filter
+        if not checkpoint_file:
+            checkpoint_file = output_file + '.checkpoint'
+
+        def as_datetime(value):
+            if isinstance(value, datetime.datetime):
+                return value
+            if isinstance(value, datetime.date):
+                return datetime.datetime(value.year, value.month, value.day)
+            return datetime.datetime.fromisoformat(value)
+
+        # The checkpoint records what is being scanned, so a scan can't be resumed with different parameters
+        scan = {'url_path': url_path, 'filters': filters.compile(), 'start': as_datetime(start_date).isoformat(), 'end': as_datetime(end_date).isoformat()}
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as checkpoint:
+                saved = json.load(checkpoint)
+            if saved.get('scan') != scan:
+                raise phantomException('The checkpoint {} is of a different scan ({}), delete it (and {}) to start this one'.format(checkpoint_file, saved.get('scan'), output_file))
+            pending = [(as_datetime(start), as_datetime(end)) for start, end in saved['pending']]
+        else:
+            pending = []
+            window_start, range_end = as_datetime(start_date), as_datetime(end_date)
+            while window_start < range_end:
+                pending.append((window_start, min(window_start + window, range_end)))
+                window_start += window
+
+        # Windows share their boundaries (the range is inclusive), so anything already written is skipped
+        seen = set()
+        if os.path.exists(output_file):
+            with open(output_file) as existing:
+                for line in existing:
+                    if line.strip():
+                        seen.add(json.loads(line).get('id'))
+
+        def save_checkpoint():
+            with open(checkpoint_file + '.tmp', 'w') as checkpoint:
+                json.dump({'scan': scan, 'pending': [(start.isoformat(), end.isoformat()) for start, end in pending]}, checkpoint)
+            os.replace(checkpoint_file + '.tmp', checkpoint_file)
+
+        stopped = threading.Event()
+
+        def fetch(start, end):
+            window_filters = filters & Q(create_time__range=(start, end))
+            count = self._sess.get(self._url(url_path, filters=window_filters, page_size=1, include_expensive=False)).json().get('count', 0)
+            if count > max_window_records and end - start > min_window:
+                middle = start + (end - start) / 2
+                return [(start, middle), (middle, end)], None
+            records = []
+            if count:
+                for record in self._iter_query(url_path, window_filters, page_size=page_size):
+                    # Once the scan has stopped (e.g. on an error) the window is abandoned, it is still in the checkpoint
+                    if stopped.is_set():
+                        return None, []
+                    records.append(record)
+            return None, records
+
+        fetch = _carry_deadline(fetch)
+        summary = {'records': 0, 'duplicates': 0, 'windows': 0, 'splits': 0}
+        save_checkpoint()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            with open(output_file, 'a') as output:
+                in_flight = dict((executor.submit(fetch, *current), current) for current in pending)
+                while in_flight:
+                    done, _ = concurrent.futures.wait(list(in_flight), return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        current = in_flight.pop(future)
+                        children, records = future.result()
+                        pending.remove(current)
+                        if children:
+                            summary['splits'] += 1
+                            pending.extend(children)
+                            for child in children:
+                                in_flight[executor.submit(fetch, *child)] = child
+                        else:
+                            summary['windows'] += 1
+                            for record in records:
+                                if record.get('id') in seen:
+                                    summary['duplicates'] += 1
+                                    continue
+                                seen.add(record.get('id'))
+                                output.write(json.dumps(record) + '\n')
+                                summary['records'] += 1
+                            output.flush()
+                        save_checkpoint()
+        finally:
+            # Windows not yet started are cancelled, and those being fetched stop once their current page arrives, so nothing is left running once this returns
+            stopped.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        os.remove(checkpoint_file)
+        logger.debug("Scanned {} windows ({} split), writing {} records to {}".format(summary['windows'], summary['splits'], summary['records'], output_file))
+        return summary
+
+    def recover_pending_playbooks(self, playbooks, journal_file, start_date=None, end_date=None, scope='new', rate=1, max_in_flight=20, max_workers=8, interval=5, max_attempts=120, progress_interval=30):
+        '''
+        Function: recover_pending_playbooks
+
+        Description:
+        Re-runs the playbooks of the containers that get_system_failure_pending_playbooks finds, after a system failure. Submissions are throttled to a rate, the number of runs in progress is capped, and every run is polled by a single poller (see _fan_out). The stranded containers are paged through in id order as the runs are submitted, so recovery starts straight away however large the backlog. Pages are requested by the ids after the last one seen, since a container stops matching the filter once a playbook has run on it, which would shift numbered pages.
+
+        Each submission is recorded in a NDJSON journal before it is sent and again once it has been accepted, and each outcome once it is known. The runs of a container are all recorded when it is listed, before any is submitted, as it stops matching once one of them has started. Calling this again with the same journal resumes the recovery: finished runs are skipped, accepted runs are polled again rather than re-submitted, and rejected submissions are retried, and a submission that was sent but never confirmed is reported as 'unknown' instead of risking a double submission. Throughput and ETA are logged every progress_interval seconds.
+
+        Args:
+            playbooks (list)                    - The playbooks to run on each container. Can also be a dictionary of container label to a list of playbooks, or a function called with the container that returns a list of playbooks.
+            journal_file (str)                  - The NDJSON file every submission and outcome is recorded to
+            (optional) start_date (str)         - The starting date to begin filtering the containers by
+            (optional) end_date (str)           - The end date to filter the containers by
+            (optional) scope (str)              - The phantom scope to run as, defaults to 'new'
+            (optional) rate (float)             - The maximum number of playbook runs submitted per second
+            (optional) max_in_flight (int)      - The maximum number of playbook runs that may be in progress at once
+            (optional) max_workers (int)        - The maximum number of playbook runs to submit at once
+            (optional) interval (int)           - The period between polling
+            (optional) max_attempts (int)       - The amount of times to poll each playbook run before giving up on it
+            (optional) progress_interval (int)  - The period between logging the throughput and ETA
+
+        Returns:
+            (dict)                              - The outcome of each run keyed by (container_id, playbook), and a summary of the count of each status, the duration and the throughput
+        '''
+        if isinstance(playbooks, dict):
+            playbook_map = playbooks
+            playbooks = lambda container: playbook_map.get(container.get('label'), [])
+        elif not callable(playbooks):
+            playbook_list = list(playbooks)
+            playbooks = lambda container: playbook_list
+
+        journal = {}
+        if os.path.exists(journal_file):
+            with open(journal_file) as existing:
+                for line in existing:
+                    if line.strip():
+                        entry = json.loads(line)
+                        journal.setdefault((entry['container_id'], entry['playbook']), {}).update(entry)
+
+        journal_lock = threading.Lock()
+        journal_output = open(journal_file, 'a')
+
+        def write_journal(keys, event, **fields):
+            lines = []
+            for key in keys:
+                entry = {'container_id': key[0], 'playbook': key[1], 'event': event, 'time': time.time()}
+                entry.update(fields)
+                lines.append(json.dumps(entry) + '\n')
+            if not lines:
+                return
+            with journal_lock:
+                journal_output.write(''.join(lines))
+                journal_output.flush()
+                os.fsync(journal_output.fileno())
+
+        results = {}
+        skipped = {}
+        progress = {'submitted': 0, 'listed': 0, 'listing': True, 'reported': time.time()}
+        filters = self._system_failure_pending_filter
+        if start_date and end_date:
+            filters &= Q(create_time__range=(start_date, end_date))
+
+        def resumed(key, entry):
+            if entry.get('event') == 'finished':
+                skipped[key] = {'playbook_run_id': entry.get('playbook_run_id'), 'status': entry.get('status'), 'resumed': True}
+            elif entry.get('event') == 'submitting':
+                skipped[key] = {'playbook_run_id': None, 'status': 'unknown', 'resumed': True}
+            else:
+                return {'resumed_run_id': entry.get('playbook_run_id')}
+
+        def source():
+            seen = set()
+            for container in self._iter_keyset('container', filters):
+                keys = [(container.get('id'), playbook_name) for playbook_name in playbooks(container)]
+                # Once one of them starts the container is no longer listed, so a resumed recovery finds the rest in the journal
+                write_journal([key for key in keys if key not in journal], 'listed')
+                for key in keys:
+                    seen.add(key)
+                    result = resumed(key, journal.get(key, {}))
+                    if result is not None:
+                        progress['listed'] += 1
+                        yield key, result
+            # Runs journalled on containers that no longer match (because a run started on them) are still tracked
+            for key, entry in journal.items():
+                if key not in seen and entry.get('event') in ['listed', 'submitted', 'rejected', 'finished', 'submitting']:
+                    result = resumed(key, entry)
+                    if result is not None:
+                        progress['listed'] += 1
+                        yield key, result
+            progress['listing'] = False
+
+        limiter = _rateLimiter(rate)
+        started = time.time()
+
+        def submit(key, result):
+            run_id = result.pop('resumed_run_id')
+            if run_id:
+                result['resumed'] = True
+                return run_id
+            limiter.acquire()
+            write_journal([key], 'submitting')
+            post_data = {'container_id': key[0], 'playbook_id': key[1], 'scope': scope, 'run': True}
+            try:
+                post_response = self._sess.post(self._url('playbook_run'), json=post_data)
+            except requests.HTTPError as post_error:
+                write_journal([key], 'rejected', status_code=post_error.response.status_code)
+                raise
+            run_id = post_response.json().get('playbook_run_id')
+            write_journal([key], 'submitted', playbook_run_id=run_id)
+
+            with journal_lock:
+                progress['submitted'] += 1
+                now = time.time()
+                if now - progress['reported'] >= progress_interval:
+                    progress['reported'] = now
+                    throughput = progress['submitted'] / (now - started)
+                    remaining = progress['listed'] - progress['submitted']
+                    # Until the listing has finished, the ETA only covers the containers listed so far
+                    logger.info("Recovery submitted {}/{}{} playbook runs, {:.2f}/s, ETA {}{:.0f}s".format(progress['submitted'], progress['listed'], '+' if progress['listing'] else '', throughput, 'at least ' if progress['listing'] else '', remaining / throughput))
+            return run_id
+
+        try:
+            self._fan_out(results, submit, 'playbook_run', max_workers=max_workers, interval=interval, max_attempts=max_attempts, max_in_flight=max_in_flight, source=source())
+            for key, result in results.items():
+                if result.get('playbook_run'):
+                    write_journal([key], 'finished', playbook_run_id=result['playbook_run_id'], status=result['status'])
+        finally:
+            journal_output.close()
+
+        results.update(skipped)
+        duration = time.time() - started
+        summary = {'total': len(results), 'submitted': progress['submitted'], 'duration': duration}
+        summary['throughput'] = progress['submitted'] / duration if duration else None
+        for result in results.values():
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+        logger.debug("Recovered {} playbook runs in {:.2f}s".format(progress['submitted'], duration))
+        return {'results': results, 'summary': summary}
+
+    def profile_playbook_run(self, playbook_id=None, file_name=None):
+        '''
+        Function: profile_playbook_run
+
+        Description:
+        Rebuilds the timeline of a playbook run from its action runs and app runs, to identify which actions are the bottleneck. For each action it calculates the time spent queued and executing, the critical path through the run, and the latency of each asset. The timeline can be written as a Chrome trace (viewable in chrome://tracing, Perfetto or speedscope).
+
+        Args:
+            (optional) playbook_id (str)   - The Phantom Playbook Run ID to profile, by default will use the last run playbook.
+            (optional) file_name (str)     - The path to write the Chrome trace JSON to
+
+        Returns:
+            (dict)                         - The timeline of each action, the critical_path, the wait and execution totals, and the latency of each asset
+        '''
+        if playbook_id is None:
+            playbook_id = self._playbook_run_id[-1]
+
+        playbook_run = self._sess.get(self._url('playbook_run/{}'.format(playbook_id), include_expensive=False)).json()
+
+        actions = {}
+        for action_run in self._iter_query('action_run', Q(playbook_run=playbook_id), include_expensive=False):
+            queued = _parse_time(action_run.get('create_time'))
+            start = _parse_time(action_run.get('start_time')) or queued
+            end = _parse_time(action_run.get('end_time') or action_run.get('close_time') or action_run.get('update_time')) or start
+            timeline = {}
+            timeline['id'] = action_run.get('id')
+            timeline['name'] = action_run.get('name') or action_run.get('action')
+            timeline['action'] = action_run.get('action')
+            timeline['status'] = action_run.get('status')
+            timeline['queued'] = queued
+            timeline['start'] = start
+            timeline['end'] = end
+            timeline['wait'] = start - queued if start and queued else 0
+            timeline['execution'] = end - start if end and start else 0
+            timeline['app_runs'] = []
+            actions[timeline['id']] = timeline
+
+        assets = {}
+        for app_run in self._iter_query('app_run', Q(playbook_run_id=playbook_id), include_expensive=False):
+            start = _parse_time(app_run.get('start_time'))
+            end = _parse_time(app_run.get('end_time') or app_run.get('update_time')) or start
+            asset = app_run.get('asset_name') or app_run.get('asset')
+            duration = end - start if start and end else 0
+            if app_run.get('action_run') in actions:
+                actions[app_run.get('action_run')]['app_runs'].append({'id': app_run.get('id'), 'asset': asset, 'start': start, 'end': end, 'duration': duration})
+            latency = assets.setdefault(asset, {'count': 0, 'total': 0, 'max': 0})
+            latency['count'] += 1
+            latency['total'] += duration
+            latency['max'] = max(latency['max'], duration)
+        for latency in assets.values():
+            latency['mean'] = latency['total'] / latency['count']
+
+        timelines = sorted((timeline for timeline in actions.values() if timeline['queued']), key=lambda timeline: timeline['queued'])
+
+        # Work backwards from the action that finished last, each time stepping to the action that finished most recently before the current one was queued
+        critical_path = []
+        remaining = sorted(timelines, key=lambda timeline: timeline['end'])
+        while remaining:
+            current = remaining.pop()
+            critical_path.append(current)
+            remaining = [timeline for timeline in remaining if timeline['end'] <= current['queued']]
+        critical_path.reverse()
+
+        profile = {}
+        profile['playbook_run_id'] = playbook_id
+        profile['playbook'] = playbook_run.get('playbook_name') or playbook_run.get('message')
+        profile['status'] = playbook_run.get('status')
+        profile['start'] = _parse_time(playbook_run.get('start_time') or playbook_run.get('create_time'))
+        profile['end'] = _parse_time(playbook_run.get('end_time') or playbook_run.get('update_time'))
+        profile['duration'] = profile['end'] - profile['start'] if profile['start'] and profile['end'] else None
+        profile['actions'] = timelines
+        profile['critical_path'] = [timeline['id'] for timeline in critical_path]
+        profile['critical_path_duration'] = critical_path[-1]['end'] - critical_path[0]['queued'] if critical_path else 0
+        profile['wait'] = sum(timeline['wait'] for timeline in timelines)
+        profile['execution'] = sum(timeline['execution'] for timeline in timelines)
+        profile['assets'] = assets
+
+        if file_name:
+            origin = profile['start'] or (timelines[0]['queued'] if timelines else 0)
+            events = []
+            critical = set(profile['critical_path'])
+            for timeline in timelines:
+                thread = '{} ({})'.format(timeline['name'], timeline['id'])
+                category = 'critical' if timeline['id'] in critical else 'action'
+                if timeline['wait']:
+                    events.append(_trace_event('{} (queued)'.format(timeline['name']), 'wait', timeline['queued'] - origin, timeline['wait'], playbook_id, thread))
+                events.append(_trace_event(timeline['name'], category, timeline['start'] - origin, timeline['execution'], playbook_id, thread, {'status': timeline['status'], 'action': timeline['action']}))
+                for app_run in timeline['app_runs']:
+                    if app_run['start']:
+                        events.append(_trace_event('{} on {}'.format(timeline['action'], app_run['asset']), 'app_run', app_run['start'] - origin, app_run['duration'], playbook_id, 'asset: {}'.format(app_run['asset'])))
+            _write_chrome_trace(events, file_name)
+
+        return profile
+
     """
     Playbooks: Setting and Getting Variables
     """
@@ -953,7 +4316,7 @@ class phantasm(object):
         Function: get_application_id
 
         Description:
-        Retrieves the application ID for a known Application name.
+        Retrieves the application ID for a known Application name. With a metadata index (see prefetch_metadata) it doesn't touch the network.
 
         Args:
             application_asset_name (str)        - The name of the Phantom App to look up, will return the ID for it.
@@ -961,25 +4324,30 @@ class phantasm(object):
         Returns:
             response (json)                     - The JSON data of the action
         '''
-        product_filters = []
-        product_filters.append('name="{}"'.format(application_asset_name))
-        url = self._url("asset", filters=product_filters)
-        post_response = self._sess.post(url)
+        if self._index is not None:
+            product_name = self._index.get('asset', application_asset_name)['product_name']
+            self._set_last_run_product_name(product_name)
+            applications = self._index.lookup('app', product_name, field='product_name')
+            if not applications:
+                raise actionException('No app with a product name of {} in the metadata index'.format(product_name))
+            self._set_last_run_application_id(applications[0]['id'])
+            return {'count': len(applications), 'num_pages': 1, 'data': applications}
+
+        url = self._url("asset", filters=Q(name=application_asset_name))
+        post_response = self._sess.get(url)
 
         product_name = post_response.json()['data'][0]['product_name']
         self._set_last_run_product_name(product_name)
 
-        app_filter = []
-        app_filter.append('product_name="{}"'.format(product_name))
-        url = self._url("asset", filters=app_filter)
-        post_response = self._sess.post(url)
+        url = self._url("app", filters=Q(product_name=product_name))
+        post_response = self._sess.get(url)
 
         application_id = post_response.json()['data'][0]['id']
         self._set_last_run_application_id(application_id)
 
         return post_response.json()
 
-    def run_action(self, container_id=None, action_name, asset_name, parameters):
+    def run_action(self, action_name, asset_name, parameters, container_id=None):
         '''
         Function: run_action
 
@@ -1001,22 +4369,233 @@ class phantasm(object):
         self.get_application_id(asset_name)
         application_id = self._get_last_run_application_id()
 
-        post_url = 'https://{}/rest/action_run'.format(self._phantom_server_address)
+        response_json = self._submit_action(action_name, asset_name, parameters, container_id, application_id)
+
+        self._set_last_run_action_id(response_json.get('action_run_id'))
+        self._set_last_run_action_name(action_name)
+
+        return response_json
+
+    def _submit_action(self, action_name, asset_name, parameters, container_id, application_id):
+        '''
+        Function: _submit_action
+
+        Description:
+        Submits an action run without touching the last run action state, so it can be called from several threads at once.
 
+        Returns:
+            Response (json)                 - The JSON data of the action
+        '''
         post_data = {}
         post_data['action'] = action_name
         post_data['container_id'] = container_id
         post_data['name'] = asset_name
-        post_data['targets'] = "[{'assets': [{}], 'parameters': {}, 'app_id': {} }]".format(asset_name, parameters, application_id)
-        post_json = json.dumps(post_data)
-
-        post_response = self._sess.post('action_run', json=post_json)
+        post_data['targets'] = [{'assets': [asset_name], 'parameters': parameters, 'app_id': application_id}]
 
-        self._set_last_run_action_id(post_response.json().get('action_run_id'))
-        self._set_last_run_action_name(action_name)
+        post_response = self._sess.post(self._url('action_run'), json=post_data)
 
         return post_response.json()
 
+    def _poll_statuses(self, url_path, ids, batch_size=100):
+        '''
+        Function: _poll_statuses
+
+        Description:
+        Polls the status of many runs (e.g. action_run or playbook_run) at once, using one request per batch of ids rather than one per run.
+
+        Args:
+            url_path (str)                  - The URL path of the runs: https://phantom.local/rest/<path>
+            ids (iterable)                  - The ids of the runs to poll
+            (optional) batch_size (int)     - The number of ids to request at a time
+
+        Returns:
+            (dict)                          - The JSON data of each run that has finished, keyed by id
+        '''
+        ids = list(ids)
+        finished = {}
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            get_response = self._sess.get(self._url(url_path, filters=Q(id__in=batch), page_size=len(batch), include_expensive=False))
+            for run in get_response.json().get('data', []):
+                if run.get('status') not in ['pending', 'running']:
+                    finished[run.get('id')] = run
+        return finished
+
+    def _fan_out(self, results, submit, run_type, max_workers=8, wait=True, interval=1, max_attempts=60, max_in_flight=None, source=None):
+        '''
+        Function: _fan_out
+
+        Description:
+        Submits runs (e.g. action runs or playbook runs) concurrently on a pool of threads, and waits for all of them with a single poller (see _poll_statuses). Each result is updated in place with the <run_type>_id, status, the <run_type> JSON once finished, and the submit_time, run_time and total_time in seconds. Runs are handed to the pool a few at a time, so a source can produce them while earlier runs are already in progress.
+
+        Args:
+            results (dict)                  - The result of each run to submit, keyed by a unique key. Runs from the source are added to it as they are drawn.
+            submit (function)               - Called as submit(key, result) on a worker thread, returns the id of the submitted run
+            run_type (str)                  - The type of run, which is also its URL path (action_run or playbook_run)
+            (optional) max_workers (int)    - The maximum number of runs to submit at once
+            (optional) wait (bool)          - Whether to wait until every run has finished
+            (optional) interval (int)       - The period between polling
+            (optional) max_attempts (int)   - The amount of times to poll each run before giving up on it
+            (optional) max_in_flight (int)  - The maximum number of runs that may be in progress at once, unlimited by default
+            (optional) source (iterable)    - (key, result) pairs of further runs to submit, drawn lazily (e.g. from a paged query)
+        '''
+        run_id_field = '{}_id'.format(run_type)
+        slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight and wait else None
+        stopped = threading.Event()
+
+        def submit_run(key):
+            result = results[key]
+            # Once the poller has stopped (e.g. on an error) nothing more is submitted, and workers waiting for a slot give up
+            while slots and not slots.acquire(timeout=0.1):
+                if stopped.is_set():
+                    return None
+            if stopped.is_set():
+                if slots:
+                    slots.release()
+                return None
+            try:
+                result['started'] = time.time()
+                run_id = submit(key, result)
+                result['submitted'] = time.time()
+            except Exception:
+                if slots:
+                    slots.release()
+                raise
+            if slots and not run_id:
+                slots.release()
+            return run_id
+
+        submit_run = _carry_deadline(submit_run)
+        for result in results.values():
+            result.setdefault(run_id_field, None)
+            result.setdefault('status', 'unsubmitted')
+
+        def drawn():
+            for key in list(results):
+                yield key
+            for key, result in source or ():
+                result.setdefault(run_id_field, None)
+                result.setdefault('status', 'unsubmitted')
+                results[key] = result
+                yield key
+
+        keys = drawn()
+        pending = {}
+        attempts = {}
+        last_poll = time.time()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            in_flight = {}
+            while True:
+                # Only a couple of submissions per worker are queued, so the source is drawn from as runs are submitted
+                for key in itertools.islice(keys, max(0, max_workers * 2 - len(in_flight))):
+                    in_flight[executor.submit(submit_run, key)] = key
+                if not in_flight and not pending:
+                    break
+                next_poll = max(0, last_poll + interval - time.time())
+                if in_flight:
+                    done, _ = concurrent.futures.wait(list(in_flight), timeout=next_poll if pending else None, return_when=concurrent.futures.FIRST_COMPLETED)
+                else:
+                    self._sleep(next_poll)
+                    done = []
+                for future in done:
+                    result = results[in_flight.pop(future)]
+                    try:
+                        run_id = future.result()
+                    except Exception as submit_error:
+                        result['status'] = 'failed'
+                        result['error'] = str(submit_error)
+                        continue
+                    result[run_id_field] = run_id
+                    result['status'] = 'pending'
+                    if wait and run_id:
+                        pending[run_id] = result
+                        attempts[run_id] = 0
+                if not pending or time.time() - last_poll < interval:
+                    continue
+
+                last_poll = time.time()
+                finished = self._poll_statuses(run_type, pending)
+                now = time.time()
+                for run_id in list(pending):
+                    result = pending[run_id]
+                    if run_id in finished:
+                        result['status'] = finished[run_id].get('status')
+                        result[run_type] = finished[run_id]
+                    else:
+                        attempts[run_id] += 1
+                        if attempts[run_id] < max_attempts:
+                            continue
+                        result['status'] = 'timeout'
+                    result['completed'] = now
+                    del pending[run_id]
+                    if slots:
+                        slots.release()
+        finally:
+            stopped.set()
+            # Submissions already sent are waited for, so their outcome is recorded (e.g. in a journal) before the error is raised
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        for result in results.values():
+            started = result.pop('started', None)
+            submitted = result.pop('submitted', None)
+            completed = result.pop('completed', None)
+            result['submit_time'] = submitted - started if started and submitted else None
+            result['run_time'] = completed - submitted if submitted and completed else None
+            result['total_time'] = completed - started if started and completed else None
+
+        return results
+
+    def run_action_many(self, action_name, targets, max_workers=8, wait=True, interval=1, max_attempts=60, include_app_runs=False):
+        '''
+        Function: run_action_many
+
+        Description:
+        Runs the same action against many targets (e.g. 'get ticket' for many JIRA ids, or 'test connectivity' on every asset). The action runs are submitted concurrently, and then all of them are waited on by a single poller.
+
+        Args:
+            action_name (str)                   - The name of the action to undertake.
+            targets (iterable)                  - A dictionary per target, with an 'asset_name' and optionally 'parameters', 'container_id' (defaults to the current container) and 'key' (defaults to the position of the target).
+            (optional) max_workers (int)        - The maximum number of action runs to submit at once
+            (optional) wait (bool)              - Whether to wait until every action has completed
+            (optional) interval (int)           - The period between polling
+            (optional) max_attempts (int)       - The amount of times to poll each action before giving up on it
+            (optional) include_app_runs (bool)  - Whether to also retrieve the app run data of each action
+
+        Returns:
+            (dict)                              - The outcome of each target, keyed by the target key. Each contains the action_run_id, status, the action run JSON (and app runs), and the submit_time, run_time and total_time in seconds.
+        '''
+        results = {}
+        application_ids = {}
+        for position, target in enumerate(targets):
+            asset_name = target['asset_name']
+            if asset_name not in application_ids:
+                self.get_application_id(asset_name)
+                application_ids[asset_name] = self._get_last_run_application_id()
+            result = {}
+            result['asset_name'] = asset_name
+            result['container_id'] = target.get('container_id') or self._get_container_id()
+            result['parameters'] = target.get('parameters', [])
+            results[target.get('key', position)] = result
+
+        def submit(key, result):
+            response_json = self._submit_action(action_name, result['asset_name'], result['parameters'], result['container_id'], application_ids[result['asset_name']])
+            return response_json.get('action_run_id')
+
+        self._fan_out(results, submit, 'action_run', max_workers=max_workers, wait=wait, interval=interval, max_attempts=max_attempts)
+
+        if include_app_runs:
+            action_run_ids = dict((result['action_run_id'], result) for result in results.values() if result.get('action_run_id'))
+            for result in action_run_ids.values():
+                result['app_runs'] = []
+            for start in range(0, len(action_run_ids), 100):
+                filters = Q(action_run__in=list(action_run_ids)[start:start + 100])
+                for app_run in self._iter_query('app_run', filters):
+                    if app_run.get('action_run') in action_run_ids:
+                        action_run_ids[app_run['action_run']]['app_runs'].append(app_run)
+
+        return results
+
     def get_action_results(self,action_id=None, wait=True, interval=1, max_attempts=10):
         '''
         Function: get_action_results
@@ -1043,7 +4622,7 @@ class phantasm(object):
         else:
             return post_response.json()
 
-    def get_action_run_data(self, action_run_id=None, wait=True, interval=1, max_attempts=10):
+    def get_action_run_data(self, action_run_id=None, wait=True, interval=1, max_attempts=10, stream=False, filters=None, extract=None):
         '''
         Function: get_action_run_data
 
@@ -1055,16 +4634,25 @@ class phantasm(object):
             (optional) wait (bool)         - Whether the playbook should wait until it's completed
             (optional) interval (int)      - The period between polling
             (optional) max_attempts (int)  - The amount of times to poll
+            (optional) stream (bool)       - Whether to stream the app runs one at a time instead of loading the whole response
+            (optional) filters (Q)         - Further filters to apply on the server
+            (optional) extract (jsonPath)  - A path (or a dict of names to paths) to pull out of the response as it streams, e.g. 'data[0].result_data[0].data[0].status'
 
         Returns:
-            Response (json)                - The JSON data of the action
+            Response (json)                - The JSON data of the action, a generator of each app run when streaming, or the values selected by extract
         '''
-        if action_id is None:
-            action_id = self._get_last_run_action_id()
+        if action_run_id is None:
+            action_run_id = self._get_last_run_action_id()
 
-        filters = []
-        filters.append('action_run="{}"'.format(action_run_id))
-        post_response = self._sess.get(self._url("app_run", filters=filters))
+        filters = Q(action_run=action_run_id) & filters
+        url = self._url("app_run", filters=filters)
+        if stream or extract is not None:
+            if wait:
+                self._wait(self._url("app_run", filters=filters, page_size=1), interval, max_attempts)
+            if extract is not None:
+                return self._extract_data(url, extract)
+            return self._stream_data(url)
+        post_response = self._sess.get(url)
         if wait:
             return self._wait(url, interval, max_attempts)
         else:
@@ -1106,10 +4694,314 @@ class phantasm(object):
     last_run_action_name = property(_get_last_run_action_name, _set_last_run_action_name)
     last_run_action_id = property(_get_last_run_action_id, _set_last_run_action_id)
 
+    """
+    Scenarios: Functions
+    """
+    def run_scenario_matrix(self, containers, playbooks, max_workers=8, max_in_flight=None, scope='new', expected_status='success', interval=1, max_attempts=300, report_file=None):
+        '''
+        Function: run_scenario_matrix
+
+        Description:
+        Runs every combination of container template and playbook in parallel. For each combination a new container is created (create_container), its artifacts are added (add_artifact), and the playbook is run against it (run_playbook). Every playbook run is then waited on by a single poller, and the outcome and timing of each is gathered into one report.
+
+        Args:
+            containers (array)              - The container templates. Each is a dictionary of create_container arguments, optionally with an 'artifacts' list of add_artifact arguments.
+            playbooks (array)               - The names of the playbooks to run against every container template
+            (optional) max_workers (int)    - The maximum number of combinations being set up at once
+            (optional) max_in_flight (int)  - The maximum number of playbooks running at once, unlimited by default
+            (optional) scope (str)          - The phantom scope to run the playbooks as, defaults to 'new'
+            (optional) expected_status (str) - The playbook status that counts as a pass
+            (optional) interval (int)       - The period between polling
+            (optional) max_attempts (int)   - The amount of times to poll each playbook before giving up on it
+            (optional) report_file (str)    - The path to write the report to as JSON
+
+        Returns:
+            (dict)                          - The 'results' of each combination (container_id, playbook_run_id, status, passed, setup_time, submit_time, run_time, total_time), and a 'summary' of the pass/fail counts and timings overall and per playbook
+        '''
+        started = time.time()
+        results = {}
+        for position, template in enumerate(containers):
+            template_name = template.get('name', 'container-{}'.format(position))
+            for playbook_name in playbooks:
+                result = {}
+                result['container'] = template_name
+                result['playbook'] = playbook_name
+                result['container_id'] = None
+                results[(position, playbook_name)] = result
+
+        def submit(key, result):
+            # Each combination has its own instance (sharing the pooled session), so the container and playbook state doesn't collide between threads
+            scenario = phantasm(server_address=self._phantom_server_addresses, auth_token=self._phantom_auth_token, cache=self._sess.cache, coalesce=self._sess.coalesce, tracer=self._tracer, balancing=self._sess.nodes.strategy if self._sess.nodes else 'round_robin', profiler=self._profiler)
+            scenario._index = self._index
+            template = dict(containers[key[0]])
+            artifacts = template.pop('artifacts', [])
+            setup_started = time.time()
+            result['container_id'] = scenario.create_container(**template).get('id')
+            if not result['container_id']:
+                raise containerException('The container {} was not created'.format(result['container']))
+            for artifact in artifacts:
+                scenario.add_artifact(**artifact)
+            result['setup_time'] = time.time() - setup_started
+            return scenario.run_playbook(result['playbook'], scope=scope).get('playbook_run_id')
+
+        self._fan_out(results, submit, 'playbook_run', max_workers=max_workers, interval=interval, max_attempts=max_attempts, max_in_flight=max_in_flight)
+
+        summary = {}
+        summary['total'] = len(results)
+        summary['passed'] = 0
+        summary['failed'] = 0
+        summary['timeout'] = 0
+        summary['errors'] = 0
+        by_playbook = {}
+        for result in results.values():
+            result['passed'] = result['status'] == expected_status
+            if result['passed']:
+                summary['passed'] += 1
+            elif result['status'] == 'timeout':
+                summary['timeout'] += 1
+            elif 'error' in result:
+                summary['errors'] += 1
+            else:
+                summary['failed'] += 1
+            playbook_summary = by_playbook.setdefault(result['playbook'], {'passed': 0, 'failed': 0, 'run_times': []})
+            playbook_summary['passed' if result['passed'] else 'failed'] += 1
+            if result.get('run_time') is not None:
+                playbook_summary['run_times'].append(result['run_time'])
+        for playbook_summary in by_playbook.values():
+            run_times = playbook_summary.pop('run_times')
+            playbook_summary['p50'] = _percentile(run_times, 50)
+            playbook_summary['p95'] = _percentile(run_times, 95)
+            playbook_summary['max'] = max(run_times) if run_times else None
+        summary['playbooks'] = by_playbook
+        summary['wall_time'] = time.time() - started
+
+        report = {'results': list(results.values()), 'summary': summary}
+        if report_file:
+            with open(report_file, 'w') as report_output:
+                json.dump(report, report_output, indent=4, default=str)
+
+        return report
+
+    def run_soak_test(self, workflow, duration=3600, window=300, iterations=None, pause=0, report_file=None, trend_threshold=0.2):
+        '''
+        Function: run_soak_test
+
+        Description:
+        Runs an endurance test, looping a workflow built from the functions of this class until the duration is up. At the end of every window it samples the resources of the client process (RSS, open files and sockets, threads and garbage collector counts), and the latency of each function called and of the HTTP requests they made. The windows are logged and appended to the report file as they close, so a long run can be followed as it goes. At the end, trends across the windows (e.g. growing latency or leaking memory) are flagged, with latency drift attributed to Phantom or the client.
+
+        The functions are timed with a tracer installed on the instance for the length of the test, replacing any existing tracer until it finishes.
+
+        e.g.
+            ph.run_soak_test([
+                ('create_container', {'name': 'soak'}),
+                ('add_artifact', {'cef': {'sourceAddress': '10.1.1.1'}}),
+                ('run_playbook', {'playbook_name': 'phantom-playbook/Create JIRA Ticket'}),
+                ('wait_for_playbook', {}),
+                ('delete_container', {}),
+            ], duration=12 * 3600)
+
+        Args:
+            workflow (array)                - The steps of one iteration, each a (function name, keyword arguments) pair, or a function that takes the instance
+            (optional) duration (int)       - The number of seconds to run the test for, unlimited if None
+            (optional) window (int)         - The number of seconds in each window
+            (optional) iterations (int)     - The maximum number of iterations, unlimited if None
+            (optional) pause (int)          - The period between iterations
+            (optional) report_file (str)    - The path of a NDJSON file each window is appended to
+            (optional) trend_threshold (float) - The relative growth over the test that is flagged as a trend
+
+        Returns:
+            (dict)                          - The 'windows' of the test (iterations, errors, resources, methods and requests), the 'trends' flagged, and a 'summary'
+        '''
+        if duration is None and iterations is None:
+            raise phantomException('A soak test needs a duration or a number of iterations')
+        def as_step(step):
+            if callable(step):
+                return step
+            name, kwargs = step
+            return lambda instance: getattr(instance, name)(**kwargs)
+
+        steps = [as_step(step) for step in workflow]
+        tracer = _soakTracer()
+        previous_tracer = self._tracer
+        self._tracer = self._sess.tracer = tracer
+        windows = []
+        state = {'iterations': 0, 'errors': 0, 'last_error': None, 'collections': _process_resources()['gc_collections']}
+
+        def close_window(window_started):
+            durations = tracer.take()
+            resources = _process_resources()
+            resources['gc_collected'] = [now - before for now, before in zip(resources['gc_collections'], state['collections'])]
+            state['collections'] = resources['gc_collections']
+            requests_made = durations.pop('requests', None)
+            record = {'window': len(windows), 'start': window_started, 'end': time.time(), 'iterations': state['iterations'], 'errors': state['errors'], 'last_error': state['last_error'], 'resources': resources, 'methods': dict((method, _latency_stats(times)) for method, times in durations.items()), 'requests': _latency_stats(requests_made) if requests_made else None}
+            windows.append(record)
+            state.update(iterations=0, errors=0, last_error=None)
+            logger.info("Soak window {}: {} iterations, {} errors, RSS {:.1f}MB, {} sockets, {} threads".format(record['window'], record['iterations'], record['errors'], (resources['rss'] or 0) / 1048576.0, resources['sockets'], resources['threads']))
+            if report_file:
+                with open(report_file, 'a') as report_output:
+                    report_output.write(json.dumps(record, default=str) + '\n')
+
+        started = window_started = time.time()
+        completed = 0
+        try:
+            while (duration is None or time.time() - started < duration) and (iterations is None or completed < iterations):
+                try:
+                    for step in steps:
+                        step(self)
+                except Exception as step_error:
+                    state['errors'] += 1
+                    state['last_error'] = repr(step_error)
+                    logger.debug("Soak iteration failed: {}".format(step_error))
+                state['iterations'] += 1
+                completed += 1
+                if time.time() - window_started >= window:
+                    close_window(window_started)
+                    window_started = time.time()
+                if pause:
+                    _deadline_sleep(pause, 'the next iteration')
+            if state['iterations']:
+                close_window(window_started)
+        finally:
+            self._tracer = self._sess.tracer = previous_tracer
+
+        trends = _soak_trends(windows, trend_threshold)
+        for trend in trends:
+            logger.warning("Soak trend: {}".format(trend))
+        summary = {'duration': time.time() - started, 'windows': len(windows), 'iterations': completed, 'errors': sum(window['errors'] for window in windows)}
+        return {'windows': windows, 'trends': trends, 'summary': summary}
+
+    """
+    Export: Functions
+    """
+    @staticmethod
+    def _flatten(record, prefix='', separator='.', flat=None):
+        '''
+        Function: _flatten
+
+        Description:
+        Flattens nested dictionaries into a single level, joining the keys with the separator (e.g. {'cef': {'sourceAddress': ..}} becomes {'cef.sourceAddress': ..}). Lists are kept as JSON strings.
+        '''
+        if flat is None:
+            flat = {}
+        for key, value in record.items():
+            name = prefix + key
+            if isinstance(value, dict) and value:
+                phantasm._flatten(value, name + separator, separator, flat)
+            elif isinstance(value, (dict, list)):
+                flat[name] = json.dumps(value)
+            else:
+                flat[name] = value
+        return flat
+
+    @staticmethod
+    def _select(record, paths, encode):
+        '''
+        Function: _select
+
+        Description:
+        Picks the requested columns out of a record without flattening the rest of it.
+
+        Args:
+            record (dict)                   - The record to pick from
+            paths (array)                   - The (column, [keys]) pairs to pick
+            encode (bool)                   - Whether to JSON encode any list or dictionary values
+        '''
+        selected = {}
+        for column, keys in paths:
+            value = record
+            for key in keys:
+                value = value.get(key) if isinstance(value, dict) else None
+            if encode and isinstance(value, (dict, list)):
+                value = json.dumps(value)
+            selected[column] = value
+        return selected
+
+    def export_to_csv(self, records, file_name, columns=None, separator='.'):
+        '''
+        Function: export_to_csv
+
+        Description:
+        Writes records to a CSV file as they are produced, so a streamed query (e.g. get_system_failure_impacted_playbooks(stream=True)) is never held in memory. Nested fields are flattened into columns such as 'cef.sourceAddress'.
+
+        Without columns the header can't be written until every record has been seen, so each flattened row is first spooled to a temporary file as JSON and then read back, which costs a second pass and as much temporary disk space as the export. For large exports pass the columns, which writes each row straight to the CSV file.
+
+        Args:
+            records (iterable)              - The records to export, e.g. the generator from a streamed query
+            file_name (str)                 - The path of the CSV file to write
+            (optional) columns (array)      - The columns to export, using the separator for nested fields. Defaults to every column found in the records, in the order they first appear.
+            (optional) separator (str)      - The separator used to join nested field names
+
+        Returns:
+            (int)                           - The number of rows written
+        '''
+        records = iter(records)
+        if columns:
+            paths = [(column, column.split(separator)) for column in columns]
+            return self._write_csv(file_name, columns, (self._select(record, paths, True) for record in records))
+
+        # The header needs the columns of every record, so the flattened rows are spooled to a temporary file while they are collected, rather than held in memory
+        found = {}
+        with tempfile.TemporaryFile('w+') as spool:
+            for record in records:
+                row = self._flatten(record, separator=separator)
+                found.update(dict.fromkeys(row))
+                spool.write(json.dumps(row, default=str) + '\n')
+            spool.seek(0)
+            return self._write_csv(file_name, list(found), (json.loads(line) for line in spool))
+
+    @staticmethod
+    def _write_csv(file_name, columns, rows):
+        '''
+        Function: _write_csv
+
+        Description:
+        Writes rows to a CSV file, leaving the columns a row doesn't have empty.
+
+        Returns:
+            (int)                           - The number of rows written
+        '''
+        count = 0
+        with open(file_name, 'w', newline='', buffering=1048576) as export_file:
+            writer = csv.DictWriter(export_file, fieldnames=columns, restval='', extrasaction='ignore')
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        return count
+
+    def export_to_ndjson(self, records, file_name, columns=None, separator='.'):
+        '''
+        Function: export_to_ndjson
+
+        Description:
+        Writes records to a newline delimited JSON file as they are produced, so a streamed query is never held in memory.
+
+        Args:
+            records (iterable)              - The records to export, e.g. the generator from a streamed query
+            file_name (str)                 - The path of the NDJSON file to write
+            (optional) columns (array)      - The fields to export, using the separator for nested fields. Defaults to the whole record.
+            (optional) separator (str)      - The separator used to join nested field names
+
+        Returns:
+            (int)                           - The number of lines written
+        '''
+        paths = [(column, column.split(separator)) for column in columns] if columns else None
+        encoder = json.JSONEncoder(separators=(',', ':'))
+
+        count = 0
+        with open(file_name, 'w', buffering=1048576) as export_file:
+            for record in records:
+                if paths:
+                    record = self._select(record, paths, False)
+                export_file.write(encoder.encode(record))
+                export_file.write('\n')
+                count += 1
+        return count
+
     """
     Miscellanous: Functions
     """
-    def get_jira_ticket_data(self, container_id=None, jira_ticket):
+    def get_jira_ticket_data(self, jira_ticket, container_id=None):
         '''
         Function: get_jira_ticket_data
 
@@ -1123,7 +5015,7 @@ class phantasm(object):
         Returns:
             action_results (json)            - The JSON containing all the metadata of the JIRA ticket
         '''
-        if cointainer_id is None:
+        if container_id is None:
             container_id = self._get_container_id()
         parameters=[{'id': jira_ticket}]
 
@@ -1131,3 +5023,138 @@ class phantasm(object):
         self.get_action_results()
         action_results = self.get_action_run_data()
         return action_results
+
+    def get_jira_ticket_data_many(self, jira_tickets, container_id=None, max_workers=8):
+        '''
+        Function: get_jira_ticket_data_many
+
+        Description:
+        Executes the JIRA 'get ticket' action for many tickets concurrently, waiting on all of them together.
+
+        Args:
+            jira_tickets (array)            - The JIRA ticket numbers to retrieve all the metadata for.
+            (optional) container_id (str)   - The container ID to run against, by default will use the current container.
+            (optional) max_workers (int)    - The maximum number of actions to submit at once
+
+        Returns:
+            (dict)                          - The outcome of each ticket as returned by run_action_many, including the app runs, keyed by ticket number
+        '''
+        if container_id is None:
+            container_id = self._get_container_id()
+        targets = []
+        for jira_ticket in jira_tickets:
+            targets.append({'key': jira_ticket, 'asset_name': 'jira', 'container_id': container_id, 'parameters': [{'id': jira_ticket}]})
+
+        return self.run_action_many("get ticket", targets, max_workers=max_workers, include_app_runs=True)
+
+    def get_cache_stats(self):
+        '''
+        Function: get_cache_stats
+
+        Description:
+        Reports how well the response cache (enabled with phantasm(cache=True)) is working.
+
+        Returns:
+            (dict)                          - The number of entries, hits, misses, evictions and invalidations, or None if caching isn't enabled
+        '''
+        if self._sess.cache is None:
+            return None
+        return self._sess.cache.stats()
+
+    def get_request_stats(self):
+        '''
+        Function: get_request_stats
+
+        Description:
+        Reports how many GET requests were sent to Phantom, and how many were saved by coalescing them with an identical request already in progress (see phantomTransport) or by the response cache.
+
+        Returns:
+            (dict)                          - The number of GET requests sent, coalesced and served from the cache by this instance
+        '''
+        cache_stats = self.get_cache_stats() or {}
+        return {'sent': self._sess.requests, 'coalesced': self._sess.coalesced, 'cached': cache_stats.get('hits', 0)}
+
+    def get_node_stats(self):
+        '''
+        Function: get_node_stats
+
+        Description:
+        Reports how requests have been spread across the nodes of a cluster (when the instance was given several server addresses), and the health of each node.
+
+        Returns:
+            (dict)                          - The requests, failures, requests in progress and health of each node, keyed by address, or None with a single node
+        '''
+        if self._sess.nodes is None:
+            return None
+        return self._sess.nodes.stats()
+
+    def prefetch_metadata(self, kinds=None):
+        '''
+        Function: prefetch_metadata
+
+        Description:
+        Loads the assets, apps, playbooks and case templates into a local index in one paginated sweep, or refreshes the index if it is already loaded. From then on get_application_id, promote_container_to_case and get_playbook_information resolve names without touching the network. The index can also be built when the instance is created, with phantasm(prefetch=True).
+
+        Args:
+            (optional) kinds (list)         - The kinds of metadata to load or refresh, defaults to all of them
+
+        Returns:
+            (metadataIndex)                 - The index, which supports exact, prefix and substring lookups and refresh()
+        '''
+        if self._index is None:
+            self._index = metadataIndex(self)
+        else:
+            self._index.refresh(kinds)
+        return self._index
+
+    def get_profile_stats(self):
+        '''
+        Function: get_profile_stats
+
+        Description:
+        Reports the time spent in each public function so far, split into client-side CPU and waiting (see methodProfiler). The profiler also writes a summary when the interpreter exits.
+
+        Returns:
+            (dict)                          - The calls, wall, cpu and wait seconds, and cpu share of each function, or None if the instance has no profiler
+        '''
+        if self._profiler is None:
+            return None
+        return self._profiler.stats()
+
+    def clear_cache(self):
+        '''
+        Function: clear_cache
+
+        Description:
+        Drops every cached response, e.g. after the data has been changed by something other than this client.
+        '''
+        if self._sess.cache is not None:
+            self._sess.cache.clear()
+
+    def export_trace(self, file_name):
+        '''
+        Function: export_trace
+
+        Description:
+        Writes the spans recorded by the tracer (enabled with phantasm(tracer=True)) to a Chrome trace file, showing where the wall-clock time of each call went: a span per public method, with a child span for each HTTP request and each sleep between polls.
+
+        Args:
+            file_name (str)                 - The path of the trace file to write
+
+        Returns:
+            (int)                           - The number of spans written
+        '''
+        if self._tracer is None:
+            raise phantomException('Tracing is not enabled, create the instance with phantasm(tracer=True)')
+        if self._tracer.dropped:
+            logger.warning("The tracer dropped its {} oldest spans, raise max_spans to keep them".format(self._tracer.dropped))
+        events = self._tracer.events()
+        _write_chrome_trace(events, file_name)
+        return len(events)
+
+
+# Every public method opens a span when the instance has a tracer, is profiled when it has a profiler, and accepts a timeout_budget (generators are instrumented as they are iterated)
+for _name, _function in list(vars(phantasm).items()):
+    if not _name.startswith('_') and inspect.isfunction(_function):
+        setattr(phantasm, _name, _instrumented(_function))
+del _name, _function
@@ -0,0 +1,1010 @@
+"""
+File: test_offline.py
+
+Description:
+    Test cases for the parts of the class that don't need a Phantom server, so
+    they can run anywhere (e.g. before a change is pushed). They cover:
+
+    1) Streaming JSON listings item by item, whatever the size of the chunks the
+       response arrives in.
+    2) Compiling server side filters into their query strings.
+    3) The rolling baselines and regression checks of the playbook history.
+    4) Generating synthetic containers and artifacts reproducibly.
+    5) Caching GET responses, with expiry, eviction and invalidation by writes.
+    6) Coalescing identical calls that are in progress at the same time, but
+       never a read made after a write with one that started before it.
+    7) Spreading requests across cluster nodes, and failing over between them.
+    8) Extracting values from action results with compiled paths, parsed or streamed.
+    9) Flagging leaks and latency drift across the windows of a soak test.
+    10) Resolving the names of playbooks through the prefetched metadata index.
+    11) Sharing profilers between instances, without leaving sampling threads behind.
+    12) Uploading files to the vault, recording the vault id of each, and attaching
+        files the vault already holds (uploading them when that fails).
+    13) Timeout budgets: shrinking socket timeouts and sleeps to fit, carrying them
+        to worker threads, and coalesced requests under different budgets.
+    14) Fanning runs out across threads: polling them in batches, capping the runs in
+        progress, and stopping on an error.
+    15) Scanning long date ranges for system failures in windows, splitting dense
+        windows and resuming from a checkpoint.
+    16) Resuming a recovery of stranded playbooks from its journal, without
+        submitting any playbook run twice.
+    17) Exporting records to CSV, with the columns found in them or given.
+    18) Updating containers in bulk, retrying only the failures worth retrying.
+"""
+
+import csv
+import json
+import time
+import datetime
+import concurrent.futures
+import threading
+import pytest
+import requests
+from urllib.parse import urlsplit, parse_qsl
+import phantasm
+
+LISTING = {
+    'count': 3,
+    'num_pages': 1,
+    'data': [
+        {'id': 1, 'name': 'quoted "name" with [brackets] and {braces}', 'tags': [], 'data': {}},
+        {'id': 2, 'name': 'escaped \\ backslash', 'tags': ['a', 'b'], 'data': {'nested': [1, 2.5, None, True]}},
+        {'id': 3, 'name': 'unicode é中', 'tags': None, 'data': {'deep': {'deeper': [{'x': -1e3}]}}},
+    ],
+}
+
+def chunked(document, size):
+    encoded = json.dumps(document).encode('utf-8') if not isinstance(document, bytes) else document
+    return [encoded[position:position + size] for position in range(0, len(encoded), size)]
+
+class fakePhantom(object):
+    '''Stands in for the session of a Phantom server: each request is answered by handlers[(method, endpoint)](url, kwargs), which returns the status code and JSON (or bytes) of the response'''
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        with self.lock:
+            self.requests.append((method, url, kwargs))
+        status, body = self.handlers[(method, phantasm._endpoint(url))](url, kwargs)
+        response = requests.Response()
+        response.status_code = status
+        response.url = url
+        response._content = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        response._content_consumed = True
+        phantasm.phantasm._hook_response(response)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def sent(self, method, endpoint):
+        with self.lock:
+            return [(url, kwargs) for sent_method, url, kwargs in self.requests if sent_method == method and phantasm._endpoint(url) == endpoint]
+
+def fake_client(monkeypatch, handlers, **kwargs):
+    session = fakePhantom(handlers)
+    monkeypatch.setitem(phantasm._sessions, ('https://phantom.local/rest/', 'token'), session)
+    return phantasm.phantasm(server_address='https://phantom.local/rest/', auth_token='token', **kwargs), session
+
+'''Streaming a listing gives the same items and metadata however it is chunked'''
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 65536])
+def test_stream_reader_items(chunk_size):
+    meta = {}
+    items = list(phantasm._jsonStreamReader(chunked(LISTING, chunk_size)).iter_items(meta=meta))
+    assert items == LISTING['data']
+    assert meta == {'count': 3, 'num_pages': 1}
+
+'''Only the requested fields of each item are kept'''
+def test_stream_reader_fields():
+    items = list(phantasm._jsonStreamReader(chunked(LISTING, 5)).iter_items(fields={'id', 'tags'}))
+    assert items == [{'id': 1, 'tags': []}, {'id': 2, 'tags': ['a', 'b']}, {'id': 3, 'tags': None}]
+
+'''Values can be skipped without decoding them, leaving the reader at the next one'''
+def test_stream_reader_skip():
+    reader = phantasm._jsonStreamReader(chunked(b'[{"a": "]}\\"", "b": [1, {"c": 2}]}, "kept", 3]', 3))
+    values = []
+    for index in reader.iter_array():
+        if index == 0:
+            reader.skip_value()
+        else:
+            values.append(reader.read_value())
+    assert values == ['kept', 3]
+
+'''An empty listing yields nothing'''
+def test_stream_reader_empty():
+    meta = {}
+    assert list(phantasm._jsonStreamReader([b'{"count": 0, "data": []}']).iter_items(meta=meta)) == []
+    assert meta == {'count': 0}
+
+'''Filters compile into the _filter_ and _exclude_ parameters Phantom parses'''
+@pytest.mark.parametrize("query,compiled", [
+    (phantasm.Q(status="failed"), '_filter_status=%22failed%22'),
+    (phantasm.Q(id__in=[1, 2], active=True, owner=None), '_filter_active=True&_filter_id__in=[1,2]&_filter_owner=None'),
+    (phantasm.Q(create_time__gt=datetime.date(2019, 3, 11)), '_filter_create_time__gt=%222019-03-11%22'),
+    (phantasm.Q(status="failed") & phantasm.Q(create_time__range=("2019-03-11", "2019-04-11")) & ~phantasm.Q(label="test"), '_filter_status=%22failed%22&_filter_create_time__range=[%222019-03-11%22,%222019-04-11%22]&_exclude_label=%22test%22'),
+    (phantasm.Q(name__icontains='a&b=c'), '_filter_name__icontains=%22a%26b%3Dc%22'),
+])
+def test_filter_compile(query, compiled):
+    assert query.compile() == compiled
+
+'''Equal filters compare and hash the same, so their compiled strings are cached once'''
+def test_filter_equality():
+    assert phantasm.Q(id__in=[1, 2]) == phantasm.Q(id__in=(1, 2))
+    assert hash(phantasm.Q(id__in=[1, 2])) == hash(phantasm.Q(id__in=(1, 2)))
+    assert phantasm.Q(a=1) != phantasm.Q(a=2)
+    assert not phantasm.Q()
+    assert phantasm.Q(a=1) & None == phantasm.Q(a=1)
+
+'''Only plain filters can be excluded'''
+def test_filter_exclude_twice():
+    with pytest.raises(ValueError):
+        ~~phantasm.Q(label="test")
+
+def playbook_run(duration, status='success', actions=None):
+    return {'playbook': 'local/Create JIRA Ticket', 'playbook_run_id': 1, 'status': status, 'duration': duration, 'actions': actions or {}}
+
+'''A run is a regression when it is over the p95 baseline by more than the margin'''
+def test_history_check(tmp_path):
+    history = phantasm.playbookHistory(str(tmp_path / 'history.ndjson'))
+    for duration in [1.0, 2.0, 3.0, 4.0, 5.0]:
+        history.record(playbook_run(duration, actions={'create ticket': duration / 2}))
+    assert history.baseline('local/Create JIRA Ticket') == {'count': 5, 'p50': 3.0, 'p95': 5.0}
+    assert history.check(playbook_run(6.0, actions={'create ticket': 3.0})) == []
+    regressions = history.check(playbook_run(6.5, actions={'create ticket': 3.5}))
+    assert len(regressions) == 2
+    assert regressions[0].startswith('local/Create JIRA Ticket took 6.50s, over the limit of 6.00s')
+    assert regressions[1].startswith('local/Create JIRA Ticket / create ticket took 3.50s')
+
+'''Baselines with too few runs are ignored, and failed runs never count towards them'''
+def test_history_min_runs(tmp_path):
+    history = phantasm.playbookHistory(str(tmp_path / 'history.ndjson'))
+    for duration in [1.0, 1.0, 1.0, 1.0]:
+        history.record(playbook_run(duration))
+    history.record(playbook_run(100.0, status='failed'))
+    assert history.baseline('local/Create JIRA Ticket')['count'] == 4
+    assert history.check(playbook_run(100.0)) == []
+    assert len(history.check(playbook_run(100.0), min_runs=4)) == 1
+
+'''The history is reloaded from its file, keeping only the most recent runs of the window'''
+def test_history_reload(tmp_path):
+    file_name = str(tmp_path / 'history.ndjson')
+    history = phantasm.playbookHistory(file_name, window=3)
+    for duration in [10.0, 1.0, 2.0, 3.0]:
+        history.record(playbook_run(duration))
+    reloaded = phantasm.playbookHistory(file_name, window=3)
+    assert reloaded.baseline('local/Create JIRA Ticket') == history.baseline('local/Create JIRA Ticket') == {'count': 3, 'p50': 2.0, 'p95': 3.0}
+
+'''The same seed always generates the same data'''
+def test_synthetic_reproducible():
+    first = list(phantasm.syntheticData(seed=7, duplicate_rate=0.2).containers(5, artifacts_per_container=10))
+    second = list(phantasm.syntheticData(seed=7, duplicate_rate=0.2).containers(5, artifacts_per_container=10))
+    assert first == second
+    assert first != list(phantasm.syntheticData(seed=8, duplicate_rate=0.2).containers(5, artifacts_per_container=10))
+
+'''The cardinality caps the distinct values of each kind'''
+def test_synthetic_cardinality():
+    artifacts = phantasm.syntheticData(seed=1, cardinality={'ip': 3}, kinds={'network': 1}).artifacts(200)
+    addresses = set(artifact['cef']['sourceAddress'] for artifact in artifacts) | set(artifact['cef']['destinationAddress'] for artifact in artifacts)
+    assert len(addresses) <= 3
+
+'''A fraction of the artifacts are duplicates, each with its own nested fields'''
+def test_synthetic_duplicates():
+    artifacts = phantasm.syntheticData(seed=1, duplicate_rate=0.5).artifacts(10, container_id=5)
+    assert len(artifacts) == 10
+    assert len(set(artifact['source_data_identifier'] for artifact in artifacts)) == 5
+    assert all(artifact['container_id'] == 5 for artifact in artifacts)
+    duplicate = artifacts[-1]
+    original = next(artifact for artifact in artifacts if artifact['source_data_identifier'] == duplicate['source_data_identifier'])
+    duplicate['cef']['sourceAddress'] = 'changed'
+    duplicate['tags'].append('changed')
+    assert original['cef'].get('sourceAddress') != 'changed' and 'changed' not in original['tags']
+
+'''Automation is only triggered by the last artifact of a container'''
+def test_synthetic_automation():
+    container = next(phantasm.syntheticData(seed=1).containers(1, artifacts_per_container=4, run_automation=True))
+    assert [artifact['run_automation'] for artifact in container['artifacts']] == [False, False, False, True]
+    batches = list(phantasm.syntheticData(seed=1).batches(5, batch_size=2, artifacts_per_container=1))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+class cachedResponse(object):
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+
+'''Responses are cached per normalised URL until their endpoint's TTL runs out'''
+def test_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(phantasm.time, 'monotonic', lambda: now[0])
+    cache = phantasm.responseCache(ttls={'container': 10})
+    response = cachedResponse()
+    cache.put('https://phantom.local/rest/container?page_size=1&sort=id', response)
+    assert cache.get('https://phantom.local/rest/container?sort=id&page_size=1') is response
+    now[0] += 11
+    assert cache.get('https://phantom.local/rest/container?sort=id&page_size=1') is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+'''Endpoints without a TTL, and responses other than 200s, are never cached'''
+def test_cache_uncached():
+    cache = phantasm.responseCache(ttls={'asset': 0})
+    cache.put('https://phantom.local/rest/playbook_run/5', cachedResponse())
+    cache.put('https://phantom.local/rest/asset/5', cachedResponse())
+    cache.put('https://phantom.local/rest/container/5', cachedResponse(404))
+    assert cache.stats()['entries'] == 0
+
+'''The least recently used response is evicted first'''
+def test_cache_eviction():
+    cache = phantasm.responseCache(max_entries=2)
+    for container_id in [1, 2]:
+        cache.put('https://phantom.local/rest/container/{}'.format(container_id), cachedResponse())
+    cache.get('https://phantom.local/rest/container/1')
+    cache.put('https://phantom.local/rest/container/3', cachedResponse())
+    assert cache.get('https://phantom.local/rest/container/1') is not None
+    assert cache.get('https://phantom.local/rest/container/2') is None
+    assert cache.stats()['evictions'] == 1
+
+'''A write drops the endpoints it may have changed, and nothing else'''
+def test_cache_invalidate():
+    cache = phantasm.responseCache()
+    for endpoint in ['container/1', 'artifact/2', 'playbook/3', 'asset/4']:
+        cache.put('https://phantom.local/rest/' + endpoint, cachedResponse())
+    cache.invalidate('https://phantom.local/rest/artifact')
+    assert cache.get('https://phantom.local/rest/container/1') is None
+    assert cache.get('https://phantom.local/rest/artifact/2') is None
+    assert cache.get('https://phantom.local/rest/playbook/3') is not None
+    assert cache.get('https://phantom.local/rest/asset/4') is not None
+
+'''A response requested before a write invalidated its endpoint is not cached'''
+def test_cache_generation():
+    cache = phantasm.responseCache()
+    generation = cache.generation('https://phantom.local/rest/container/1')
+    cache.invalidate('https://phantom.local/rest/container/1')
+    cache.put('https://phantom.local/rest/container/1', cachedResponse(), generation)
+    assert cache.get('https://phantom.local/rest/container/1') is None
+    cache.put('https://phantom.local/rest/asset/1', cachedResponse(), cache.generation('https://phantom.local/rest/asset/1'))
+    assert cache.get('https://phantom.local/rest/asset/1') is not None
+
+'''A GET in flight while a write invalidates its endpoint doesn't cache its stale response'''
+def test_cache_transport_race():
+    sent = threading.Event()
+    written = threading.Event()
+    class session(object):
+        def get(self, url, **kwargs):
+            sent.set()
+            written.wait(5)
+            return cachedResponse()
+        def post(self, url, **kwargs):
+            return cachedResponse()
+    transport = phantasm.phantomTransport(session(), cache=phantasm.responseCache(), coalesce=False)
+    reader = threading.Thread(target=transport.get, args=('https://phantom.local/rest/container/1',))
+    reader.start()
+    sent.wait(5)
+    transport.post('https://phantom.local/rest/container/1')
+    written.set()
+    reader.join()
+    assert transport.cache.stats()['entries'] == 0
+
+def coalesced_calls(flight, function, callers, timeout=None):
+    outcomes = []
+    def call():
+        try:
+            outcomes.append(flight.do('key', function, timeout))
+        except Exception as call_error:
+            outcomes.append(call_error)
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+'''Callers asking for the same key while a call is in progress share its result'''
+def test_single_flight_result():
+    flight = phantasm._singleFlight()
+    release = threading.Event()
+    made = []
+    def respond():
+        made.append(True)
+        release.wait(5)
+        return 'response'
+    threads, outcomes = coalesced_calls(flight, respond, 4)
+    while flight.calls + flight.coalesced < 4:
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert outcomes == ['response'] * 4
+    assert len(made) == 1 and flight.coalesced == 3
+    assert flight.do('key', lambda: 'again') == 'again'
+
+'''The leader's exception is raised to every caller'''
+def test_single_flight_error():
+    flight = phantasm._singleFlight()
+    release = threading.Event()
+    def fail():
+        release.wait(5)
+        raise requests.ConnectionError('refused')
+    threads, outcomes = coalesced_calls(flight, fail, 3)
+    while flight.calls + flight.coalesced < 3:
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(outcomes) == 3 and all(isinstance(outcome, requests.ConnectionError) for outcome in outcomes)
+
+'''A follower stops waiting when its own timeout runs out'''
+def test_single_flight_timeout():
+    flight = phantasm._singleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('key', lambda: release.wait(5)))
+    leader.start()
+    while not flight.calls:
+        release.wait(0.01)
+    with pytest.raises(requests.Timeout):
+        flight.do('key', lambda: None, timeout=0.05)
+    release.set()
+    leader.join()
+
+'''A read made after a write doesn't join a read of the same endpoint that started before the write'''
+def test_single_flight_read_own_write(monkeypatch):
+    state = {'status': 'new'}
+    started = threading.Event()
+    release = threading.Event()
+    def containers(url, kwargs):
+        status = state['status']
+        if not started.is_set():
+            started.set()
+            release.wait(5)
+        return 200, {'count': 1, 'data': [{'id': 1, 'status': status}]}
+    def update(url, kwargs):
+        state['status'] = kwargs['json']['status']
+        return 200, {'success': True}
+    ph, session = fake_client(monkeypatch, {('get', 'container'): containers, ('post', 'container'): update})
+    reader = threading.Thread(target=ph.get_containers)
+    reader.start()
+    started.wait(5)
+    ph.update_container_status('closed', 1)
+    assert ph.get_containers()['data'][0]['status'] == 'closed'
+    release.set()
+    reader.join()
+    assert ph.get_request_stats()['coalesced'] == 0
+    assert len(session.sent('get', 'container')) == 2
+
+NODES = ['https://phantom1.local/rest/', 'https://phantom2.local/rest/', 'https://phantom3.local/rest/']
+
+class nodeSession(object):
+    def __init__(self, down=(), error=requests.ConnectionError):
+        self.down = down
+        self.error = error
+        self.urls = []
+    def _send(self, url, **kwargs):
+        self.urls.append(url)
+        if any(url.startswith(node) for node in self.down):
+            raise self.error('{} is down'.format(url))
+        return url
+    get = post = delete = _send
+
+'''Requests built for the first node are sent to each node in turn'''
+def test_nodes_round_robin():
+    pool = phantasm.nodePool(NODES)
+    session = nodeSession()
+    for _ in range(6):
+        pool.send(session, 'get', NODES[0] + 'container/1', {})
+    assert session.urls == [node + 'container/1' for node in NODES] * 2
+    assert all(node['requests'] == 2 and node['healthy'] for node in pool.stats().values())
+
+'''The node with the fewest requests in progress is chosen'''
+def test_nodes_least_outstanding():
+    pool = phantasm.nodePool(NODES, strategy='least_outstanding')
+    busy = pool._acquire(set())
+    assert pool._acquire(set()) != busy
+    with pytest.raises(phantasm.phantomException):
+        phantasm.nodePool(NODES, strategy='random')
+
+'''A node that can't be connected to is failed over and then skipped for the cooldown'''
+def test_nodes_failover():
+    pool = phantasm.nodePool(NODES)
+    session = nodeSession(down=[NODES[0]])
+    assert pool.send(session, 'get', NODES[0] + 'container/1', {}) in [NODES[1] + 'container/1', NODES[2] + 'container/1']
+    for _ in range(4):
+        pool.send(session, 'get', NODES[0] + 'container/1', {})
+    assert [url for url in session.urls if url.startswith(NODES[0])] == [NODES[0] + 'container/1']
+    assert pool.stats()[NODES[0]] == {'requests': 1, 'failures': 1, 'outstanding': 0, 'healthy': False}
+
+'''A POST that may have reached a node is never sent again, unless the connection was never made'''
+def test_nodes_post_failover():
+    session = nodeSession(down=[NODES[0]])
+    with pytest.raises(requests.ConnectionError):
+        phantasm.nodePool(NODES).send(session, 'post', NODES[0] + 'container', {})
+    assert len(session.urls) == 1
+    session = nodeSession(down=[NODES[0]], error=requests.ConnectTimeout)
+    assert phantasm.nodePool(NODES).send(session, 'post', NODES[0] + 'container', {}) in [NODES[1] + 'container', NODES[2] + 'container']
+
+'''The error is raised once every node has failed'''
+def test_nodes_all_down():
+    session = nodeSession(down=NODES)
+    with pytest.raises(requests.ConnectionError):
+        phantasm.nodePool(NODES).send(session, 'get', NODES[0] + 'container/1', {})
+    assert sorted(session.urls) == [node + 'container/1' for node in NODES]
+
+ACTION_RUN = {
+    'count': 2,
+    'data': [
+        {'id': 10, 'message': 'first', 'result_data': [{'data': [{'status': 'open', 'key': 'J-1'}, {'status': 'closed', 'key': 'J-2'}], 'parameter': {'id': 'J-1'}}]},
+        {'id': 11, 'message': 'second', 'result_data': [{'data': [{'status': 'open', 'key': 'J-3', 'odd key': [1, 2, 3]}]}]},
+    ],
+}
+
+'''Paths select the same values from a parsed document and from its raw bytes'''
+@pytest.mark.parametrize("path,values", [
+    ('data[0].result_data[0].data[0].status', ['open']),
+    ('$.data[*].result_data[*].data[*].status', ['open', 'closed', 'open']),
+    ('data[-1].message', ['second']),
+    ('data.*.id', [10, 11]),
+    ("data[1].result_data[0].data[0]['odd key'][-1]", [3]),
+    ('data[0].result_data[0].parameter', [{'id': 'J-1'}]),
+    ('data[5].message', []),
+    ('count.missing', []),
+])
+def test_path_find(path, values):
+    compiled = phantasm.jsonPath(path)
+    assert compiled.find(ACTION_RUN) == values
+    assert compiled.find_stream(chunked(ACTION_RUN, 3)) == values
+    assert compiled.find_stream(json.dumps(ACTION_RUN).encode('utf-8')) == values
+
+'''Several paths are applied in one pass'''
+def test_path_find_all():
+    paths = {'statuses': 'data[*].result_data[*].data[*].status', 'messages': phantasm.jsonPath('data[*].message')}
+    expected = {'statuses': ['open', 'closed', 'open'], 'messages': ['first', 'second']}
+    assert phantasm.jsonPath.find_all(paths, ACTION_RUN) == expected
+    assert phantasm.jsonPath.find_all_stream(paths, chunked(ACTION_RUN, 1)) == expected
+
+'''first returns the first value selected, or the default'''
+def test_path_first():
+    assert phantasm.jsonPath('data[*].id').first(ACTION_RUN) == 10
+    assert phantasm.jsonPath('data[*].missing').first(ACTION_RUN, default='none') == 'none'
+
+'''Invalid paths are rejected when they are compiled'''
+@pytest.mark.parametrize("path", ['data[', 'data[x]', "data['unterminated]"])
+def test_path_invalid(path):
+    with pytest.raises(phantasm.phantomException):
+        phantasm.jsonPath(path)
+
+def soak_windows(count, rss=lambda window: 100e6, threads=lambda window: 4, method=lambda window: 0.1, requests_made=lambda window: 0.05):
+    return [{'resources': {'rss': rss(window), 'gc_objects': 50000, 'threads': threads(window), 'sockets': 2},
+             'methods': {'get_container': {'p50': method(window)}},
+             'requests': {'p50': requests_made(window)}} for window in range(count)]
+
+'''A steady run flags nothing, and neither does a run with too few windows'''
+def test_soak_steady():
+    assert phantasm._soak_trends(soak_windows(10)) == []
+    assert phantasm._soak_trends(soak_windows(2, rss=lambda window: 100e6 * (1 + window))) == []
+
+'''Memory and threads that keep growing are flagged as possible leaks'''
+def test_soak_leaks():
+    trends = phantasm._soak_trends(soak_windows(10, rss=lambda window: 100e6 + window * 10e6, threads=lambda window: 4 + window))
+    assert len(trends) == 2
+    assert trends[0].startswith('Client memory grew 90% over 10 windows')
+    assert trends[1] == 'Threads rose from 4 to 13 over 10 windows, a possible leak'
+
+'''Latency drift is put down to Phantom when the requests slowed as much, and to the client when they didn't'''
+@pytest.mark.parametrize("requests_made,cause", [
+    (lambda window: 0.05 + window * 0.01, 'on the Phantom side'),
+    (lambda window: 0.05, 'on the client side'),
+])
+def test_soak_latency(requests_made, cause):
+    trends = phantasm._soak_trends(soak_windows(5, method=lambda window: 0.1 + window * 0.02, requests_made=requests_made))
+    assert len(trends) == 1
+    assert trends[0].startswith('get_container p50 latency grew 80%')
+    assert trends[0].endswith(cause)
+
+'''The soak tracer keeps the duration of every span of a window, however many there are'''
+def test_soak_tracer():
+    tracer = phantasm._soakTracer()
+    for _ in range(1000):
+        tracer.record('get_container', 'method', 0, 0.5)
+        tracer.record('GET container', 'http', 0, 0.25)
+    tracer.record('sleep', 'wait', 0, 1)
+    durations = tracer.take()
+    assert sorted(durations) == ['get_container', 'requests']
+    assert durations['get_container'] == [0.5] * 1000 and durations['requests'] == [0.25] * 1000
+    assert tracer.take() == {}
+
+'''A bounded tracer counts the spans it drops'''
+def test_tracer_dropped():
+    tracer = phantasm.spanTracer(max_spans=3)
+    for _ in range(5):
+        tracer.record('get_container', 'method', 0, 1)
+    assert len(tracer.events()) == 3 and tracer.dropped == 2
+
+def listing(*records):
+    return lambda url, kwargs: (200, {'count': len(records), 'num_pages': 1, 'data': list(records)})
+
+'''With a metadata index, the last playbook run is found by the name it was run with, less its repository'''
+def test_index_playbook_information(monkeypatch):
+    handlers = {('get', kind): listing() for kind in ['asset', 'app', 'workflow_template']}
+    handlers[('get', 'playbook')] = listing({'id': 7, 'name': 'Create JIRA Ticket'}, {'id': 8, 'name': 'Close JIRA Ticket'})
+    handlers[('post', 'playbook_run')] = lambda url, kwargs: (200, {'playbook_run_id': 100})
+    handlers[('get', 'playbook_run')] = listing({'id': 100, 'playbook': 7, 'status': 'success'})
+    ph, session = fake_client(monkeypatch, handlers, prefetch=True)
+    ph.run_playbook('phantom-playbook/Create JIRA Ticket', container_id=5)
+    assert ph.get_playbook_information()['data'][0]['id'] == 100
+    assert ph.get_playbook_information('jira ticket')['data'][0]['id'] == 100
+    urls = [url for url, _ in session.sent('get', 'playbook_run')]
+    assert urls[0].endswith('_filter_playbook__in=[7]')
+    assert urls[1].endswith('_filter_playbook__in=[8,7]')
+
+def profiler_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'phantasm-profiler']
+
+'''Instances created with a profiling mode share one profiler, whose sampler only runs during profiled calls'''
+def test_profiler_shared(monkeypatch):
+    monkeypatch.setattr(phantasm, '_profilers', {})
+    handlers = {('get', 'container'): listing({'id': 1})}
+    clients = [fake_client(monkeypatch, handlers, profiler='sampling')[0] for _ in range(20)]
+    assert len(set(id(ph._profiler) for ph in clients)) == 1
+    assert list(phantasm._profilers) == [('sampling', None)]
+    for ph in clients:
+        ph.get_containers()
+    for thread in profiler_threads():
+        thread.join(1)
+    assert profiler_threads() == []
+    assert clients[0].get_profile_stats()['get_containers']['calls'] == 20
+    clients[0].get_containers()
+    assert clients[0].get_profile_stats()['get_containers']['calls'] == 21
+
+'''Single and parallel uploads both record the vault id of each file in file_id'''
+def test_upload_file_id(monkeypatch, tmp_path):
+    uploaded = iter(range(1, 10))
+    def attach(url, kwargs):
+        attachment_id = next(uploaded)
+        return 200, {'id': attachment_id, 'vault_id': 'vault{}'.format(attachment_id), 'succeeded': True}
+    ph, session = fake_client(monkeypatch, {('post', 'container_attachment'): attach})
+    for name in ['first.txt', 'second.txt']:
+        (tmp_path / name).write_bytes(name.encode('utf-8'))
+    ph.upload_file_to_phantom(str(tmp_path / 'first.txt'), container_id=5, deduplicate=False)
+    ph.upload_many([str(tmp_path / 'second.txt')], container_id=5, deduplicate=False)
+    assert ph.file_id == ['vault1', 'vault2']
+
+def vault_client(monkeypatch, attach):
+    def container_attachment(url, kwargs):
+        if 'vault_id' in kwargs['json']:
+            return attach(url, kwargs)
+        return 200, {'id': 2, 'vault_id': 'uploaded', 'succeeded': True}
+    handlers = {('post', 'container_attachment'): container_attachment}
+    handlers[('get', 'vault_document')] = lambda url, kwargs: (200, {'count': 1, 'data': [{'hash': 'existing'}]})
+    return fake_client(monkeypatch, handlers)
+
+def attached(session):
+    return [kwargs['json'] for url, kwargs in session.sent('post', 'container_attachment')]
+
+'''A file the vault already holds is attached by its vault id rather than sent again, and after that is found in the local index'''
+def test_upload_attaches_existing(monkeypatch, tmp_path):
+    ph, session = vault_client(monkeypatch, lambda url, kwargs: (200, {'id': 1, 'vault_id': kwargs['json']['vault_id'], 'succeeded': True}))
+    (tmp_path / 'sample.bin').write_bytes(b'sample')
+    ph.upload_file_to_phantom(str(tmp_path / 'sample.bin'), container_id=5)
+    ph.upload_file_to_phantom(str(tmp_path / 'sample.bin'), container_id=6)
+    assert len(session.sent('get', 'vault_document')) == 1
+    assert [post.get('vault_id') for post in attached(session)] == ['existing', 'existing']
+    assert all('file_content' not in post for post in attached(session))
+    assert ph.file_id == ['existing', 'existing']
+
+def refuse_attach(url, kwargs):
+    return 400, {'failed': True, 'message': 'vault id not found'}
+
+def drop_attach(url, kwargs):
+    raise requests.ConnectionError('connection dropped')
+
+def garbled_attach(url, kwargs):
+    return 200, b'<html>gateway error</html>'
+
+'''When attaching the existing vault entry fails in any way (refused, dropped or an answer that is not JSON), the file is uploaded instead'''
+@pytest.mark.parametrize("attach", [refuse_attach, drop_attach, garbled_attach])
+def test_upload_attach_fallback(monkeypatch, tmp_path, attach):
+    ph, session = vault_client(monkeypatch, attach)
+    (tmp_path / 'sample.bin').write_bytes(b'sample')
+    response = ph.upload_file_to_phantom(str(tmp_path / 'sample.bin'), container_id=5)
+    assert response['vault_id'] == 'uploaded'
+    assert [(post.get('vault_id'), 'file_content' in post) for post in attached(session)] == [('existing', False), (None, True)]
+    assert ph.file_id == ['uploaded']
+
+class fakeClock(object):
+    '''Stands in for time.monotonic and time.sleep, so time only passes when the client sleeps or the fake session advances it'''
+    def __init__(self, monkeypatch, now=1000.0):
+        self.now = now
+        self.slept = []
+        monkeypatch.setattr(phantasm.time, 'monotonic', lambda: self.now)
+        monkeypatch.setattr(phantasm.time, 'sleep', self.sleep)
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def request(self, kwargs, seconds=1.0):
+        # A request takes the seconds given, unless its socket timeout runs out first
+        timeout = kwargs.get('timeout')
+        if timeout is not None and timeout < seconds:
+            self.now += timeout
+            raise requests.ReadTimeout('Read timed out after {:.2f}s'.format(timeout))
+        self.now += seconds
+
+'''Deadlines nest, only ever shortening, and raise once there is no time left'''
+def test_deadline_nesting(monkeypatch):
+    clock = fakeClock(monkeypatch)
+    assert phantasm._time_left('the first request') is None
+    with phantasm.deadline(10):
+        with phantasm.deadline(60):
+            assert phantasm._time_left('the first request') == 10
+        with phantasm.deadline(4):
+            assert phantasm._time_left('the first request') == 4
+        clock.now += 10
+        with pytest.raises(phantasm.deadlineException, match='budget of 10.00s ran out before the next request'):
+            phantasm._time_left('the next request')
+    assert phantasm._time_left('the next request') is None
+
+'''A sleep that would outlast the deadline raises straight away, without sleeping'''
+def test_deadline_sleep(monkeypatch):
+    clock = fakeClock(monkeypatch)
+    with phantasm.deadline(5):
+        phantasm._deadline_sleep(2, 'the next attempt')
+        with pytest.raises(phantasm.deadlineException, match='would run out waiting 4.00s'):
+            phantasm._deadline_sleep(4, 'the next attempt')
+    assert clock.slept == [2]
+
+'''A budget that runs out while polling shortens the sleeps to fit, then raises a deadlineException'''
+def test_deadline_poll(monkeypatch):
+    clock = fakeClock(monkeypatch)
+    timeouts = []
+    def running(url, kwargs):
+        timeouts.append(kwargs.get('timeout'))
+        clock.request(kwargs)
+        return 200, {'id': 9, 'status': 'running'}
+    ph, session = fake_client(monkeypatch, {('get', 'playbook_run'): running})
+    with pytest.raises(phantasm.deadlineException):
+        ph.wait_for_playbook(9, interval=5, max_attempts=100, timeout_budget=12)
+    assert clock.now == pytest.approx(1012)
+    assert clock.slept == [5, 2.5, 0.75]
+    assert timeouts == [12, 6, 2.5, 0.75]
+    assert getattr(phantasm._deadline_state, 'deadline', None) is None
+
+'''Requests without a budget are sent without a socket timeout, and their timeouts are raised as they are'''
+def test_deadline_none(monkeypatch):
+    clock = fakeClock(monkeypatch)
+    def slow(url, kwargs):
+        clock.request(kwargs)
+        raise requests.ReadTimeout('Read timed out')
+    ph, session = fake_client(monkeypatch, {('get', 'container'): slow})
+    with pytest.raises(requests.ReadTimeout) as timeout_error:
+        ph.get_containers()
+    assert not isinstance(timeout_error.value, phantasm.deadlineException)
+    assert session.sent('get', 'container')[0][1].get('timeout') is None
+
+'''The deadline of a call is carried to the worker threads it submits work on'''
+def test_deadline_worker_threads(monkeypatch):
+    clock = fakeClock(monkeypatch)
+    ph, session = fake_client(monkeypatch, {('get', 'container'): listing({'id': 1})})
+    with phantasm.deadline(5):
+        carried = phantasm._carry_deadline(ph.get_containers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(carried).result()
+        executor.submit(ph.get_containers).result()
+        clock.now += 5
+        with pytest.raises(phantasm.deadlineException):
+            executor.submit(carried).result()
+    assert [kwargs.get('timeout') for _, kwargs in session.sent('get', 'container')] == [5, None]
+
+'''A coalesced follower without a budget isn't failed by the leader running out of its own'''
+def test_deadline_follower_without_budget(monkeypatch):
+    joined = threading.Event()
+    def containers(url, kwargs):
+        if kwargs.get('timeout') is not None:
+            joined.wait(5)
+            raise requests.ReadTimeout('Read timed out')
+        return 200, {'count': 1, 'data': [{'id': 1}]}
+    ph, session = fake_client(monkeypatch, {('get', 'container'): containers})
+    outcomes = []
+    def leader():
+        try:
+            ph.get_containers(timeout_budget=30)
+        except Exception as leader_error:
+            outcomes.append(leader_error)
+    coalesced = phantasm._single_flight.coalesced
+    thread = threading.Thread(target=leader)
+    thread.start()
+    while not session.sent('get', 'container'):
+        joined.wait(0.01)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        follower = executor.submit(ph.get_containers)
+        while phantasm._single_flight.coalesced == coalesced:
+            joined.wait(0.01)
+        joined.set()
+        assert follower.result(5)['data'] == [{'id': 1}]
+    thread.join()
+    assert isinstance(outcomes[0], requests.Timeout)
+    assert len(session.sent('get', 'container')) == 2
+
+'''A coalesced follower with a budget stops waiting on a leader without one when its budget runs out'''
+def test_deadline_follower_with_budget(monkeypatch):
+    release = threading.Event()
+    def containers(url, kwargs):
+        release.wait(5)
+        return 200, {'count': 1, 'data': [{'id': 1}]}
+    ph, session = fake_client(monkeypatch, {('get', 'container'): containers})
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(ph.get_containers)
+        while not session.sent('get', 'container'):
+            release.wait(0.01)
+        with pytest.raises(phantasm.deadlineException):
+            ph.get_containers(timeout_budget=0.1)
+        release.set()
+        assert leader.result(5)['data'] == [{'id': 1}]
+    assert len(session.sent('get', 'container')) == 1
+
+class fakeRuns(object):
+    '''Action or playbook runs on a fake Phantom, which finish after being polled a number of times. It counts the runs in progress at once, and the ids asked for by each poll.'''
+    def __init__(self, polls=2, submit_time=0, poll_status=200):
+        self.polls = polls
+        self.submit_time = submit_time
+        self.poll_status = poll_status
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.posted = []
+        self.batches = []
+        self.in_progress = 0
+        self.most_in_progress = 0
+
+    def submit(self, url, kwargs):
+        with self.lock:
+            self.posted.append(kwargs['json'])
+            run_id = len(self.posted)
+            self.runs[run_id] = 0
+            self.in_progress += 1
+            self.most_in_progress = max(self.most_in_progress, self.in_progress)
+        time.sleep(self.submit_time)
+        return 200, {'success': True, 'action_run_id': run_id, 'playbook_run_id': run_id}
+
+    def poll(self, url, kwargs):
+        ids = json.loads(dict(parse_qsl(urlsplit(url).query))['_filter_id__in'])
+        with self.lock:
+            self.batches.append(ids)
+            if self.poll_status != 200:
+                return self.poll_status, {'failed': True}
+            data = []
+            for run_id in ids:
+                self.runs[run_id] += 1
+                finished = self.runs[run_id] == self.polls
+                if finished:
+                    self.in_progress -= 1
+                data.append({'id': run_id, 'status': 'success' if self.runs[run_id] >= self.polls else 'running'})
+        return 200, {'count': len(data), 'data': data}
+
+def action_client(monkeypatch, runs):
+    handlers = {('get', 'asset'): listing({'id': 1, 'name': 'jira', 'product_name': 'Jira'}), ('get', 'app'): listing({'id': 7, 'product_name': 'Jira'})}
+    handlers[('post', 'action_run')] = runs.submit
+    handlers[('get', 'action_run')] = runs.poll
+    return fake_client(monkeypatch, handlers)
+
+'''Every action run is polled by one poller, a batch of ids per request rather than a request per run'''
+def test_fan_out_batched_polls(monkeypatch):
+    runs = fakeRuns(polls=2)
+    ph, session = action_client(monkeypatch, runs)
+    targets = [{'asset_name': 'jira', 'container_id': 5, 'parameters': [{'id': 'J-{}'.format(position)}]} for position in range(250)]
+    results = ph.run_action_many('get ticket', targets, max_workers=8, interval=0.01)
+    assert len(runs.posted) == 250
+    assert sorted(result['action_run_id'] for result in results.values()) == list(range(1, 251))
+    assert all(result['status'] == 'success' and result['action_run']['id'] == result['action_run_id'] for result in results.values())
+    assert max(len(batch) for batch in runs.batches) == 100
+    assert sum(len(batch) for batch in runs.batches) == 500
+    assert all('action_run/' not in url for url, _ in session.sent('get', 'action_run'))
+
+'''Once polling fails, the error is raised and no further runs are submitted'''
+def test_fan_out_stops_on_error(monkeypatch):
+    runs = fakeRuns(submit_time=0.02, poll_status=500)
+    ph, session = action_client(monkeypatch, runs)
+    targets = [{'asset_name': 'jira', 'container_id': 5} for _ in range(100)]
+    with pytest.raises(requests.HTTPError):
+        ph.run_action_many('get ticket', targets, max_workers=2, interval=0.01)
+    submitted = len(runs.posted)
+    time.sleep(0.2)
+    assert len(runs.posted) <= submitted + 2
+    assert len(runs.posted) < 20
+
+'''The scenario matrix never has more playbooks running than max_in_flight, and reports every combination'''
+def test_scenario_matrix_in_flight(monkeypatch, tmp_path):
+    runs = fakeRuns(polls=3, submit_time=0.01)
+    containers = iter(range(1, 100))
+    handlers = {('post', 'container'): lambda url, kwargs: (200, {'id': next(containers), 'success': True}), ('post', 'artifact'): lambda url, kwargs: (200, {'id': 1, 'success': True})}
+    handlers[('post', 'playbook_run')] = runs.submit
+    handlers[('get', 'playbook_run')] = runs.poll
+    ph, session = fake_client(monkeypatch, handlers)
+    templates = [{'name': 'container-{}'.format(position), 'artifacts': [{'cef': {'sourceAddress': '10.1.1.{}'.format(position)}}]} for position in range(4)]
+    report = ph.run_scenario_matrix(templates, ['local/a', 'local/b', 'local/c'], max_workers=6, max_in_flight=3, interval=0.01, report_file=str(tmp_path / 'report.json'))
+    assert runs.most_in_progress == 3
+    assert len(runs.posted) == 12
+    assert report['summary']['total'] == report['summary']['passed'] == 12
+    assert sorted((result['container'], result['playbook']) for result in report['results']) == sorted(('container-{}'.format(position), playbook) for position in range(4) for playbook in ['local/a', 'local/b', 'local/c'])
+    assert len(session.sent('post', 'artifact')) == 4 * 3
+    assert json.loads((tmp_path / 'report.json').read_text())['summary']['passed'] == 12
+
+class fakeFailures(object):
+    '''Containers left pending by a system failure on a fake Phantom, listed by their create_time range. A window's count can be made to fail, and listing pages can be slowed down.'''
+    def __init__(self, records, fail=None, delay=0):
+        self.records = records
+        self.fail = fail
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.windows = []
+        self.active = 0
+
+    def containers(self, url, kwargs):
+        query = dict(parse_qsl(urlsplit(url).query, keep_blank_values=True))
+        start, end = json.loads(query['_filter_create_time__range'])
+        matching = [record for record in self.records if start <= record['create_time'] <= end]
+        page, page_size = int(query['page']), int(query['page_size'])
+        if page_size == 1:
+            with self.lock:
+                self.windows.append((start, end))
+            if self.fail and self.fail(start, end):
+                return 500, {'failed': True}
+            return 200, {'count': len(matching), 'num_pages': len(matching), 'data': matching[:1]}
+        with self.lock:
+            self.active += 1
+        try:
+            time.sleep(self.delay)
+            return 200, {'count': len(matching), 'num_pages': -(-len(matching) // page_size), 'data': matching[page * page_size:(page + 1) * page_size]}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+# One container a day, but eight on the 12th, and one on the boundary of the 12th and 13th that both windows list
+FAILURES = [{'id': day, 'create_time': '2019-03-{}T06:00:00'.format(day)} for day in [11, 13, 14]]
+FAILURES += [{'id': 100 + hour, 'create_time': '2019-03-12T{:02d}:30:00'.format(hour * 3)} for hour in range(8)]
+FAILURES += [{'id': 200, 'create_time': '2019-03-13T00:00:00'}]
+
+def scanned(file_name):
+    with open(file_name) as output:
+        return [json.loads(line)['id'] for line in output if line.strip()]
+
+'''Dense windows are split until they hold few enough records, and records on a shared boundary are written once'''
+def test_scan_split(monkeypatch, tmp_path):
+    failures = fakeFailures(FAILURES)
+    ph, session = fake_client(monkeypatch, {('get', 'container'): failures.containers})
+    output_file = str(tmp_path / 'failures.ndjson')
+    summary = ph.scan_system_failures(output_file, '2019-03-11', '2019-03-15', impacted=False, max_window_records=3, page_size=2)
+    assert sorted(scanned(output_file)) == sorted(record['id'] for record in FAILURES)
+    assert summary['records'] == len(FAILURES) and summary['duplicates'] == 1
+    assert summary['splits'] == 3 and summary['windows'] == 7
+    assert ('2019-03-12T00:00:00', '2019-03-12T12:00:00') in failures.windows
+    assert not (tmp_path / 'failures.ndjson.checkpoint').exists()
+
+'''An interrupted scan resumes from its checkpoint, fetching only the windows that hadn't completed'''
+def test_scan_resume(monkeypatch, tmp_path):
+    failures = fakeFailures(FAILURES, fail=lambda start, end: start.startswith('2019-03-14'))
+    ph, session = fake_client(monkeypatch, {('get', 'container'): failures.containers})
+    output_file = str(tmp_path / 'failures.ndjson')
+    with pytest.raises(requests.HTTPError):
+        ph.scan_system_failures(output_file, '2019-03-11', '2019-03-15', impacted=False, max_window_records=3, max_workers=1)
+    checkpoint = json.loads((tmp_path / 'failures.ndjson.checkpoint').read_text())
+    assert ['2019-03-14T00:00:00', '2019-03-15T00:00:00'] in checkpoint['pending']
+    assert ['2019-03-11T00:00:00', '2019-03-12T00:00:00'] not in checkpoint['pending']
+    with pytest.raises(phantasm.phantomException, match='different scan'):
+        ph.scan_system_failures(output_file, '2019-03-11', '2019-03-16', impacted=False, max_window_records=3)
+    failures.fail = None
+    failures.windows = []
+    ph.scan_system_failures(output_file, '2019-03-11', '2019-03-15', impacted=False, max_window_records=3, max_workers=1)
+    assert sorted(scanned(output_file)) == sorted(record['id'] for record in FAILURES)
+    assert ('2019-03-11T00:00:00', '2019-03-12T00:00:00') not in failures.windows
+    assert ('2019-03-14T00:00:00', '2019-03-15T00:00:00') in failures.windows
+
+'''Once a window fails, no other window is left being fetched after the error is raised'''
+def test_scan_stops_on_error(monkeypatch, tmp_path):
+    failures = fakeFailures(FAILURES, fail=lambda start, end: start.startswith('2019-03-11'), delay=0.05)
+    ph, session = fake_client(monkeypatch, {('get', 'container'): failures.containers})
+    with pytest.raises(requests.HTTPError):
+        ph.scan_system_failures(str(tmp_path / 'failures.ndjson'), '2019-03-11', '2019-03-20', impacted=False, max_window_records=3, max_workers=2, page_size=1000)
+    sent = len(session.requests)
+    assert failures.active == 0
+    time.sleep(0.1)
+    assert len(session.requests) == sent
+
+class fakeRecovery(fakeRuns):
+    '''Containers stranded by a system failure on a fake Phantom, each listed until a playbook run is submitted on it. A submission of the unconfirmed playbook run reaches the server, but the connection drops before its response.'''
+    def __init__(self, container_ids, unconfirmed=None, **kwargs):
+        fakeRuns.__init__(self, polls=1, **kwargs)
+        self.container_ids = container_ids
+        self.unconfirmed = unconfirmed
+
+    def containers(self, url, kwargs):
+        last_id = int(dict(parse_qsl(urlsplit(url).query)).get('_filter_id__gt', 0))
+        with self.lock:
+            started = set(post['container_id'] for post in self.posted)
+        data = [{'id': container_id, 'label': 'events'} for container_id in self.container_ids if container_id > last_id and container_id not in started]
+        return 200, {'count': len(data), 'num_pages': 1, 'data': data}
+
+    def submit(self, url, kwargs):
+        status, body = fakeRuns.submit(self, url, kwargs)
+        if (kwargs['json']['container_id'], kwargs['json']['playbook_id']) == self.unconfirmed:
+            raise requests.ConnectionError('connection dropped')
+        return status, body
+
+def recovery_client(monkeypatch, runs):
+    handlers = {('get', 'container'): runs.containers, ('post', 'playbook_run'): runs.submit, ('get', 'playbook_run'): runs.poll}
+    return fake_client(monkeypatch, handlers)
+
+'''A recovery stopped partway is resumed from its journal, submitting every playbook run exactly once, including the rest of the runs on containers no longer listed'''
+def test_recover_resumes_from_journal(monkeypatch, tmp_path):
+    journal_file = str(tmp_path / 'recovery.ndjson')
+    playbooks = ['local/a', 'local/b']
+    runs = fakeRecovery(list(range(1, 11)), unconfirmed=(1, 'local/b'), submit_time=0.01, poll_status=500)
+    ph, session = recovery_client(monkeypatch, runs)
+    with pytest.raises(requests.HTTPError):
+        ph.recover_pending_playbooks(playbooks, journal_file, rate=1000, max_workers=2, interval=0.05)
+    stopped_at = len(runs.posted)
+    assert 2 <= stopped_at < 20
+
+    runs.poll_status = 200
+    recovered = ph.recover_pending_playbooks(playbooks, journal_file, rate=1000, max_workers=2, interval=0.01)
+    posted = [(post['container_id'], post['playbook_id']) for post in runs.posted]
+    assert sorted(posted) == sorted(set(posted)) == [(container_id, playbook) for container_id in range(1, 11) for playbook in playbooks]
+    assert recovered['results'][(1, 'local/b')]['status'] == 'unknown'
+    assert all(result['status'] == 'success' for key, result in recovered['results'].items() if key != (1, 'local/b'))
+    assert recovered['summary']['submitted'] == 20 - stopped_at
+
+    again = ph.recover_pending_playbooks(playbooks, journal_file, rate=1000, max_workers=2, interval=0.01)
+    assert len(runs.posted) == 20
+    assert all(result['resumed'] for result in again['results'].values())
+
+EXPORTED = [
+    {'id': 1, 'name': 'first', 'cef': {'sourceAddress': '10.0.0.1'}},
+    {'id': 2, 'cef': {'destinationAddress': '10.0.0.2', 'sourceAddress': '10.0.0.3'}, 'tags': ['a', 'b']},
+    {'id': 3, 'name': 'third', 'severity': 'high'},
+]
+
+def read_csv(file_name):
+    with open(file_name, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        return next(reader), list(reader)
+
+'''Without columns, the header is the union of the columns of every record in the order they first appear, and a row leaves the columns it lacks empty'''
+def test_export_csv_columns_union(monkeypatch, tmp_path):
+    ph, session = fake_client(monkeypatch, {})
+    file_name = str(tmp_path / 'export.csv')
+    assert ph.export_to_csv((record for record in EXPORTED), file_name) == 3
+    header, rows = read_csv(file_name)
+    assert header == ['id', 'name', 'cef.sourceAddress', 'cef.destinationAddress', 'tags', 'severity']
+    assert rows == [
+        ['1', 'first', '10.0.0.1', '', '', ''],
+        ['2', '', '10.0.0.3', '10.0.0.2', '["a", "b"]', ''],
+        ['3', 'third', '', '', '', 'high'],
+    ]
+
+'''With columns, nested fields are picked by their joined names, in the order given, and missing ones are left empty'''
+def test_export_csv_nested_columns(monkeypatch, tmp_path):
+    ph, session = fake_client(monkeypatch, {})
+    file_name = str(tmp_path / 'export.csv')
+    assert ph.export_to_csv(iter(EXPORTED), file_name, columns=['cef/sourceAddress', 'id', 'cef/missing', 'tags'], separator='/') == 3
+    header, rows = read_csv(file_name)
+    assert header == ['cef/sourceAddress', 'id', 'cef/missing', 'tags']
+    assert rows == [['10.0.0.1', '1', '', ''], ['10.0.0.3', '2', '', '["a", "b"]'], ['', '3', '', '']]
+
+'''Updates Phantom is too busy for or can't be reached for are retried, and other failures are not'''
+def test_update_containers_retries(monkeypatch):
+    answers = {1: [503, 200], 2: [400], 3: ['dropped', 200], 4: [503, 502, 500]}
+    def update(url, kwargs):
+        answer = answers[int(urlsplit(url).path.split('/')[-1])].pop(0)
+        if answer == 'dropped':
+            raise requests.ConnectionError('connection dropped')
+        if answer != 200:
+            return answer, {'failed': True, 'message': 'status {}'.format(answer)}
+        return 200, {'success': True}
+    ph, session = fake_client(monkeypatch, {('post', 'container'): update})
+    updated = ph.update_containers([1, 2, 3, 4], status='closed', retries=2, backoff=0.001)
+    assert {container_id: (outcome['updated'], outcome['attempts']) for container_id, outcome in updated['results'].items()} == {1: (True, 2), 2: (False, 1), 3: (True, 2), 4: (False, 3)}
+    assert updated['results'][4]['error'] and updated['results'][1]['error'] is None
+    assert {key: updated['summary'][key] for key in ['total', 'updated', 'failed', 'retries']} == {'total': 4, 'updated': 2, 'failed': 2, 'retries': 4}
+    assert len(session.sent('post', 'container')) == 8
+    assert all(kwargs['json'] == {'status': 'closed'} for url, kwargs in session.sent('post', 'container'))